@@ -1,29 +1,45 @@
 import os
 import argparse
 import tensorflow as tf
-from glob import glob
 from tensorflow.keras import layers, models
 
+import dataset_shards
+
 # CONFIG
 IMG_SIZE = 256
 BATCH_SIZE = 8
 EPOCHS = 30
+VAL_SPLIT = 0.2
+SEED = 42  # of the train/val file split
 AUTOTUNE = tf.data.AUTOTUNE
 
 
 def load_image_pair(img_path, heatmap_path):
+    """Decodes and resizes one pair to uint8 tensors; this is what the cache holds."""
     image = tf.io.read_file(img_path)
     image = tf.image.decode_jpeg(image, channels=3)
     image = tf.image.resize(image, [IMG_SIZE, IMG_SIZE])
-    image = tf.cast(image, tf.float32) / 255.0
+    image = tf.saturate_cast(tf.round(image), tf.uint8)
 
     heatmap = tf.io.read_file(heatmap_path)
     heatmap = tf.image.decode_png(heatmap, channels=1)
     heatmap = tf.image.resize(heatmap, [IMG_SIZE, IMG_SIZE])
-    heatmap = tf.cast(heatmap, tf.float32) / 255.0
+    heatmap = tf.saturate_cast(tf.round(heatmap), tf.uint8)
 
     return image, heatmap
 
+
+def augment_pair(image, heatmap):
+    """Random flips applied to image and heatmap together, so the attention still lines up."""
+    pair = tf.concat([image, heatmap], axis=-1)
+    pair = tf.image.random_flip_left_right(pair)
+    pair = tf.image.random_flip_up_down(pair)
+    return pair[..., :3], pair[..., 3:]
+
+
+def normalize_batch(images, heatmaps):
+    return tf.cast(images, tf.float32) / 255.0, tf.cast(heatmaps, tf.float32) / 255.0
+
 from tensorflow.keras.saving import register_keras_serializable
 
 @register_keras_serializable()
@@ -32,14 +48,41 @@ def mse_ssim_loss(y_true, y_pred):
     ssim = tf.reduce_mean(tf.image.ssim(y_true, y_pred, max_val=1.0))
     return mse - ssim  # maximize SSIM while minimizing MSE
 
-def get_dataset(image_dir, heatmap_dir):
-    image_paths = sorted(glob(os.path.join(image_dir, "*")))
-    heatmap_paths = sorted(glob(os.path.join(heatmap_dir, "*")))
+def make_split(pairs, training=False, cache_file=None):
+    """Decode -> cache -> (shuffle, augment) -> batch -> normalize.
 
+    Decoded, resized uint8 pairs are cached after the first epoch, in
+    memory or in cache_file when it is set, so later epochs read no files.
+    Shuffling and augmentation come after the cache and change every epoch.
+    """
+    image_paths = [image_path for image_path, _ in pairs]
+    heatmap_paths = [heatmap_path for _, heatmap_path in pairs]
     dataset = tf.data.Dataset.from_tensor_slices((image_paths, heatmap_paths))
-    dataset = dataset.cache()
-    dataset = dataset.map(lambda x, y: load_image_pair(x, y), num_parallel_calls=AUTOTUNE)
-    return dataset.shuffle(200).batch(BATCH_SIZE).prefetch(AUTOTUNE)
+    dataset = dataset.map(load_image_pair, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.cache(cache_file or "")
+    if training:
+        dataset = dataset.shuffle(len(pairs), reshuffle_each_iteration=True)
+        dataset = dataset.map(augment_pair, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.batch(BATCH_SIZE).map(normalize_batch, num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def get_dataset(image_dir, heatmap_dir, val_split=VAL_SPLIT, seed=SEED, cache_dir=None):
+    """Returns (train_ds, val_ds), split on a seeded shuffle of the file list so no val image is trained on.
+
+    With cache_dir set, each split is cached to a file there instead of memory.
+    """
+    pairs = dataset_shards.list_pairs(image_dir, heatmap_dir)
+    splits = dataset_shards.split_pairs(pairs, test_size=0, val_size=val_split, seed=seed)
+    print(f"Dataset: {len(splits['train'])} training, {len(splits['val'])} validation samples")
+
+    cache_files = {}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_files = {name: os.path.join(cache_dir, f"{name}-{IMG_SIZE}-{seed}") for name in ("train", "val")}
+    train_ds = make_split(splits["train"], training=True, cache_file=cache_files.get("train"))
+    val_ds = make_split(splits["val"], cache_file=cache_files.get("val"))
+    return train_ds, val_ds
 
 def build_model(input_shape=(IMG_SIZE, IMG_SIZE, 3)):
     base_model = tf.keras.applications.EfficientNetB3(
@@ -71,11 +114,12 @@ def build_model(input_shape=(IMG_SIZE, IMG_SIZE, 3)):
 
 def main(args):
     print("Preparing dataset...")
-    dataset = get_dataset(args.image_dir, args.heatmap_dir)
-    total = tf.data.experimental.cardinality(dataset).numpy()
-    train_size = int(0.8 * total)
-    train_ds = dataset.take(train_size)
-    val_ds = dataset.skip(train_size)
+    if args.shard_dir:
+        # Prebuilt by dataset_shards.py: already resized and split by file
+        train_ds = dataset_shards.shard_dataset(args.shard_dir, 'train', BATCH_SIZE, shuffle=True, color_order='rgb')
+        val_ds = dataset_shards.shard_dataset(args.shard_dir, 'val', BATCH_SIZE, color_order='rgb')
+    else:
+        train_ds, val_ds = get_dataset(args.image_dir, args.heatmap_dir, cache_dir=args.cache_dir)
 
     print("Building and training model...")
     model = build_model()
@@ -143,6 +187,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--image_dir", default="dataset/images")
     parser.add_argument("--heatmap_dir", default="dataset/heatmaps")
+    parser.add_argument("--cache_dir", help="Cache decoded images to files here instead of in memory; clear it when the dataset changes")
+    parser.add_argument("--shard_dir", help="Train on shards built by dataset_shards.py instead of image_dir/heatmap_dir")
     parser.add_argument("--model_dir", default="lesion_heatmap_model")
     parser.add_argument("--vertex_deploy", action="store_true")
     parser.add_argument("--bucket", help="GCS bucket name")
@@ -0,0 +1,274 @@
+"""One-time build of preprocessed training shards, and the tf.data reader for them.
+
+Training used to decode every JPEG/PNG (and, for GCPHeatmapModel, redo the
+LAB/CLAHE/LANCZOS preprocessing) on every run. The build step does that
+once and writes resized uint8 pairs to .npy shards that are memory-mapped
+at training time:
+
+    <output>/manifest.json
+    <output>/<split>-00000-images.npy      (N, H, W, 3) uint8
+    <output>/<split>-00000-heatmaps.npy    (N, H, W, 1) uint8
+
+The manifest records the build settings, the train/val/test split (made on
+the file list, seeded, so val/test never leak into train), each shard's
+sample count and sha256, and the sha256 of every source pair. Samples are
+written in shuffled order, so reading a shard front to back is already
+random; the reader adds shard-order shuffling, parallel interleave and a
+shuffle buffer.
+
+    python dataset_shards.py --images dataset/images --heatmaps dataset/heatmaps --output dataset/shards
+    python dataset_shards.py --output dataset/shards --verify
+
+Building needs only numpy and OpenCV; reading needs TensorFlow.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+FORMAT = 'eye-sense-shards'
+VERSION = 1
+MANIFEST = 'manifest.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+SPLITS = ('train', 'val', 'test')
+
+
+def enhance_image(image, size):
+    """LAB/CLAHE contrast enhancement and LANCZOS resize of a BGR uint8 image to size=(w, h)."""
+    # 1. Convert to LAB color space for better color normalization
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+
+    # 2. CLAHE on L channel
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    l = clahe.apply(l)
+
+    # 3. Merge back and convert to BGR
+    lab = cv2.merge([l, a, b])
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+    # 4. Resize with better quality
+    return cv2.resize(enhanced, size, interpolation=cv2.INTER_LANCZOS4)
+
+
+def list_pairs(image_dir, heatmap_dir):
+    """Sorted (image path, heatmap path) pairs for every image whose <name>_heatmap.png exists.
+
+    Raises ValueError if there are none.
+    """
+    pairs = []
+    for filename in sorted(os.listdir(image_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        heatmap_path = os.path.join(heatmap_dir, os.path.splitext(filename)[0] + '_heatmap.png')
+        if os.path.exists(heatmap_path):
+            pairs.append((os.path.join(image_dir, filename), heatmap_path))
+        else:
+            print(f"Warning: Heatmap not found for {filename} at {heatmap_path}. Skipping.")
+    if not pairs:
+        raise ValueError(f"No valid image/heatmap pairs found in {image_dir} and {heatmap_dir}.")
+    return pairs
+
+
+def split_pairs(pairs, test_size=0.2, val_size=0.1, seed=42):
+    """Seeded shuffle of the file list into {"train", "val", "test"}; val_size is a fraction of the rest."""
+    order = np.random.default_rng(seed).permutation(len(pairs))
+    shuffled = [pairs[i] for i in order]
+    n_test = int(round(len(pairs) * test_size))
+    n_val = int(round((len(pairs) - n_test) * val_size))
+    return {'test': shuffled[:n_test], 'val': shuffled[n_test:n_test + n_val], 'train': shuffled[n_test + n_val:]}
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def preprocess_pair(job):
+    """Pool task: returns (image uint8 (H, W, 3), heatmap uint8 (H, W, 1), source sha256), or None if unreadable."""
+    (image_path, heatmap_path), size, enhance = job
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    with open(heatmap_path, 'rb') as f:
+        heatmap_bytes = f.read()
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    heatmap = cv2.imdecode(np.frombuffer(heatmap_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None or heatmap is None:
+        return None
+    image = enhance_image(image, size) if enhance else cv2.resize(image, size)
+    heatmap = cv2.resize(heatmap, size)
+    source = hashlib.sha256(hashlib.sha256(image_bytes).digest() + hashlib.sha256(heatmap_bytes).digest())
+    return image, heatmap[..., None], source.hexdigest()
+
+
+def write_array(path, array):
+    """np.save via a temp file and os.replace; returns the file's sha256."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+    return sha256_file(path)
+
+
+def write_split(pool, name, pairs, output_dir, size, enhance, shard_size):
+    """Preprocesses one split in parallel and writes it shard by shard. Returns its manifest entries."""
+    width, height = size
+    shards, samples = [], []
+    images = np.empty((shard_size, height, width, 3), np.uint8)
+    heatmaps = np.empty((shard_size, height, width, 1), np.uint8)
+    count = 0
+
+    def flush():
+        index = len(shards)
+        entry = {'count': count}
+        for kind, array in (('images', images), ('heatmaps', heatmaps)):
+            filename = f'{name}-{index:05d}-{kind}.npy'
+            entry[kind] = filename
+            entry[f'{kind}_sha256'] = write_array(os.path.join(output_dir, filename), array[:count])
+        shards.append(entry)
+
+    jobs = [(pair, size, enhance) for pair in pairs]
+    for pair, result in zip(pairs, pool.imap(preprocess_pair, jobs, chunksize=8)):
+        if result is None:
+            print(f"Warning: Could not load {pair[0]} or {pair[1]}. Skipping.")
+            continue
+        images[count], heatmaps[count], source_sha256 = result
+        samples.append({'image': os.path.basename(pair[0]), 'heatmap': os.path.basename(pair[1]),
+                        'shard': len(shards), 'sha256': source_sha256})
+        count += 1
+        if count == shard_size:
+            flush()
+            count = 0
+    if count:
+        flush()
+    return shards, samples
+
+
+def build_shards(image_dir, heatmap_dir, output_dir, image_size=(256, 256), enhance=False, shard_size=512,
+                 test_size=0.2, val_size=0.1, seed=42, workers=None):
+    """Preprocesses every image/heatmap pair into shards under output_dir and writes the manifest."""
+    pairs = list_pairs(image_dir, heatmap_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    splits = split_pairs(pairs, test_size, val_size, seed)
+    manifest = {'format': FORMAT, 'version': VERSION, 'image_size': list(image_size), 'color_order': 'bgr',
+                'enhance': enhance, 'shard_size': shard_size, 'seed': seed, 'test_size': test_size,
+                'val_size': val_size, 'splits': {}, 'samples': {}}
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for name in SPLITS:
+            shards, samples = write_split(pool, name, splits[name], output_dir, tuple(image_size), enhance, shard_size)
+            manifest['splits'][name] = shards
+            manifest['samples'][name] = samples
+            print(f"{name}: {len(samples)} samples in {len(shards)} shards")
+
+    tmp_path = os.path.join(output_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST))
+    print(f"Built {sum(len(s) for s in manifest['samples'].values())} samples in {time.perf_counter() - start:.1f}s "
+          f"into {output_dir}")
+    return manifest
+
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT or manifest.get('version') != VERSION:
+        raise ValueError(f"{shard_dir} is not a version {VERSION} {FORMAT} directory; rebuild it")
+    return manifest
+
+
+def verify_shards(shard_dir):
+    """Re-hashes every shard file against the manifest. Returns the list of mismatched filenames."""
+    manifest = load_manifest(shard_dir)
+    bad = []
+    for shards in manifest['splits'].values():
+        for shard in shards:
+            for kind in ('images', 'heatmaps'):
+                path = os.path.join(shard_dir, shard[kind])
+                if not os.path.exists(path) or sha256_file(path) != shard[f'{kind}_sha256']:
+                    bad.append(shard[kind])
+    return bad
+
+
+def shard_dataset(shard_dir, split='train', batch_size=8, shuffle=False, seed=None, color_order='bgr',
+                  shuffle_buffer=256):
+    """Streams float32 (image, heatmap) batches of one split straight from the memory-mapped shards.
+
+    Shards are interleaved in parallel; with shuffle=True their order is
+    reshuffled every epoch and samples pass through a shuffle buffer. The
+    only per-sample work is the uint8 -> float32 scaling (and a channel flip
+    when color_order differs from the manifest's).
+    """
+    import tensorflow as tf
+
+    manifest = load_manifest(shard_dir)
+    shards = manifest['splits'][split]
+    if not shards:
+        raise ValueError(f"Split '{split}' of {shard_dir} is empty")
+    width, height = manifest['image_size']
+
+    def read_shard(index):
+        shard = shards[int(index)]
+        images = np.load(os.path.join(shard_dir, shard['images']), mmap_mode='r')
+        heatmaps = np.load(os.path.join(shard_dir, shard['heatmaps']), mmap_mode='r')
+        for i in range(shard['count']):
+            yield np.asarray(images[i]), np.asarray(heatmaps[i])
+
+    signature = (tf.TensorSpec((height, width, 3), tf.uint8), tf.TensorSpec((height, width, 1), tf.uint8))
+    dataset = tf.data.Dataset.range(len(shards))
+    if shuffle:
+        dataset = dataset.shuffle(len(shards), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.interleave(
+        lambda index: tf.data.Dataset.from_generator(read_shard, output_signature=signature, args=(index,)),
+        cycle_length=min(len(shards), 4), num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    flip = color_order != manifest['color_order']
+
+    def normalize(images, heatmaps):
+        if flip:
+            images = tf.reverse(images, axis=[-1])
+        return tf.cast(images, tf.float32) / 255.0, tf.cast(heatmaps, tf.float32) / 255.0
+
+    dataset = dataset.batch(batch_size).map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build preprocessed training shards from images and heatmaps')
+    parser.add_argument('--images', type=str, default='dataset/images', help='Folder of lesion images')
+    parser.add_argument('--heatmaps', type=str, default='dataset/heatmaps', help='Folder of <name>_heatmap.png files')
+    parser.add_argument('--output', type=str, default='dataset/shards', help='Folder to write shards to')
+    parser.add_argument('--size', type=int, default=256, help='Side length images and heatmaps are resized to')
+    parser.add_argument('--enhance', action='store_true', help='Apply the LAB/CLAHE/LANCZOS preprocessing')
+    parser.add_argument('--shard-size', type=int, default=512, help='Samples per shard')
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--val-size', type=float, default=0.1, help='Fraction of the non-test samples')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the train/val/test split')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--verify', action='store_true', help='Check existing shards against the manifest')
+    args = parser.parse_args()
+
+    if args.verify:
+        bad = verify_shards(args.output)
+        print(f"{len(bad)} shard files do not match the manifest" if bad else "All shards match the manifest")
+        for filename in bad:
+            print(f"  mismatch: {filename}")
+        raise SystemExit(1 if bad else 0)
+
+    build_shards(args.images, args.heatmaps, args.output, (args.size, args.size), args.enhance, args.shard_size,
+                 args.test_size, args.val_size, args.seed, args.workers)
+
+
+if __name__ == '__main__':
+    main()
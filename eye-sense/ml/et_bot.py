@@ -1,126 +1,139 @@
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-import random
+from PIL import Image
 import os
-import datetime
-
-def zoom_image(image, zoom_factor=1.2):
-    """Zoom into the center of the image by a zoom_factor."""
-    h, w = image.shape[:2]
-    new_h = int(h / zoom_factor)
-    new_w = int(w / zoom_factor)
-    top = (h - new_h) // 2
-    left = (w - new_w) // 2
-    cropped = image[top:top+new_h, left:left+new_w]
-    return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
-
-def remove_hair(image, kernel_size=17, threshold=10, inpaint_radius=1):
-    """Removes hair using black-hat filtering + inpainting."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
-    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel)
-    _, mask = cv2.threshold(blackhat, threshold, 255, cv2.THRESH_BINARY)
-    inpainted = cv2.inpaint(image, mask, inpaint_radius, cv2.INPAINT_TELEA)
-    return inpainted
-
-def load_image(filepath):
-    """Load and return BGR and grayscale image."""
-    image = cv2.imread(filepath)
-    return image, cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-def segment_lesion(gray_image):
-    """Segment the lesion using Otsu thresholding and return the largest contour."""
-    _, binary = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        raise ValueError("No contours found!")
-    return max(contours, key=cv2.contourArea)
-
-def sample_border_points(contour, num_points):
-    contour_points = contour.squeeze()
-    if len(contour_points.shape) == 1:
-        contour_points = np.expand_dims(contour_points, axis=0)
-    indices = np.random.choice(len(contour_points), num_points, replace=True)
-    return [tuple(contour_points[i]) for i in indices]
-
-def sample_internal_points(mask, num_points):
-    ys, xs = np.where(mask == 255)
-    if len(xs) == 0:
-        return []
-    indices = np.random.choice(len(xs), num_points, replace=True)
-    return list(zip(xs[indices], ys[indices]))
-
-def create_mask_from_contour(shape, contour):
-    mask = np.zeros(shape, dtype=np.uint8)
-    cv2.drawContours(mask, [contour], -1, 255, -1)
-    return mask
-
-def visualize_heatmap(image, border_points, internal_points, output_dir='dataset/heatmaps', visualize=False, sigma=30, original_filename=None):
-    h, w, _ = image.shape
-    heatmap = np.zeros((h, w), dtype=np.float32)
-
-    for x, y in border_points + internal_points:
-        if 0 <= x < w and 0 <= y < h:
-            heatmap[y, x] += 1
-
-    from scipy.ndimage import gaussian_filter
-
-    
-    heatmap_blurred = gaussian_filter(heatmap, sigma=30)
-    heatmap_blurred = np.power(heatmap_blurred, 0.7)
-
-    if np.max(heatmap_blurred) == 0:
+import sys
+import argparse
+import multiprocessing
+import time
+import zlib
+
+# Shared heatmap code lives with the Flask service in server/routes
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+from routes.render import overlay, encode_image
+from routes import pipeline, sampler
+from routes.pipeline import Pipeline
+from routes.et_bot_utils import DERMGAZE_PIPELINE
+
+def stage_load(ctx):
+    """Reads the file once: bytes for the segmentation cache, BGR pixels via cv2."""
+    with open(ctx['filepath'], 'rb') as f:
+        ctx['image_bytes'] = f.read()
+    ctx['raw'] = cv2.imdecode(np.frombuffer(ctx['image_bytes'], np.uint8), cv2.IMREAD_COLOR)
+    if ctx['raw'] is None:
+        raise ValueError(f"Could not read image {ctx['filepath']}")
+
+def stage_write(ctx):
+    # Rendered at the image's own size; the image array is written as-is
+    # (BGR from cv2.imread), the same channel order the plt.imshow path used
+    blended = overlay(ctx['image'], ctx['density'])
+
+    if ctx.get('visualize'):
+        Image.fromarray(blended).show()
         return
 
-    heatmap_normalized = heatmap_blurred / np.max(heatmap_blurred)
-
-    plt.figure(figsize=(10, 8))
-    plt.imshow(image)
-    plt.imshow(heatmap_normalized, cmap='jet', alpha=0.4)
-    plt.axis('off')
-    plt.title('Gaze Heatmap Overlay')
-
-    if visualize: 
-        plt.show()
+    output_dir = ctx.get('output_dir', 'dataset/heatmaps')
+    os.makedirs(output_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(ctx['filepath']))[0]
+    with open(f'{output_dir}/{base_name}_heatmap.png', 'wb') as f:
+        f.write(encode_image(blended, 'png').getvalue())
+
+# The bot pipeline at native resolution, reading from and writing to disk
+ET_BOT_PIPELINE = Pipeline('et_bot', DERMGAZE_PIPELINE.replace('decode', stage_load).replace('render', stage_write).stages)
+
+def simulate_derm_gaze(filepath, num_border_points=3000, num_internal_points=2000, visualize=False, seed=None, density='sampled', output_dir='dataset/heatmaps'):
+    """Runs ET_BOT_PIPELINE on one image file. Returns the per-stage timings."""
+    _, timings = ET_BOT_PIPELINE.run(
+        filepath=filepath, num_border_points=num_border_points, num_internal_points=num_internal_points,
+        visualize=visualize, seed=seed, density_method=density, output_dir=output_dir,
+        output_size=0, working_size=0, cache_namespace='et_bot')
+    return timings
+
+########################
+#  BATCH GENERATION    #
+########################
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+def output_path(filepath, output_dir):
+    """Where stage_write writes the heatmap for filepath."""
+    base_name = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(output_dir, f'{base_name}_heatmap.png')
+
+def is_up_to_date(filepath, output_dir):
+    """True if the heatmap exists and is newer than its source image."""
+    out = output_path(filepath, output_dir)
+    return os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(filepath)
+
+def init_worker():
+    # One OpenCV thread per process; the pool already uses every core
+    cv2.setNumThreads(1)
+    # Per-image JSON lines would drown the progress line; main() prints a per-stage summary
+    pipeline.PIPELINE_LOG = False
+
+def process_image(job):
+    """Pool task: renders one heatmap. Returns (filepath, seconds, stage timings, error or None)."""
+    filepath, output_dir, seed, density = job
+    start = time.perf_counter()
+    try:
+        # Per-file seed so results do not depend on which worker ran the file
+        file_seed = None if seed is None else [seed, zlib.crc32(os.path.basename(filepath).encode('utf-8'))]
+        timings = simulate_derm_gaze(filepath, seed=file_seed, density=density, output_dir=output_dir)
+        return filepath, time.perf_counter() - start, timings, None
+    except Exception as e:
+        return filepath, time.perf_counter() - start, [], str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate expert-gaze heatmaps for a folder of lesion images')
+    parser.add_argument('--input', type=str, default='dataset/images', help='Folder of lesion images')
+    parser.add_argument('--output', type=str, default='dataset/heatmaps', help='Folder to write heatmaps to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes (default: all cores)')
+    parser.add_argument('--limit', type=int, default=None, help='Process at most this many images')
+    parser.add_argument('--chunksize', type=int, default=None, help='Images per task sent to a worker (default: auto)')
+    parser.add_argument('--force', action='store_true', help='Regenerate heatmaps that are already up to date')
+    parser.add_argument('--seed', type=int, default=None, help='Make the sampled gaze points reproducible')
+    parser.add_argument('--density', choices=sampler.DENSITY_METHODS, default='sampled',
+                        help='sampled gaze points, their analytic expectation, or the lesion distance field')
+    args = parser.parse_args()
+
+    files = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+                   if f.lower().endswith(IMAGE_EXTENSIONS))
+    stale = [f for f in files if args.force or not is_up_to_date(f, args.output)]
+    todo = stale[:args.limit]
+    print(f"{len(files)} images, {len(files) - len(stale)} up to date, "
+          f"{len(todo)} to generate with {args.workers} workers")
+    if not todo:
         return
 
-    os.makedirs(output_dir, exist_ok=True)
-    
-    if original_filename:
-        base_name = os.path.splitext(original_filename)[0]
-        filename = f'{output_dir}/{base_name}_heatmap.png'
-    else:
-        filename = f'{output_dir}/heatmap_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.jpg'
-    
-    plt.savefig(filename, bbox_inches='tight', pad_inches=0)
-    plt.close()
-
-def simulate_derm_gaze(filepath, num_border_points=3000, num_internal_points=2000, visualize=False):
-    # Load and zoom
-    raw_image, _ = load_image(filepath)
-    image = zoom_image(raw_image)
-    
-    # Hair removal
-    cleaned = remove_hair(image)
-
-    # Grayscale after cleanup
-    gray = cv2.cvtColor(cleaned, cv2.COLOR_BGR2GRAY)
-
-    # Segmentation
-    contour = segment_lesion(gray)
-    mask = create_mask_from_contour(gray.shape, contour)
-
-    # Sampling
-    border_points = sample_border_points(contour, num_border_points)
-    internal_points = sample_internal_points(mask, num_internal_points)
-
-    # Heatmap
-    visualize_heatmap(image, border_points, internal_points, original_filename=os.path.basename(filepath), visualize=visualize)
-
-# Process all images in folder
-files = sorted(os.listdir('dataset/images'))
-for file in files:
-    simulate_derm_gaze(f'dataset/images/{file}')
+    os.makedirs(args.output, exist_ok=True)
+    # A few chunks per worker keeps every core busy without per-image IPC overhead
+    chunksize = args.chunksize or max(1, len(todo) // (args.workers * 4))
+    jobs = [(f, args.output, args.seed, args.density) for f in todo]
+    failures = []
+    stage_ms = {}
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers, initializer=init_worker) as pool:
+        for done, (filepath, seconds, timings, error) in enumerate(pool.imap_unordered(process_image, jobs, chunksize), 1):
+            if error:
+                failures.append((filepath, error))
+            for t in timings:
+                if not t['skipped']:
+                    stage_ms.setdefault(t['stage'], []).append(t['ms'])
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed
+            print(f"\r[{done}/{len(todo)}] {rate:.1f} img/s, "
+                  f"eta {(len(todo) - done) / rate:.0f}s, {len(failures)} failed", end='', flush=True)
+    print()
+
+    elapsed = time.perf_counter() - start
+    print(f"Generated {len(todo) - len(failures)} heatmaps in {elapsed:.1f}s "
+          f"({len(todo) / elapsed:.1f} img/s)")
+    for stage, ms in stage_ms.items():
+        print(f"  {stage:<12} {len(ms):>6} runs  mean {sum(ms) / len(ms):8.1f} ms  max {max(ms):8.1f} ms")
+    for filepath, error in failures:
+        print(f"  failed: {filepath}: {error}")
+
+if __name__ == '__main__':
+    main()
 
 # simulate_derm_gaze('lesion.jpg', visualize=True)
@@ -3,14 +3,14 @@ import tempfile
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras import layers, models
-from sklearn.model_selection import train_test_split
 import matplotlib.pyplot as plt
 import cv2
 from google.cloud import storage
 from pathlib import Path
-from tqdm import tqdm
 import time
 
+import dataset_shards
+
 class GCPHeatmapModel:
     def __init__(self, bucket_name=None, model_dir='ml/models', image_size=(256, 256)):
         self.bucket_name = bucket_name
@@ -25,77 +25,88 @@ class GCPHeatmapModel:
         """Create necessary directories if they don't exist."""
         os.makedirs(self.model_dir, exist_ok=True)
     
-    def build_dataset(self, image_dir, heatmap_dir, test_size=0.2):
-        """Build training dataset from directories of images and heatmaps."""
-        X = []
-        y = []
-        
-        image_filenames = sorted([f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        
+    def enhance_image(self, image):
+        """LAB/CLAHE contrast enhancement and LANCZOS resize of a BGR uint8 image."""
+        return dataset_shards.enhance_image(image, self.image_size)
+
+    def load_pair(self, image_path, heatmap_path, enhance=False):
+        """Graph-side decode of one pair into uint8 tensors: (H, W, 3) BGR image, (H, W, 1) heatmap."""
+        width, height = self.image_size
+        image = tf.io.decode_image(tf.io.read_file(image_path), channels=3, expand_animations=False)
+        # Models here are trained (and served) on OpenCV's BGR channel order
+        image = tf.reverse(image, axis=[-1])
+        if enhance:
+            image = tf.numpy_function(self.enhance_image, [image], tf.uint8)
+        else:
+            image = tf.image.resize(image, [height, width])
+            image = tf.saturate_cast(tf.round(image), tf.uint8)
+        image = tf.ensure_shape(image, [height, width, 3])
+
+        heatmap = tf.io.decode_image(tf.io.read_file(heatmap_path), channels=1, expand_animations=False)
+        heatmap = tf.saturate_cast(tf.round(tf.image.resize(heatmap, [height, width])), tf.uint8)
+        return image, tf.ensure_shape(heatmap, [height, width, 1])
+
+    @staticmethod
+    def normalize_batch(images, heatmaps):
+        """uint8 -> float32 in [0, 1], one batch at a time inside the tf.data graph."""
+        return tf.cast(images, tf.float32) / 255.0, tf.cast(heatmaps, tf.float32) / 255.0
+
+    def make_dataset(self, pairs, batch_size=8, shuffle=False, enhance=False, seed=None):
+        """Streams (image, heatmap) float32 batches from a list of file pairs.
+
+        Files are shuffled by name (every epoch when shuffle=True) and decoded
+        in parallel; samples stay uint8 until normalize_batch, so memory use
+        does not grow with the dataset.
+        """
+        image_paths = [image_path for image_path, _ in pairs]
+        heatmap_paths = [heatmap_path for _, heatmap_path in pairs]
+        dataset = tf.data.Dataset.from_tensor_slices((image_paths, heatmap_paths))
+        if shuffle:
+            dataset = dataset.shuffle(len(pairs), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.map(lambda image_path, heatmap_path: self.load_pair(image_path, heatmap_path, enhance),
+                              num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(self.normalize_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def build_dataset(self, image_dir, heatmap_dir, test_size=0.2, validation_split=0.1, batch_size=8,
+                      enhance=True, seed=42):
+        """Builds streaming train/validation/test datasets from directories of images and heatmaps.
+
+        The split is made on the file list, so no sample is loaded up front.
+        Returns (train_dataset, val_dataset, test_dataset); val_dataset is None
+        when validation_split is 0.
+        """
         print(f"Building dataset from: {image_dir} and {heatmap_dir}")
-        
-        for img_filename in tqdm(image_filenames, desc="Loading Dataset"):
-            base_name = os.path.splitext(img_filename)[0]
-            heatmap_filename = base_name + '_heatmap.png'
-            
-            img_path = os.path.join(image_dir, img_filename)
-            heatmap_path = os.path.join(heatmap_dir, heatmap_filename)
-            
-            if not os.path.exists(heatmap_path):
-                print(f"Warning: Heatmap not found for {img_filename} at {heatmap_path}. Skipping.")
-                continue
-            
-            # Load image
-            image = cv2.imread(img_path)
-            if image is None:
-                print(f"Warning: Could not load image {img_path}. Skipping.")
-                continue
-            
-            # Enhanced preprocessing
-            # 1. Convert to LAB color space for better color normalization
-            lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            
-            # 2. CLAHE on L channel
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            l = clahe.apply(l)
-            
-            # 3. Merge back and convert to BGR
-            lab = cv2.merge([l, a, b])
-            enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-            
-            # 4. Resize with better quality
-            image_resized = cv2.resize(enhanced, self.image_size, interpolation=cv2.INTER_LANCZOS4)
-            
-            # Load and process heatmap
-            heatmap = cv2.imread(heatmap_path, cv2.IMREAD_GRAYSCALE)
-            if heatmap is None:
-                print(f"Warning: Could not load heatmap {heatmap_path}. Skipping.")
-                continue
-            
-            heatmap_resized = cv2.resize(heatmap, self.image_size)
-            
-            # Normalize image and heatmap
-            image_normalized = image_resized / 255.0
-            heatmap_normalized = heatmap_resized / 255.0
-            
-            X.append(image_normalized)
-            y.append(np.expand_dims(heatmap_normalized, axis=-1))
-        
-        if not X:
-            raise ValueError(f"No valid image/heatmap pairs found in {image_dir} and {heatmap_dir}.")
-        
-        X = np.array(X)
-        y = np.array(y)
-        
-        # Split with stratification if possible
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=42
-        )
-        
-        print(f"Dataset loaded: {len(X_train)} training samples, {len(X_test)} test samples")
-        return X_train, X_test, y_train, y_test
-    
+        pairs = dataset_shards.list_pairs(image_dir, heatmap_dir)
+        splits = dataset_shards.split_pairs(pairs, test_size, validation_split, seed)
+        train_pairs, val_pairs, test_pairs = splits['train'], splits['val'], splits['test']
+
+        print(f"Dataset: {len(train_pairs)} training, {len(val_pairs)} validation, {len(test_pairs)} test samples")
+        train_dataset = self.make_dataset(train_pairs, batch_size, shuffle=True, enhance=enhance, seed=seed)
+        val_dataset = self.make_dataset(val_pairs, batch_size, enhance=enhance) if val_pairs else None
+        test_dataset = self.make_dataset(test_pairs, batch_size, enhance=enhance)
+        return train_dataset, val_dataset, test_dataset
+
+    def build_shard_dataset(self, shard_dir, batch_size=8, seed=42):
+        """Train/validation/test datasets read from shards built by dataset_shards.py.
+
+        The shards already hold resized (and, if built with --enhance,
+        CLAHE-enhanced) uint8 pairs split by file, so no image is decoded or
+        preprocessed during training. Returns (train_dataset, val_dataset,
+        test_dataset); val_dataset is None when the val split is empty.
+        """
+        manifest = dataset_shards.load_manifest(shard_dir)
+        if tuple(manifest['image_size']) != tuple(self.image_size):
+            raise ValueError(f"Shards in {shard_dir} are {manifest['image_size']}, model expects {list(self.image_size)}")
+        counts = {name: len(samples) for name, samples in manifest['samples'].items()}
+        print(f"Dataset: {counts['train']} training, {counts['val']} validation, {counts['test']} test samples "
+              f"from {shard_dir}")
+        train_dataset = dataset_shards.shard_dataset(shard_dir, 'train', batch_size, shuffle=True, seed=seed)
+        val_dataset = dataset_shards.shard_dataset(shard_dir, 'val', batch_size) if counts['val'] else None
+        test_dataset = dataset_shards.shard_dataset(shard_dir, 'test', batch_size)
+        return train_dataset, val_dataset, test_dataset
+
     def build_model(self):
         """Build an enhanced U-Net with attention and residual connections."""
         input_shape = (*self.image_size, 3)
@@ -213,8 +224,11 @@ class GCPHeatmapModel:
         
         return model
     
-    def train_model(self, X_train, y_train, validation_split=0.1, epochs=50, batch_size=8):
-        """Train with improved augmentation and learning rate scheduling."""
+    def train_model(self, train_dataset, val_dataset=None, epochs=50):
+        """Train with improved augmentation and learning rate scheduling.
+
+        train_dataset and val_dataset are batched datasets from make_dataset.
+        """
         model = self.build_model()
         
         # Advanced data augmentation
@@ -269,39 +283,40 @@ class GCPHeatmapModel:
             image = data_augmentation(image)
             return image, label
         
-        train_dataset = tf.data.Dataset.from_tensor_slices((X_train, y_train))
-        train_dataset = train_dataset.shuffle(1000)
         train_dataset = train_dataset.map(augment_data, num_parallel_calls=tf.data.AUTOTUNE)
-        train_dataset = train_dataset.batch(batch_size)
         train_dataset = train_dataset.prefetch(tf.data.AUTOTUNE)
         
         # Train the model
         history = model.fit(
             train_dataset,
-            validation_split=validation_split,
+            validation_data=val_dataset,
             epochs=epochs,
             callbacks=callbacks
         )
         
         return model, history
     
-    def evaluate_model(self, model, X_test, y_test):
-        """Evaluate model with detailed metrics and visualization."""
-        # Get predictions
-        y_pred = model.predict(X_test)
-        
+    def evaluate_model(self, model, test_dataset, num_samples=5):
+        """Evaluate model with detailed metrics and visualization.
+
+        Streams test_dataset once for the metrics; only the num_samples
+        visualized samples are held in memory. Returns (metrics, their predictions).
+        """
         # Calculate metrics
-        metrics = {
-            'loss': model.evaluate(X_test, y_test)[0],
-            'accuracy': model.evaluate(X_test, y_test)[1],
-            'iou': model.evaluate(X_test, y_test)[2],
-            'recall': model.evaluate(X_test, y_test)[3],
-            'precision': model.evaluate(X_test, y_test)[4]
-        }
+        values = model.evaluate(test_dataset)
+        metrics = dict(zip(['loss', 'accuracy', 'iou', 'recall', 'precision'], values))
+        
+        # Get predictions for the samples to show
+        X_test, y_test = [], []
+        for image, heatmap in test_dataset.unbatch().take(num_samples):
+            X_test.append(image.numpy())
+            y_test.append(heatmap.numpy())
+        X_test, y_test = np.array(X_test), np.array(y_test)
+        y_pred = model.predict(X_test, verbose=0)
         
         # Visualize results
-        num_samples = min(5, len(X_test))  # Show up to 5 samples
-        fig, axes = plt.subplots(num_samples, 3, figsize=(15, 5 * num_samples))
+        num_samples = len(X_test)
+        fig, axes = plt.subplots(num_samples, 3, figsize=(15, 5 * num_samples), squeeze=False)
         
         for i in range(num_samples):
             # Original image
@@ -424,72 +439,26 @@ class GCPHeatmapModel:
             print(f"Error during prediction: {str(e)}")
             raise
 
-    def run_training_pipeline(self, image_dir='ml/dataset/images', heatmap_dir='ml/dataset/heatmaps', test_size=0.2, epochs=50, batch_size=8):
-        """Run the training pipeline using existing images and heatmaps."""
-        print(f"Loading dataset from {image_dir} and {heatmap_dir}...")
-        
-        # Load and preprocess images and heatmaps
-        X = []
-        y = []
-        
-        # Get all image files
-        image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        
-        for img_file in tqdm(image_files, desc="Loading dataset"):
-            # Get corresponding heatmap filename
-            base_name = os.path.splitext(img_file)[0]
-            heatmap_file = f"{base_name}_heatmap.png"
-            
-            if not os.path.exists(os.path.join(heatmap_dir, heatmap_file)):
-                print(f"Warning: No matching heatmap found for {img_file}")
-                continue
-            
-            # Load and preprocess image
-            img_path = os.path.join(image_dir, img_file)
-            image = cv2.imread(img_path)
-            if image is None:
-                print(f"Warning: Could not load image {img_path}")
-                continue
-            
-            # Resize and normalize image
-            image = cv2.resize(image, self.image_size)
-            image = image / 255.0
-            
-            # Load and preprocess heatmap
-            heatmap_path = os.path.join(heatmap_dir, heatmap_file)
-            heatmap = cv2.imread(heatmap_path, cv2.IMREAD_GRAYSCALE)
-            if heatmap is None:
-                print(f"Warning: Could not load heatmap {heatmap_path}")
-                continue
-            
-            # Resize and normalize heatmap
-            heatmap = cv2.resize(heatmap, self.image_size)
-            heatmap = heatmap / 255.0
-            heatmap = np.expand_dims(heatmap, axis=-1)
-            
-            X.append(image)
-            y.append(heatmap)
-        
-        if not X:
-            raise ValueError("No valid image/heatmap pairs found in the dataset")
-        
-        X = np.array(X)
-        y = np.array(y)
-        
-        # Split dataset
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=test_size, random_state=42
-        )
-        
-        print(f"Dataset loaded: {len(X_train)} training samples, {len(X_test)} test samples")
+    def run_training_pipeline(self, image_dir='ml/dataset/images', heatmap_dir='ml/dataset/heatmaps', test_size=0.2, epochs=50, batch_size=8,
+                              shard_dir=None):
+        """Run the training pipeline using existing images and heatmaps, or prebuilt shards if shard_dir is set."""
+        if shard_dir:
+            print(f"Loading dataset shards from {shard_dir}...")
+            train_dataset, val_dataset, test_dataset = self.build_shard_dataset(shard_dir, batch_size=batch_size)
+        else:
+            print(f"Loading dataset from {image_dir} and {heatmap_dir}...")
+            # Stream images and heatmaps from disk, split by file
+            train_dataset, val_dataset, test_dataset = self.build_dataset(
+                image_dir, heatmap_dir, test_size=test_size, batch_size=batch_size, enhance=False
+            )
         
         # Train model
         print("Training model...")
-        model, history = self.train_model(X_train, y_train, epochs=epochs, batch_size=batch_size)
+        model, history = self.train_model(train_dataset, val_dataset, epochs=epochs)
         
         # Evaluate model
         print("Evaluating model...")
-        metrics, y_pred = self.evaluate_model(model, X_test, y_test)
+        metrics, y_pred = self.evaluate_model(model, test_dataset)
         
         print("Training pipeline completed.")
         return model, history, metrics, y_pred
@@ -497,6 +466,7 @@ class GCPHeatmapModel:
 if __name__ == "__main__":
     print("This script defines the GCPHeatmapModel class.")
     print("To preprocess data, run: python ml/et_bot.py --input-dir <...> --output-dir <...>")
+    print("To build training shards, run: python ml/dataset_shards.py --images <...> --heatmaps <...> --output <...>")
     print("To train the model, use the 'train' mode in run_eye_sense_model.sh")
     print("To predict, use the 'predict' mode in run_eye_sense_model.sh")
     
@@ -1,10 +1,18 @@
-from google.cloud import storage
 from PIL import Image
 from io import BytesIO
-import matplotlib.pyplot as plt
 import cv2
 import numpy as np
-import random
+import os
+import sys
+import json
+
+# Shared heatmap code lives with the Flask service in server/routes
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+from routes.density import density_map
+from routes.render import render_heatmap
+from routes import gcs, sampler
+from routes.image_cache import get_image_cache
+from routes.transfer import BulkTransfer, WORKERS, iter_blobs, with_retry
 
 # if you haven't already made a GCP key, follow these instructions and rename the key file to 'gcp_cred.json'
 # Go to GCP Console --> Service Accounts --> Keys --> Add Key --> Create New Key --> JSON
@@ -14,9 +22,7 @@ import random
 ##################
 
 def upload_image(bucket_name:str, blob_name: str, path: str):
-    client = storage.Client.from_service_account_json('gcp_cred.json')
-
-    bucket = client.get_bucket(bucket_name)
+    bucket = gcs.get_bucket(bucket_name, 'gcp_cred.json')
     blob = bucket.blob(blob_name)
     blob.upload_from_filename(path)
 
@@ -25,21 +31,17 @@ def upload_image(bucket_name:str, blob_name: str, path: str):
 
 # passes a buffer assumed to be an image
 def upload_buf(bucket_name:str, blob_name: str, buf, file_type: str = "image/jpg"):
-    client = storage.Client.from_service_account_json('gcp_cred.json')
-
-    bucket = client.get_bucket(bucket_name)
+    bucket = gcs.get_bucket(bucket_name, 'gcp_cred.json')
     blob = bucket.blob(blob_name)
-    blob.upload_from_file(buf, content_type=file_type)
+    data = buf.read()
+    with_retry(lambda: blob.upload_from_string(data, content_type=file_type))
 
     #returns a public url
     return blob.public_url
 
 def download_image(bucket_name: str, blob_name: str):
-    client = storage.Client.from_service_account_json('gcp_cred.json')
-
-    bucket = client.get_bucket(bucket_name)
-    blob = bucket.get_blob(blob_name)
-    img = Image.open(BytesIO(blob.download_as_bytes()))
+    bucket = gcs.get_bucket(bucket_name, 'gcp_cred.json')
+    img = Image.open(BytesIO(get_image_cache().get(bucket, blob_name)))
 
     return img
 
@@ -65,25 +67,13 @@ def segment_lesion(gray_image, threshold_value=100):
     largest_contour = max(contours, key=cv2.contourArea)
     return largest_contour
 
-def sample_border_points(contour, num_points):
+def sample_border_points(contour, num_points, rng=None):
     """Sample random points along the contour (border)."""
-    contour_points = contour.squeeze()
-    if len(contour_points.shape) == 1:  # Handle rare case of a single point
-        contour_points = np.expand_dims(contour_points, axis=0)
-    sampled_points = []
-    for _ in range(num_points):
-        idx = random.randint(0, len(contour_points) - 1)
-        sampled_points.append(tuple(contour_points[idx]))
-    return sampled_points
-
-def sample_internal_points(mask, num_points):
+    return sampler.sample_border_points(contour, num_points, rng)
+
+def sample_internal_points(mask, num_points, rng=None):
     """Sample random points inside the lesion mask."""
-    ys, xs = np.where(mask == 255)
-    sampled_points = []
-    for _ in range(num_points):
-        idx = random.randint(0, len(xs) - 1)
-        sampled_points.append((xs[idx], ys[idx]))
-    return sampled_points
+    return sampler.sample_internal_points(mask, num_points, rng)
 
 def create_mask_from_contour(shape, contour):
     """Create a filled mask from the contour."""
@@ -94,35 +84,11 @@ def create_mask_from_contour(shape, contour):
 def visualize_heatmap(image, border_points, internal_points, blob_name="test.jpg"):
     img_height, img_width, _ = image.shape
 
-    # --- Create heatmap matrix ---
-    heatmap = np.zeros((img_height, img_width))  # Note: image size is (width, height), but numpy is (rows, cols)
-
-    # Draw each gaze point into heatmap
-    for x, y in border_points + internal_points:
-        if 0 <= x < img_width and 0 <= y < img_height:
-            heatmap[y, x] += 1  # y is row, x is column
-
-    # --- Blur heatmap using Gaussian filter ---
-    from scipy.ndimage import gaussian_filter
-    heatmap_blurred = gaussian_filter(heatmap, sigma=30)
-
-    # --- Normalize to [0, 1] ---
-    heatmap_normalized = heatmap_blurred / np.max(heatmap_blurred)
-
-    # --- Plot the image and overlay the heatmap ---
-    plt.figure(figsize=(10, 8))
-    plt.imshow(image)  # Background image
-    plt.imshow(heatmap_normalized, cmap='jet', alpha=0.4)  # Heatmap overlay
-    plt.axis('off')
-    plt.title('Gaze Heatmap Overlay')
-    plt.tight_layout()
-    # plt.show()
+    # --- Bin, blur (sigma=30) and normalize gaze points to [0, 1] ---
+    heatmap_normalized = density_map(np.concatenate([border_points, internal_points]), img_width, img_height, sigma=30)
 
-    # Save the overlay
-    buf = BytesIO()
-    plt.savefig(buf, format='jpg')
-    buf.seek(0)
-    plt.close()
+    # --- Overlay the heatmap at the image's own size and encode as JPEG ---
+    buf = render_heatmap(image, heatmap_normalized, fmt="jpeg")
 
     return upload_buf("eye-sense-heatmap-data", blob_name, buf)
     
@@ -139,44 +105,68 @@ def simulate_derm_gaze(blobpath, num_border_points=20, num_internal_points=10):
 
     # visualize_points(image, contour, border_points, internal_points)
     visualize_heatmap(image, border_points, internal_points)
-    plt.show()
 
 # simulate_derm_gaze("ISIC-images/ISIC_0000003.jpg")
 
-# use to iterate through bucket
-def processImages(bucket_name: str, folder = ""):
-    client = storage.Client.from_service_account_json('gcp_cred.json')
+# Experience levels (point counts, blur) live in a data file so new levels need no code change
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experience_profiles.json')
 
-    bucket = client.get_bucket(bucket_name)
-    blobs = bucket.list_blobs(max_results = 4, prefix = folder)
-    
-    for blob in blobs:
-        for i in range(3): # used to do different levels of experience
-            match i:
-                case 0:
-                    experience_level = "novice"
-                    num_border_points = 100
-                    num_internal_points = 200
-                case 1:
-                    experience_level = "med_student"
-                    num_border_points = 150
-                    num_internal_points = 150
-                case _:
-                    experience_level = "dermatologist"
-                    num_border_points = 250
-                    num_internal_points = 50
-            
-            
-            img = Image.open(BytesIO(blob.download_as_bytes()))
-            image, gray = load_image(img)
-            contour = segment_lesion(gray)
-            mask = create_mask_from_contour(gray.shape, contour)
-
-            border_points = sample_border_points(contour, num_border_points)
-            internal_points = sample_internal_points(mask, num_internal_points)
-            print(visualize_heatmap(image, border_points, internal_points, blob.name[:-4] + "_"     + experience_level + ".jpg"))
-
-processImages('eye-sense-image-data', folder = 'ISIC-images/')
+def load_profiles(path=PROFILES_PATH):
+    """Returns the list of {name, num_border_points, num_internal_points, sigma[, density]} profiles."""
+    with open(path) as f:
+        return json.load(f)['profiles']
+
+def generate_profile_heatmaps(image, gray, profiles, rng=None, density='sampled'):
+    """Segments the lesion once and renders one JPEG heatmap per profile.
+
+    density is a sampler.DENSITY_METHODS name; a profile's own "density" key wins.
+    Returns a list of (profile name, rewound BytesIO).
+    """
+    contour = segment_lesion(gray)
+    mask = create_mask_from_contour(gray.shape, contour)
+    rng = sampler.get_rng(rng)
+    heatmaps = []
+    for profile in profiles:
+        heatmap_normalized = sampler.lesion_density(contour, mask, profile['num_border_points'],
+                                                    profile['num_internal_points'],
+                                                    sigma=profile.get('sigma', 30), rng=rng,
+                                                    method=profile.get('density', density))
+        heatmaps.append((profile['name'], render_heatmap(image, heatmap_normalized, fmt="jpeg")))
+    return heatmaps
+
+# use to iterate through bucket
+def processImages(bucket_name: str, folder = "", profiles=None, max_results=None, workers=WORKERS, seed=None,
+                  output_bucket="eye-sense-heatmap-data", density='sampled'):
+    """Renders every experience profile for each image, decoding and segmenting it once.
+
+    Downloads run ahead and uploads run behind on a bounded BulkTransfer
+    pool; the listing streams page by page. max_results=None processes the
+    whole folder. density="distance" skips sampling and blurring entirely.
+    """
+    profiles = profiles or load_profiles()
+    bucket = gcs.get_bucket(bucket_name, 'gcp_cred.json')
+    heatmap_bucket = gcs.get_bucket(output_bucket, 'gcp_cred.json')
+    rng = sampler.get_rng(seed)
+
+    with BulkTransfer(workers) as transfer:
+        for blob, data in transfer.download_all(iter_blobs(bucket, folder, limit=max_results)):
+            try:
+                image, gray = load_image(Image.open(BytesIO(data)))
+                heatmaps = generate_profile_heatmaps(image, gray, profiles, rng, density)
+            except Exception as e:
+                transfer.stats.fail(blob.name, e)
+                continue
+            for experience_level, buf in heatmaps:
+                blob_name = blob.name[:-4] + "_" + experience_level + ".jpg"
+                transfer.upload(heatmap_bucket, blob_name, buf, content_type="image/jpg")
+
+    print(transfer.stats.summary())
+    for blob_name, error in transfer.stats.failed:
+        print(f"  failed: {blob_name}: {error}")
+    return transfer.stats
+
+if __name__ == '__main__':
+    processImages('eye-sense-image-data', folder = 'ISIC-images/')
 
 
 
@@ -1,11 +1,19 @@
+import multiprocessing
+
 from flask import Flask
 from routes.heatmap import api_heatmap
+from routes.inference import api_inference, preload_model
 from flask_cors import CORS
 
 app = Flask(__name__)
 app.register_blueprint(api_heatmap, url_prefix="/api/v1/heatmaps")
+app.register_blueprint(api_inference, url_prefix="/api/v1/inference")
 CORS(app)
 
+# Spawned bot job workers re-import this module; only the serving process loads the model
+if multiprocessing.current_process().name == "MainProcess":
+    preload_model()
+
 
 if __name__ == "__main__":
     app.run(host='localhost', debug=True)
\ No newline at end of file
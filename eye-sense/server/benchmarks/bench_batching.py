@@ -0,0 +1,85 @@
+"""Benchmark micro-batched predictions against one forward pass per request.
+
+Starts --clients threads that each send --requests predictions through a
+PredictionBatcher over the warm predictor, once with INFERENCE_MAX_BATCH=1
+(no batching) and once per requested max batch size, and reports throughput,
+latency percentiles and the batch-size histogram.
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_batching.py --model ../ml/models/gcp_heatmap_predictor
+    python benchmarks/bench_batching.py --demo --clients 16 --max-batch 4 8 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes.batcher import MAX_WAIT_MS, PredictionBatcher
+from routes.predictor import COLOR_ORDER, INPUT_SIZE, MODEL_PATH, HeatmapPredictor, tf
+from bench_inference import DEFAULT_IMAGE, save_demo_model
+
+
+def run_clients(batcher, prepared, clients, requests):
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        mine = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            batcher.predict(prepared)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched heatmap predictions")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--input-size", type=int, default=INPUT_SIZE)
+    parser.add_argument("--color-order", default=COLOR_ORDER)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent request threads")
+    parser.add_argument("--requests", type=int, default=10, help="Requests per client")
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--demo", action="store_true", help="Benchmark an untrained GCPHeatmapModel network")
+    args = parser.parse_args()
+    if tf is None:
+        sys.exit("TensorFlow is not installed")
+
+    image = np.asarray(Image.open(args.image).convert('RGB'))
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = save_demo_model(tmp, args.input_size) if args.demo else args.model
+        predictor = HeatmapPredictor(model_path, args.input_size, args.color_order).load()
+        predictor.warm_up(max(args.max_batch))
+        prepared = predictor.prepare(image)
+
+        total = args.clients * args.requests
+        print(f"{args.clients} clients x {args.requests} requests, max wait {args.max_wait_ms:g} ms")
+        print(f"{'max batch':>9} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'mean batch':>11}")
+        for max_batch in [1] + args.max_batch:
+            batcher = PredictionBatcher(predictor.predict_batch, max_batch, args.max_wait_ms, max_queue=total)
+            elapsed, latencies = run_clients(batcher, prepared, args.clients, args.requests)
+            sizes = batcher.stats()['batch_size']
+            print(f"{max_batch:>9} {total / elapsed:>8.1f} {np.percentile(latencies, 50):>9.1f} "
+                  f"{np.percentile(latencies, 95):>9.1f} {sizes['mean']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the shared density engine against the original per-point loop.
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_density.py
+    python benchmarks/bench_density.py --points 10000 100000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes.density import BLUR_BACKENDS, accumulate_points, blur, normalize
+
+
+def legacy_heatmap(points, width, height, sigma):
+    """The original generate_heatmap code path (float64, Python loop)."""
+    points = [(int(x), int(y)) for x, y in points if 0 <= x < width and 0 <= y < height]
+    heatmap = np.zeros((height, width))
+    for x, y in points:
+        heatmap[y, x] += 1
+    heatmap_blurred = gaussian_filter(heatmap, sigma=sigma)
+    return heatmap_blurred / np.max(heatmap_blurred)
+
+
+def engine_heatmap(points, width, height, sigma, backend):
+    return normalize(blur(accumulate_points(points, width, height), sigma, backend))
+
+
+def fake_gaze(n, width, height, rng):
+    """Clustered fixations with a little out-of-bounds noise, like WebGazer output."""
+    centers = rng.uniform((0, 0), (width, height), size=(12, 2))
+    pts = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 60, size=(n, 2))
+    return pts
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark heatmap density backends")
+    parser.add_argument("--points", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--sigma", type=float, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="Skip the slow original loop")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"grid {args.width}x{args.height}, sigma={args.sigma}, best of {args.repeat}")
+    print(f"{'points':>10} {'backend':>10} {'time (ms)':>10} {'speedup':>8} {'max err':>9}")
+
+    for n in args.points:
+        pts = fake_gaze(n, args.width, args.height, rng)
+        reference = None
+        legacy_time = None
+        if not args.skip_legacy:
+            legacy_list = [tuple(p) for p in pts]
+            legacy_time, reference = timeit(
+                lambda: legacy_heatmap(legacy_list, args.width, args.height, args.sigma), 1)
+            print(f"{n:>10} {'legacy':>10} {legacy_time * 1000:>10.1f} {'1.0x':>8} {'-':>9}")
+
+        for backend in BLUR_BACKENDS:
+            elapsed, result = timeit(
+                lambda: engine_heatmap(pts, args.width, args.height, args.sigma, backend), args.repeat)
+            speedup = f"{legacy_time / elapsed:.1f}x" if legacy_time else "-"
+            err = f"{np.abs(result - reference).max():.4f}" if reference is not None else "-"
+            print(f"{n:>10} {backend:>10} {elapsed * 1000:>10.1f} {speedup:>8} {err:>9}")
+
+
+if __name__ == "__main__":
+    main()
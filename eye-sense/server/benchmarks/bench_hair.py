@@ -0,0 +1,90 @@
+"""Benchmark multi-resolution hair removal against the full-resolution original.
+
+Runs every image in ml/dataset/images (optionally upscaled to mimic large
+dermoscopy uploads) through remove_hair at scale 1.0 and at each requested
+scale, and reports runtime and SSIM against the full-resolution output.
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_hair.py
+    python benchmarks/bench_hair.py --upscale 2.7 --scales 0.5 0.25 auto --limit 10
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes.hair import remove_hair
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml', 'dataset', 'images')
+
+
+def ssim(a, b):
+    """Mean SSIM of the grayscale images (Gaussian window, sigma 1.5)."""
+    a = cv2.cvtColor(a, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    window = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = window(a), window(b)
+    var_a = window(a * a) - mu_a * mu_a
+    var_b = window(b * b) - mu_b * mu_b
+    cov = window(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def parse_scale(value):
+    return value if value == 'auto' else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-resolution hair removal")
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--scales", type=parse_scale, nargs="+", default=[0.5, 0.25, 'auto'])
+    parser.add_argument("--upscale", type=float, default=1.0, help="Resize inputs first, e.g. 2.7 for ~4k px")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.images, '*')))[:args.limit]
+    totals = {scale: [0.0, []] for scale in [1.0] + args.scales}
+    for path in files:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        if args.upscale != 1.0:
+            image = cv2.resize(image, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_LINEAR)
+        elapsed, reference = timeit(lambda: remove_hair(image, scale=1.0), args.repeat)
+        totals[1.0][0] += elapsed
+        for scale in args.scales:
+            elapsed, result = timeit(lambda: remove_hair(image, scale=scale), args.repeat)
+            totals[scale][0] += elapsed
+            totals[scale][1].append(ssim(reference, result))
+
+    size = f"{image.shape[1]}x{image.shape[0]}" if files else "-"
+    print(f"{len(files)} images, last {size}, best of {args.repeat}")
+    print(f"{'scale':>6} {'total (s)':>10} {'speedup':>8} {'mean SSIM':>10} {'min SSIM':>9}")
+    base = totals[1.0][0]
+    for scale, (elapsed, scores) in totals.items():
+        mean_ssim = f"{np.mean(scores):.4f}" if scores else "1.0000"
+        min_ssim = f"{np.min(scores):.4f}" if scores else "1.0000"
+        print(f"{str(scale):>6} {elapsed:>10.2f} {base / elapsed:>7.1f}x {mean_ssim:>10} {min_ssim:>9}")
+
+
+if __name__ == "__main__":
+    main()
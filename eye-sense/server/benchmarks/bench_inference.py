@@ -0,0 +1,90 @@
+"""Benchmark per-request model loading against the resident warm predictor.
+
+cold   what run_prediction.predict_on_image does for every request:
+       tf.keras.models.load_model, then model.predict on a batch of one
+warm   routes.predictor.HeatmapPredictor: loaded and warmed once, then one
+       traced forward pass per request
+
+Without a trained model, --demo saves an untrained GCPHeatmapModel network
+to a temporary directory and benchmarks that (same architecture, same cost).
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_inference.py --model ../ml/models/gcp_heatmap_predictor
+    python benchmarks/bench_inference.py --demo --requests 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes.predictor import COLOR_ORDER, INPUT_SIZE, MODEL_PATH, HeatmapPredictor, tf
+
+ML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml')
+DEFAULT_IMAGE = os.path.join(ML_DIR, 'lesion.jpg')
+
+
+def save_demo_model(directory, input_size):
+    sys.path.append(ML_DIR)
+    from gcp_heatmap_model import GCPHeatmapModel
+    model = GCPHeatmapModel(model_dir=directory, image_size=(input_size, input_size)).build_model()
+    path = os.path.join(directory, 'demo_heatmap_predictor.keras')
+    model.save(path)
+    return path
+
+
+def percentiles(seconds):
+    ms = np.array(seconds) * 1000
+    return f"mean {ms.mean():8.1f} ms  p50 {np.percentile(ms, 50):8.1f} ms  p95 {np.percentile(ms, 95):8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold vs warm heatmap model inference")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--input-size", type=int, default=INPUT_SIZE)
+    parser.add_argument("--color-order", default=COLOR_ORDER)
+    parser.add_argument("--requests", type=int, default=20, help="Warm requests to time")
+    parser.add_argument("--cold-requests", type=int, default=3, help="Cold requests to time (each reloads)")
+    parser.add_argument("--demo", action="store_true", help="Benchmark an untrained GCPHeatmapModel network")
+    args = parser.parse_args()
+    if tf is None:
+        sys.exit("TensorFlow is not installed")
+
+    image = np.asarray(Image.open(args.image).convert('RGB'))
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = save_demo_model(tmp, args.input_size) if args.demo else args.model
+
+        predictor = HeatmapPredictor(model_path, args.input_size, args.color_order)
+        batch = predictor.prepare(image)[None]
+
+        cold = []
+        for _ in range(args.cold_requests):
+            start = time.perf_counter()
+            model = tf.keras.models.load_model(model_path, compile=False)
+            model.predict(batch, verbose=0)
+            cold.append(time.perf_counter() - start)
+            del model
+            tf.keras.backend.clear_session()
+
+        predictor.load().warm_up()
+        warm = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            predictor.predict(image)
+            warm.append(time.perf_counter() - start)
+
+    print(f"model {model_path}, input {args.input_size}px")
+    print(f"startup: load {predictor.load_seconds:.2f}s, warm-up {predictor.warmup_seconds:.2f}s (paid once)")
+    print(f"cold x{len(cold):<4} {percentiles(cold)}")
+    print(f"warm x{len(warm):<4} {percentiles(warm)}")
+    print(f"speedup per request: {np.mean(cold) / np.mean(warm):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark DLmodel input-pipeline epoch times.
+
+paths    the old get_dataset: .cache() on the path tensors, so every epoch
+         re-reads and re-decodes every JPEG/PNG
+memory   DLmodel.get_dataset: decoded, resized pairs cached in memory
+file     DLmodel.get_dataset(cache_dir=...): the same, cached to a file
+shards   dataset_shards.shard_dataset over --shards, if given
+
+Each pipeline's training split is iterated for --epochs epochs without a
+model, so the times are pure input cost. Epoch 1 fills the caches; the
+later epochs show what training pays per epoch.
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_input_pipeline.py --epochs 5
+    python benchmarks/bench_input_pipeline.py --shards ../ml/dataset/shards
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes.predictor import tf
+
+ML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml')
+
+
+def path_cached_dataset(DLmodel, image_dir, heatmap_dir):
+    """The pre-fix pipeline, kept here only for comparison."""
+    from glob import glob
+    image_paths = sorted(glob(os.path.join(image_dir, "*")))
+    heatmap_paths = sorted(glob(os.path.join(heatmap_dir, "*")))
+    dataset = tf.data.Dataset.from_tensor_slices((image_paths, heatmap_paths))
+    dataset = dataset.cache()
+    dataset = dataset.map(DLmodel.load_image_pair, num_parallel_calls=DLmodel.AUTOTUNE)
+    dataset = dataset.map(DLmodel.normalize_batch, num_parallel_calls=DLmodel.AUTOTUNE)
+    dataset = dataset.shuffle(200).batch(DLmodel.BATCH_SIZE).prefetch(DLmodel.AUTOTUNE)
+    # main() trained on the first 80% of the batches
+    return dataset.take(int(0.8 * tf.data.experimental.cardinality(dataset).numpy()))
+
+
+def epoch_times(dataset, epochs):
+    times = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        for _ in dataset:
+            pass
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DLmodel input-pipeline epoch times")
+    parser.add_argument("--images", default=os.path.join(ML_DIR, 'dataset', 'images'))
+    parser.add_argument("--heatmaps", default=os.path.join(ML_DIR, 'dataset', 'heatmaps'))
+    parser.add_argument("--shards", help="Shard directory built by ml/dataset_shards.py")
+    parser.add_argument("--epochs", type=int, default=5)
+    args = parser.parse_args()
+    if tf is None:
+        sys.exit("TensorFlow is not installed")
+
+    sys.path.append(ML_DIR)
+    import DLmodel
+    import dataset_shards
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pipelines = {
+            'paths': lambda: path_cached_dataset(DLmodel, args.images, args.heatmaps),
+            'memory': lambda: DLmodel.get_dataset(args.images, args.heatmaps)[0],
+            'file': lambda: DLmodel.get_dataset(args.images, args.heatmaps, cache_dir=tmp)[0],
+        }
+        if args.shards:
+            pipelines['shards'] = lambda: dataset_shards.shard_dataset(
+                args.shards, 'train', DLmodel.BATCH_SIZE, shuffle=True, color_order='rgb')
+
+        print(f"{'pipeline':>8} {'epoch 1 (s)':>12} {'later epochs (s)':>17}")
+        for name, make in pipelines.items():
+            times = epoch_times(make(), args.epochs)
+            later = f"{np.mean(times[1:]):>17.3f}" if len(times) > 1 else f"{'-':>17}"
+            print(f"{name:>8} {times[0]:>12.3f} {later}")
+
+
+if __name__ == "__main__":
+    main()
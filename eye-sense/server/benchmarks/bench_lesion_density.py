@@ -0,0 +1,99 @@
+"""Benchmark the bot's lesion density methods on the bundled dataset.
+
+Segments every image in ml/dataset/images the way the bot does (zoom, hair
+removal, Otsu), then times each sampler.DENSITY_METHODS entry for every
+experience profile and reports its correlation with the analytic density
+(the noise-free expectation of the sampled one). "legacy" is the original
+full-resolution scipy Gaussian over the sampled histogram.
+
+Run from eye-sense/server:
+
+    python benchmarks/bench_lesion_density.py
+    python benchmarks/bench_lesion_density.py --working-size 0 --limit 10
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from routes import sampler
+from routes.density import accumulate_points, normalize
+from routes.et_bot_utils import create_mask_from_contour, fit_long_side, remove_hair, segment_lesion, zoom_image
+
+ML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml')
+DEFAULT_IMAGES = os.path.join(ML_DIR, 'dataset', 'images')
+DEFAULT_PROFILES = os.path.join(ML_DIR, 'experience_profiles.json')
+
+
+def legacy_density(contour, mask, num_border, num_internal, sigma, rng):
+    height, width = mask.shape
+    grid = accumulate_points(sampler.sample_points(contour, mask, num_border, num_internal, rng), width, height)
+    return normalize(gaussian_filter(grid.astype(np.float64), sigma=sigma).astype(np.float32), 0.7)
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lesion density methods")
+    parser.add_argument("--images", default=DEFAULT_IMAGES)
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES)
+    parser.add_argument("--working-size", type=int, default=1024, help="Long side to segment at; 0 = native")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-legacy", action="store_true", help="Skip the slow full-resolution baseline")
+    args = parser.parse_args()
+
+    with open(args.profiles) as f:
+        profiles = json.load(f)['profiles']
+    methods = (() if args.no_legacy else ('legacy',)) + sampler.DENSITY_METHODS
+    elapsed = {method: 0.0 for method in methods}
+    corr = {method: [] for method in methods}
+    files = sorted(glob.glob(os.path.join(args.images, '*')))[:args.limit]
+    runs = 0
+    for path in files:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        image = fit_long_side(zoom_image(image), args.working_size)[0]
+        contour = segment_lesion(cv2.cvtColor(remove_hair(image), cv2.COLOR_BGR2GRAY))
+        mask = create_mask_from_contour(image.shape[:2], contour)
+        for profile in profiles:
+            counts = (contour, mask, profile['num_border_points'], profile['num_internal_points'])
+            sigma = profile.get('sigma', 30)
+            results = {}
+            for method in methods:
+                if method == 'legacy':
+                    fn = lambda: legacy_density(*counts, sigma, np.random.default_rng(0))
+                else:
+                    fn = lambda: sampler.lesion_density(*counts, sigma=sigma, gamma=0.7, rng=0, method=method)
+                seconds, results[method] = timeit(fn, args.repeat)
+                elapsed[method] += seconds
+            for method in methods:
+                corr[method].append(np.corrcoef(results['analytic'].ravel(), results[method].ravel())[0, 1])
+            runs += 1
+
+    size = f"{image.shape[1]}x{image.shape[0]}" if files else "-"
+    print(f"{len(files)} images x {len(profiles)} profiles, last {size}, best of {args.repeat}")
+    print(f"{'method':>9} {'mean (ms)':>10} {'corr vs analytic':>17} {'min corr':>9}")
+    for method in methods:
+        print(f"{method:>9} {elapsed[method] / runs * 1000:>10.1f} {np.mean(corr[method]):>17.3f} "
+              f"{np.min(corr[method]):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
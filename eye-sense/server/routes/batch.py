@@ -0,0 +1,172 @@
+"""Batch rendering of many gaze heatmaps in one request.
+
+Survey owners viewing results used to send one POST per response, each
+re-downloading and re-decoding the image. A batch resolves every distinct
+blob once, decodes/resizes every distinct (blob, width, height) once, and
+then renders the items on a shared thread pool (NumPy, SciPy, OpenCV and
+Pillow release the GIL for the heavy parts). Items already in the result
+cache are returned without rendering.
+"""
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from . import gaze_codec, render, result_cache
+from .density import density_map
+from .image_cache import get_image_cache
+from .pixel_cache import get_pixel_cache
+from .result_cache import get_result_cache
+
+WORKERS = int(os.getenv('HEATMAP_BATCH_WORKERS', str(os.cpu_count() or 4)))
+MAX_ITEMS = int(os.getenv('HEATMAP_BATCH_MAX_ITEMS', '200'))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide render pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="heatmap-batch")
+    return _pool
+
+
+class BatchItem:
+    """One requested heatmap and, once rendered, its bytes or error."""
+
+    def __init__(self, index, spec):
+        self.index = index
+        self.error = None
+        if not isinstance(spec, dict):
+            spec, self.error = {}, "Item must be an object"
+        self.filename = spec.get('filename')
+        self.output_format = spec.get('format', 'png')
+        self.gaze_payload = spec.get('gazeDataStr')
+        self.generation = None
+        self.key = None
+        self.image_bytes = None
+        try:
+            self.width, self.height = render.display_size(spec.get('width'), spec.get('height'))
+        except ValueError as e:
+            self.width = self.height = None
+            size_error = str(e)
+        else:
+            size_error = None
+        if self.error is not None:
+            pass
+        elif not isinstance(self.filename, str) or not self.filename:
+            self.error = "Missing filename"
+        elif size_error is not None:
+            self.error = size_error
+        elif not isinstance(self.gaze_payload, str):
+            self.error = "Missing gazeDataStr"
+        elif not isinstance(self.output_format, str) or self.output_format not in render.FORMATS:
+            self.error = f"Unsupported format '{self.output_format}'"
+
+    @property
+    def name(self):
+        base = os.path.splitext(os.path.basename(self.filename or 'heatmap'))[0]
+        return f"{self.index:04d}_{base}.{self.output_format}"
+
+    def manifest(self):
+        entry = {"index": self.index, "filename": self.filename, "width": self.width, "height": self.height}
+        if self.error:
+            entry["error"] = self.error
+        else:
+            entry["file"] = self.name
+            entry["etag"] = result_cache.etag_for(self.key)
+        return entry
+
+
+def render_batch(bucket, specs, sigma, alpha):
+    """Renders every spec, sharing blob lookups, decodes and the worker pool.
+
+    Per-item problems, expected or not, are recorded on the item instead of
+    failing the batch.
+    """
+    items = [BatchItem(i, spec) for i, spec in enumerate(specs)]
+    pool = get_pool()
+    valid = [item for item in items if item.error is None]
+
+    # One generation check per distinct blob
+    def check_generation(name):
+        try:
+            return get_image_cache().current_generation(bucket, name)
+        except Exception as e:
+            return e
+
+    filenames = sorted({item.filename for item in valid})
+    generations = dict(zip(filenames, pool.map(check_generation, filenames)))
+
+    results = get_result_cache()
+    to_render = []
+    for item in valid:
+        checked = generations[item.filename]
+        if isinstance(checked, Exception):
+            item.error = f"Could not look up '{item.filename}': {checked}"
+            continue
+        exists, item.generation = checked
+        if not exists:
+            item.error = f"File '{item.filename}' not found in bucket"
+            continue
+        params = {"sigma": sigma, "alpha": alpha, "format": item.output_format}
+        item.key = result_cache.digest(item.filename, item.generation, item.width, item.height,
+                                       item.gaze_payload, params)
+        item.image_bytes = results.get(item.key)
+        if item.image_bytes is None:
+            to_render.append(item)
+
+    # One decode + resize per distinct (blob, width, height)
+    def load_pixels(size_key):
+        try:
+            return get_pixel_cache().get(bucket, *size_key)
+        except Exception as e:
+            return e
+
+    size_keys = sorted({(item.filename, item.width, item.height) for item in to_render})
+    pixels = dict(zip(size_keys, pool.map(load_pixels, size_keys)))
+
+    def render_item(item):
+        img = pixels[(item.filename, item.width, item.height)]
+        if isinstance(img, Exception) or img is None:
+            item.error = f"Could not open image: {img}" if img is not None else "Image not found"
+            return
+        try:
+            points = gaze_codec.decode_json(item.gaze_payload)
+        except Exception as e:
+            item.error = f"Invalid gaze data: {e}"
+            return
+        try:
+            heatmap_normalized = density_map(points, item.width, item.height, sigma=sigma)
+            item.image_bytes = render.render_heatmap(img, heatmap_normalized, fmt=item.output_format,
+                                                     alpha=alpha).getvalue()
+        except Exception as e:
+            item.image_bytes = None
+            item.error = f"Could not render heatmap: {e}"
+            return
+        results.put(item.key, item.image_bytes)
+
+    list(pool.map(render_item, to_render))
+    return items
+
+
+def zip_batch(items):
+    """Packs rendered items plus a manifest.json into a rewound BytesIO zip.
+
+    Images are already compressed, so entries are stored rather than deflated.
+    """
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for item in items:
+            if item.error is None:
+                zf.writestr(item.name, item.image_bytes)
+        zf.writestr("manifest.json", json.dumps({"items": [item.manifest() for item in items]}, indent=2),
+                    compress_type=zipfile.ZIP_DEFLATED)
+    buf.seek(0)
+    return buf
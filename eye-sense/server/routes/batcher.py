@@ -0,0 +1,132 @@
+"""Dynamic micro-batching for heatmap model predictions.
+
+Concurrent /predict requests each used to run their own forward pass on a
+batch of one, leaving most of the encoder's throughput unused. Requests now
+hand their prepared input to a PredictionBatcher. A single worker thread
+takes the first waiting input, keeps collecting for up to
+INFERENCE_MAX_WAIT_MS or until INFERENCE_MAX_BATCH inputs have arrived, runs
+one batched forward pass and hands every caller its own slice.
+
+At most INFERENCE_MAX_QUEUE inputs may wait; beyond that submit raises
+QueueFullError. Batch sizes and queue waits are kept as histograms.
+INFERENCE_MAX_BATCH=1 turns batching off.
+"""
+import bisect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .predictor import get_predictor
+
+MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '8'))
+MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '10'))
+MAX_QUEUE = int(os.getenv('INFERENCE_MAX_QUEUE', '256'))
+
+# Upper bounds (ms) of the queue-wait histogram buckets; the last bucket is open-ended
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when INFERENCE_MAX_QUEUE inputs are already waiting for a batch."""
+
+
+class Histogram:
+    """Thread-safe bucketed counts plus the running sum of observed values."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += value
+
+    def snapshot(self):
+        """{"buckets": {"<=bound": count, ..., ">last": count}, "count", "mean"}."""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.total
+        labels = [f"<={bound:g}" for bound in self.bounds] + [f">{self.bounds[-1]:g}"]
+        n = sum(counts)
+        return {'buckets': dict(zip(labels, counts)), 'count': n, 'mean': total / n if n else 0.0}
+
+
+class PredictionBatcher:
+    """Collects prepared inputs from many threads into batched predict_batch calls."""
+
+    def __init__(self, predict_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, max_queue=MAX_QUEUE):
+        self.predict_batch = predict_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        # Batch sizes are exact: one bucket per size
+        self.batch_sizes = Histogram(range(1, self.max_batch + 1))
+        self.queue_wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self._worker = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, prepared):
+        """Queues one prepared input. Returns a Future of its heatmap."""
+        future = Future()
+        try:
+            self._queue.put_nowait((prepared, future, time.perf_counter()))
+        except queue.Full:
+            raise QueueFullError(f"{self._queue.maxsize} predictions are already waiting")
+        return future
+
+    def predict(self, prepared):
+        """Blocks until the batch holding this input has run; returns its heatmap."""
+        return self.submit(prepared).result()
+
+    def _collect(self):
+        """Blocks for the first input, then gathers more until the batch is full or max_wait passes."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, _, queued_at in batch:
+                self.queue_wait_ms.observe((started - queued_at) * 1000)
+            try:
+                heatmaps = self.predict_batch(np.stack([prepared for prepared, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(heatmaps[i])
+
+    def stats(self):
+        return {'max_batch': self.max_batch, 'max_wait_ms': self.max_wait * 1000, 'queued': self._queue.qsize(),
+                'batch_size': self.batch_sizes.snapshot(), 'queue_wait_ms': self.queue_wait_ms.snapshot()}
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Returns the process-wide PredictionBatcher over the warm predictor (see get_predictor)."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = PredictionBatcher(get_predictor().predict_batch)
+    return _batcher
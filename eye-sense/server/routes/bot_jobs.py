@@ -0,0 +1,176 @@
+"""Background job queue for the expert-gaze bot.
+
+The bot pipeline (zoom, hair inpainting, segmentation, sampling, render)
+takes seconds per image, which used to tie up a request worker for the whole
+run. Jobs are submitted here instead and run on a local process pool; the
+client polls (or long-polls) for the result.
+
+- Jobs are keyed by the sha256 of the image bytes plus the pipeline params,
+  so re-submitting an identical upload returns the existing job.
+- At most BOT_JOB_MAX_PENDING jobs may be queued or running; beyond that
+  submit raises QueueFullError and the route answers 503 + Retry-After.
+- Finished jobs (and their PNG) are kept for BOT_JOB_TTL_SECONDS and evicted
+  lazily on the next queue access.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .et_bot_utils import run_dermgaze_bot
+
+WORKERS = int(os.getenv('BOT_JOB_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+MAX_PENDING = int(os.getenv('BOT_JOB_MAX_PENDING', '32'))
+TTL_SECONDS = float(os.getenv('BOT_JOB_TTL_SECONDS', '600'))
+MAX_WAIT_SECONDS = float(os.getenv('BOT_JOB_MAX_WAIT_SECONDS', '30'))
+# spawn keeps workers independent of the server's threads and locks
+START_METHOD = os.getenv('BOT_JOB_START_METHOD', 'spawn')
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFullError(RuntimeError):
+    """Raised when BOT_JOB_MAX_PENDING jobs are already queued or running."""
+
+
+def job_id_for(image_bytes, params):
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    h.update(b'\0')
+    h.update(image_bytes)
+    return h.hexdigest()
+
+
+class BotJob:
+    """One submitted image and the future running it."""
+
+    def __init__(self, job_id, future):
+        self.id = job_id
+        self.future = future
+        self.submitted_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return RUNNING if self.future.running() else QUEUED
+        return FAILED if self.future.exception() is not None else DONE
+
+    def result(self):
+        """Returns the PNG bytes of a finished job."""
+        return self.future.result()[0]
+
+    def timings(self):
+        """Per-stage pipeline timings of a finished job."""
+        return self.future.result()[1]
+
+    def describe(self):
+        status = self.status
+        entry = {"jobId": self.id, "status": status,
+                 "ageSeconds": round(time.monotonic() - self.submitted_at, 3)}
+        if status == FAILED:
+            entry["error"] = str(self.future.exception())
+        return entry
+
+
+class BotJobQueue:
+    """Bounded, deduplicating front of a ProcessPoolExecutor."""
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING, ttl_seconds=TTL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.counters = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self._run_seconds = 0.0
+
+    def _get_pool(self):
+        """Caller holds the lock."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context(START_METHOD))
+        return self._pool
+
+    def _evict_finished(self):
+        """Caller holds the lock."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _pending(self):
+        """Caller holds the lock."""
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def _on_done(self, job, future):
+        with self._lock:
+            job.finished_at = time.monotonic()
+            self._run_seconds += job.finished_at - job.submitted_at
+            self.counters['failed' if future.exception() is not None else 'completed'] += 1
+
+    def submit(self, image_bytes, **params):
+        """Queues the bot pipeline for image_bytes. Returns (job, created).
+
+        An identical upload that is pending or finished successfully returns
+        the existing job; a failed one is retried.
+        """
+        job_id = job_id_for(image_bytes, params)
+        with self._lock:
+            self._evict_finished()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != FAILED:
+                self.counters['deduplicated'] += 1
+                return job, False
+            if self._pending() >= self.max_pending:
+                self.counters['rejected'] += 1
+                raise QueueFullError(f"Bot queue is full ({self.max_pending} jobs pending)")
+            try:
+                future = self._get_pool().submit(run_dermgaze_bot, image_bytes, **params)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge upload); start a fresh pool
+                self._pool = None
+                future = self._get_pool().submit(run_dermgaze_bot, image_bytes, **params)
+            job = BotJob(job_id, future)
+            self._jobs[job_id] = job
+            self.counters['submitted'] += 1
+        future.add_done_callback(lambda f: self._on_done(job, f))
+        return job, True
+
+    def get(self, job_id, wait_seconds=0):
+        """Returns the job (or None), waiting up to wait_seconds for it to finish."""
+        with self._lock:
+            self._evict_finished()
+            job = self._jobs.get(job_id)
+        if job is not None and wait_seconds > 0:
+            wait([job.future], timeout=min(wait_seconds, MAX_WAIT_SECONDS))
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            counters = dict(self.counters)
+            finished = counters['completed'] + counters['failed']
+            mean_seconds = self._run_seconds / finished if finished else 0.0
+        return {**counters, 'queued': statuses.count(QUEUED), 'running': statuses.count(RUNNING),
+                'retained': len(statuses), 'workers': self.workers, 'max_pending': self.max_pending,
+                'mean_turnaround_seconds': round(mean_seconds, 3)}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_bot_queue():
+    """Returns the process-wide BotJobQueue; its worker pool starts on first submit."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = BotJobQueue()
+    return _queue
@@ -0,0 +1,199 @@
+"""Persisted cohort (aggregate) gaze grids for a survey question.
+
+Every response to a question is binned into a running per-group count grid
+as it arrives, so a combined heatmap over thousands of respondents costs
+one blur and one render instead of thousands. Grids live at a fixed
+canonical resolution (long side COHORT_GRID_SIZE, aspect ratio taken from
+the first response) and points are rescaled from each respondent's display
+size into it. Each response contributes a total weight of 1, so long
+sessions do not drown out short ones.
+
+State is persisted under COHORT_DIR/<sha1(cohort id)>/:
+
+    meta.json       filename, grid size, groups
+    <group>.npy     float32 running grid for that respondent group
+    <group>.ids     response ids counted in that group, one per line
+
+Response ids are appended to their group's .ids file, so recording one costs
+the same however many responses the cohort already has; meta.json is only
+rewritten when a new group appears.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from .density import accumulate_points, as_point_array
+
+COHORT_DIR = os.getenv('COHORT_DIR', 'cohorts')
+GRID_SIZE = int(os.getenv('COHORT_GRID_SIZE', '512'))
+DEFAULT_GROUP = 'all'
+
+_GROUP_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class CohortError(ValueError):
+    """Raised for a request that does not fit the cohort (bad group, other image)."""
+
+
+def valid_group(group):
+    return isinstance(group, str) and _GROUP_RE.match(group) is not None
+
+
+def valid_response_id(response_id):
+    return isinstance(response_id, str) and 0 < len(response_id) <= 256 and response_id.isprintable()
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class Cohort:
+    """Running grids for one cohort id, loaded from and saved to disk."""
+
+    def __init__(self, cohort_id, root=COHORT_DIR):
+        self.cohort_id = cohort_id
+        self.dir = os.path.join(root, hashlib.sha1(cohort_id.encode('utf-8')).hexdigest())
+        self.lock = threading.Lock()
+        self.meta = {'cohortId': cohort_id, 'filename': None, 'gridWidth': None, 'gridHeight': None,
+                     'groups': []}
+        self.grids = {}
+        self.counts = {}
+        # Every counted response id, for O(1) repeat checks
+        self.response_ids = set()
+        meta_path = os.path.join(self.dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            if 'responses' in self.meta:
+                self._migrate()
+            for group in self.meta['groups']:
+                self.grids[group] = np.load(os.path.join(self.dir, f"{group}.npy"))
+                ids = self._read_ids(group)
+                self.counts[group] = len(ids)
+                self.response_ids.update(ids)
+
+    @property
+    def grid_shape(self):
+        return self.meta['gridHeight'], self.meta['gridWidth']
+
+    def _init_grid_size(self, width, height):
+        scale = GRID_SIZE / max(width, height)
+        self.meta['gridWidth'] = max(1, round(width * scale))
+        self.meta['gridHeight'] = max(1, round(height * scale))
+
+    def _ids_path(self, group):
+        return os.path.join(self.dir, f"{group}.ids")
+
+    def _read_ids(self, group):
+        if not os.path.exists(self._ids_path(group)):
+            return []
+        with open(self._ids_path(group), encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    def _save_meta(self):
+        _write_atomic(os.path.join(self.dir, 'meta.json'), lambda f: f.write(json.dumps(self.meta).encode('utf-8')))
+
+    def _migrate(self):
+        """Moves the response id lists of an older meta.json into .ids files."""
+        responses = self.meta.pop('responses')
+        for group, ids in responses.items():
+            _write_atomic(self._ids_path(group), lambda f: f.write(''.join(f"{rid}\n" for rid in ids).encode('utf-8')))
+        self.meta['groups'] = list(responses)
+        self._save_meta()
+
+    def _save(self, group, response_id):
+        os.makedirs(self.dir, exist_ok=True)
+        _write_atomic(os.path.join(self.dir, f"{group}.npy"), lambda f: np.save(f, self.grids[group]))
+        with open(self._ids_path(group), 'a', encoding='utf-8') as f:
+            f.write(f"{response_id}\n")
+        if group not in self.meta['groups']:
+            self.meta['groups'].append(group)
+            self._save_meta()
+
+    def add_response(self, response_id, filename, width, height, points, group=DEFAULT_GROUP):
+        """Adds one response's points to its group grid and persists it.
+
+        Returns False (and changes nothing) if the response was already counted.
+        """
+        if not valid_group(group):
+            raise CohortError(f"Invalid group '{group}'")
+        if not valid_response_id(response_id):
+            raise CohortError("Invalid responseId")
+        with self.lock:
+            if self.meta['filename'] is None:
+                self.meta['filename'] = filename
+                self._init_grid_size(width, height)
+            elif self.meta['filename'] != filename:
+                raise CohortError(f"Cohort '{self.cohort_id}' aggregates '{self.meta['filename']}', not '{filename}'")
+
+            if response_id in self.response_ids:
+                return False
+
+            grid_height, grid_width = self.grid_shape
+            pts = as_point_array(points).astype(np.float64)
+            pts = pts[(pts[:, 0] >= 0) & (pts[:, 0] < width) & (pts[:, 1] >= 0) & (pts[:, 1] < height)]
+            if group not in self.grids:
+                self.grids[group] = np.zeros((grid_height, grid_width), dtype=np.float32)
+            if len(pts):
+                pts *= (grid_width / width, grid_height / height)
+                weights = np.full(len(pts), 1.0 / len(pts), dtype=np.float32)
+                accumulate_points(pts, grid_width, grid_height, weights=weights, out=self.grids[group])
+            self._save(group, response_id)
+            self.counts[group] = self.counts.get(group, 0) + 1
+            self.response_ids.add(response_id)
+            return True
+
+    def _summary(self):
+        """Caller holds the lock."""
+        return {'cohortId': self.cohort_id, 'filename': self.meta['filename'],
+                'gridWidth': self.meta['gridWidth'], 'gridHeight': self.meta['gridHeight'],
+                'groups': dict(self.counts)}
+
+    def combined_grid(self, groups=None):
+        """Returns (summary, grid, response count) from one consistent state.
+
+        grid is the sum of the selected groups' grids (all groups if None),
+        or None if the cohort has no responses yet.
+        """
+        with self.lock:
+            summary = self._summary()
+            selected = list(self.grids) if not groups else [g for g in groups if g in self.grids]
+            if self.meta['gridWidth'] is None:
+                return summary, None, 0
+            total = np.zeros(self.grid_shape, dtype=np.float32)
+            for group in selected:
+                total += self.grids[group]
+            return summary, total, sum(self.counts[g] for g in selected)
+
+    def summary(self):
+        with self.lock:
+            return self._summary()
+
+
+class CohortStore:
+    """Loads each cohort once per process and keeps it in memory."""
+
+    def __init__(self, root=COHORT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._cohorts = {}
+
+    def get(self, cohort_id):
+        with self._lock:
+            if cohort_id not in self._cohorts:
+                self._cohorts[cohort_id] = Cohort(cohort_id, self.root)
+            return self._cohorts[cohort_id]
+
+
+_store = CohortStore()
+
+
+def get_cohort_store():
+    return _store
@@ -0,0 +1,156 @@
+"""Gaze density engine shared by the heatmap endpoint, the DermGaze bot
+and the offline heatmap scripts in ml/ and eye_tracking/.
+
+Points are binned into a float32 count grid with a single bincount /
+np.add.at call instead of a Python loop, and the grid is blurred with one
+of several Gaussian backends:
+
+    separable  two 1-D passes (scipy.ndimage), exact, good for small sigma
+    fft        reflect-padded FFT convolution with the same kernel, exact
+    pyramid    block-sum downsample, blur at sigma / factor, bilinear upsample;
+               several times faster than fft but approximate: each point moves
+               to its block's centre, which costs up to ~0.1 of peak for a lone
+               point and a few hundredths for dense gaze, so it is only used
+               when asked for
+    auto       fft for large sigma, separable otherwise (both exact)
+"""
+import numpy as np
+from scipy import ndimage, signal
+
+try:
+    import cv2
+except ImportError:  # eye_tracking/ scripts only need numpy + scipy
+    cv2 = None
+
+BLUR_BACKENDS = ("auto", "separable", "fft", "pyramid")
+
+# Below this many points per grid cell np.add.at beats a full-size bincount
+ADD_AT_RATIO = 0.02
+
+# From this sigma on the FFT backend beats two direct 1-D passes
+FFT_MIN_SIGMA = 8.0
+
+# Sigma (in downsampled pixels) the pyramid backend keeps after shrinking
+PYRAMID_MIN_SIGMA = 4.0
+
+
+def as_point_array(points):
+    """Returns points as an (N, 2) numeric array of (x, y) rows.
+
+    Integer and float arrays (e.g. decoded int16 wire payloads) are used
+    without a copy; anything else is converted to float64.
+    """
+    pts = np.asarray(points)
+    if pts.size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    if pts.dtype.kind not in "iuf":
+        pts = pts.astype(np.float64)
+    return pts.reshape(-1, 2)
+
+
+def accumulate_points(points, width, height, weights=None, out=None):
+    """Bins (x, y) points into a (height, width) float32 count grid.
+
+    Points outside the grid are dropped, and coordinates are truncated the
+    same way int(x) was in the original per-point loop. If out is given the
+    counts are added to it in place (used for running/incremental grids).
+    """
+    pts = as_point_array(points)
+    if out is None:
+        out = np.zeros((height, width), dtype=np.float32)
+    if len(pts) == 0:
+        return out
+
+    xs, ys = pts[:, 0], pts[:, 1]
+    keep = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    xs = xs[keep].astype(np.intp)
+    ys = ys[keep].astype(np.intp)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float32)[keep]
+
+    if len(xs) < ADD_AT_RATIO * width * height:
+        np.add.at(out, (ys, xs), 1.0 if weights is None else weights)
+    else:
+        counts = np.bincount(ys * width + xs, weights=weights, minlength=width * height)
+        out += counts.reshape(height, width).astype(np.float32, copy=False)
+    return out
+
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    """Normalized 1-D Gaussian kernel matching scipy.ndimage's radius."""
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def _blur_separable(grid, sigma):
+    return ndimage.gaussian_filter(grid, sigma=sigma, mode="reflect", output=np.float32)
+
+
+def _blur_fft(grid, sigma):
+    kernel = gaussian_kernel1d(sigma)
+    radius = len(kernel) // 2
+    # 'symmetric' padding is the same boundary rule as ndimage's 'reflect'
+    padded = np.pad(grid, radius, mode="symmetric")
+    out = signal.fftconvolve(padded, kernel[None, :], mode="valid", axes=1)
+    out = signal.fftconvolve(out, kernel[:, None], mode="valid", axes=0)
+    # FFT round-off leaves tiny negatives that would turn into NaN under gamma
+    return np.maximum(out, 0, dtype=np.float32)
+
+
+def _blur_pyramid(grid, sigma):
+    factor = int(sigma // PYRAMID_MIN_SIGMA)
+    if factor < 2:
+        return _blur_separable(grid, sigma)
+
+    h, w = grid.shape
+    # Mirror a full kernel radius around the grid and blur with zeros beyond it: the same
+    # boundary as the exact backends' reflect mode, whatever the block alignment
+    margin = int(4.0 * sigma + 0.5)
+    extended = np.pad(grid, margin, mode="symmetric")
+    eh, ew = extended.shape
+    sh, sw = -(-eh // factor), -(-ew // factor)
+    extended = np.pad(extended, ((0, sh * factor - eh), (0, sw * factor - ew)))
+    # Block sums keep total mass; dividing by factor^2 keeps per-pixel scale
+    small = extended.reshape(sh, factor, sw, factor).sum(axis=(1, 3))
+    small = ndimage.gaussian_filter(small / np.float32(factor * factor), sigma / factor, mode="constant",
+                                    output=np.float32)
+    if cv2 is not None:
+        full = cv2.resize(small, (sw * factor, sh * factor), interpolation=cv2.INTER_LINEAR)
+    else:
+        full = ndimage.zoom(small, factor, order=1, mode="nearest", grid_mode=True)
+    return np.ascontiguousarray(full[margin:margin + h, margin:margin + w], dtype=np.float32)
+
+
+def blur(grid, sigma, backend="auto"):
+    """Gaussian-blurs a density grid with the chosen backend."""
+    if backend == "auto":
+        backend = "fft" if sigma >= FFT_MIN_SIGMA else "separable"
+    if backend == "separable":
+        return _blur_separable(grid, sigma)
+    if backend == "fft":
+        return _blur_fft(grid, sigma)
+    if backend == "pyramid":
+        return _blur_pyramid(grid, sigma)
+    raise ValueError(f"Unknown blur backend '{backend}', expected one of {BLUR_BACKENDS}")
+
+
+def normalize(density, gamma=None):
+    """Scales a blurred grid to [0, 1], optionally applying a gamma curve first.
+
+    Returns the grid unchanged (all zeros) when it has no mass.
+    """
+    if gamma is not None:
+        density = np.power(density, gamma, dtype=np.float32)
+    peak = density.max() if density.size else 0
+    if peak <= 0:
+        return density
+    density /= peak
+    return density
+
+
+def density_map(points, width, height, sigma=30, backend="auto", gamma=None):
+    """Builds a normalized [0, 1] float32 heatmap from gaze points."""
+    grid = accumulate_points(points, width, height)
+    return normalize(blur(grid, sigma, backend), gamma)
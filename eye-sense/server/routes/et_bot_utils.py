@@ -1,16 +1,30 @@
 from io import BytesIO
 import cv2
 import numpy as np
-import matplotlib as mpl
-mpl.use('agg')
-import matplotlib.pyplot as plt
+from PIL import Image
 import random
 import os
 import datetime
+from .density import density_map
+from .render import overlay, render_heatmap
+from . import hair, sampler
+from .hair import HAIR_REMOVAL_SCALE
+from .segment_cache import get_segment_cache
+from .pipeline import Pipeline, Stage
+
+# How the bot turns the segmented lesion into a heatmap, one of sampler.DENSITY_METHODS:
+# "sampled" blurs random gaze points, "analytic" blurs their expected value and
+# "distance" computes the blurred expectation straight from the mask's distance field
+BOT_ANALYTIC_DENSITY = os.getenv('BOT_ANALYTIC_DENSITY', 'false').lower() in ('1', 'true', 'yes')
+BOT_DENSITY = os.getenv('BOT_DENSITY', 'analytic' if BOT_ANALYTIC_DENSITY else 'sampled')
+
+# Long side (px) the bot does its CV and density work at, and of its output
+# (1000 matches the old 10x8 in matplotlib figure); 0 = native
+BOT_WORKING_SIZE = int(os.getenv('BOT_WORKING_SIZE', '1024'))
+BOT_OUTPUT_SIZE = int(os.getenv('BOT_OUTPUT_SIZE', '1000'))
 
 def zoom_image(image, zoom_factor=1.2):
     """Zoom into the center of the image by a zoom_factor."""
-    print("zooming")
     h, w = image.shape[:2]
     new_h = int(h / zoom_factor)
     new_w = int(w / zoom_factor)
@@ -19,20 +33,9 @@ def zoom_image(image, zoom_factor=1.2):
     cropped = image[top:top+new_h, left:left+new_w]
     return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
 
-def remove_hair(image, kernel_size=17, threshold=10, inpaint_radius=1):
-    """Removes hair using black-hat filtering + inpainting."""
-    print("removing hair")
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    print("gray:", gray)
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
-    print("kernel:", kernel)
-    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel)
-    print("blackhat:", blackhat)
-    _, mask = cv2.threshold(blackhat, threshold, 255, cv2.THRESH_BINARY)
-    print("mask:", mask)
-    inpainted = cv2.inpaint(image, mask, inpaint_radius, cv2.INPAINT_TELEA)
-    print("inpainted:", inpainted)
-    return inpainted
+def remove_hair(image, kernel_size=17, threshold=10, inpaint_radius=1, scale=HAIR_REMOVAL_SCALE):
+    """Removes hair using black-hat filtering + inpainting (multi-resolution unless scale=1.0)."""
+    return hair.remove_hair(image, kernel_size, threshold, inpaint_radius, scale=scale)
 
 def load_image(filepath):
     """Load and return BGR and grayscale image."""
@@ -41,77 +44,147 @@ def load_image(filepath):
 
 def segment_lesion(gray_image):
     """Segment the lesion using Otsu thresholding and return the largest contour."""
-    print("segmenting lesion")
     _, binary = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours:
         raise ValueError("No contours found!")
     return max(contours, key=cv2.contourArea)
 
-def sample_border_points(contour, num_points):
-    print("sampling border points")
-    contour_points = contour.squeeze()
-    if len(contour_points.shape) == 1:
-        contour_points = np.expand_dims(contour_points, axis=0)
-    indices = np.random.choice(len(contour_points), num_points, replace=True)
-    return [tuple(contour_points[i]) for i in indices]
-
-def sample_internal_points(mask, num_points):
-    print("sampling internal points")
-    ys, xs = np.where(mask == 255)
-    if len(xs) == 0:
-        return []
-    indices = np.random.choice(len(xs), num_points, replace=True)
-    return list(zip(xs[indices], ys[indices]))
+def sample_border_points(contour, num_points, rng=None):
+    return sampler.sample_border_points(contour, num_points, rng)
+
+def sample_internal_points(mask, num_points, rng=None):
+    return sampler.sample_internal_points(mask, num_points, rng)
 
 def create_mask_from_contour(shape, contour):
-    print("creating mask from contour")
     mask = np.zeros(shape, dtype=np.uint8)
     cv2.drawContours(mask, [contour], -1, 255, -1)
     return mask
 
-def visualize_heatmap(image, border_points, internal_points, output_dir='dataset/heatmaps', visualize=False, sigma=30, original_filename=None):
-    print("visualizing heatmap")
-    h, w, _ = image.shape
-    heatmap = np.zeros((h, w), dtype=np.float32)
-
-    for x, y in border_points + internal_points:
-        if 0 <= x < w and 0 <= y < h:
-            heatmap[y, x] += 1
-
-    from scipy.ndimage import gaussian_filter
+def fit_long_side(image, size):
+    """Downscales so the long side is at most `size` pixels; returns (image, scale)."""
+    scale = min(1.0, size / max(image.shape[:2])) if size else 1.0
+    if scale >= 1.0:
+        return image, 1.0
+    return hair.downscale(image, scale), scale
 
-    
-    heatmap_blurred = gaussian_filter(heatmap, sigma=30)
-    heatmap_blurred = np.power(heatmap_blurred, 0.7)
+def visualize_heatmap(image, border_points, internal_points, output_dir='dataset/heatmaps', visualize=False, sigma=30, original_filename=None, working_shape=None, density=None):
+    """Renders the sampled points (or a precomputed normalized density) over `image`.
 
-    if np.max(heatmap_blurred) == 0:
+    With working_shape=(h, w) the points and density are in that smaller
+    frame: the density is built there (sigma scaled to match) and upsampled
+    to the image.
+    """
+    h, w, _ = image.shape
+    work_h, work_w = working_shape or (h, w)
+    if density is None:
+        points = np.concatenate([border_points, internal_points])
+        density = density_map(points, work_w, work_h, sigma=sigma * work_w / w, gamma=0.7)
+    heatmap_normalized = density
+    if (work_h, work_w) != (h, w):
+        heatmap_normalized = cv2.resize(heatmap_normalized, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    if np.max(heatmap_normalized) == 0:
         return
 
-    heatmap_normalized = heatmap_blurred / np.max(heatmap_blurred)
-
-    plt.figure(figsize=(10, 8))
-    plt.imshow(image)
-    plt.imshow(heatmap_normalized, cmap='jet', alpha=0.4)
-    plt.axis('off')
-    # plt.title('Gaze Heatmap Overlay')
-
     if visualize: 
-        plt.show()
+        Image.fromarray(overlay(image, heatmap_normalized)).show()
         return
 
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # if original_filename:
-    #     base_name = os.path.splitext(original_filename)[0]
-    #     filename = f'{output_dir}/{base_name}_heatmap.png'
-    # else:
-    #     filename = f'{output_dir}/heatmap_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.jpg'
-    
-    # plt.savefig(filename, bbox_inches='tight', pad_inches=0)
-    buf = BytesIO()
-    plt.savefig(buf, bbox_inches='tight', pad_inches=0)
-    plt.close()
-    buf.seek(0)
-    
-    return buf
+    return render_heatmap(image, heatmap_normalized)
+
+# --- Pipeline stages. Each reads and writes the shared context dict.
+
+def stage_decode(ctx):
+    ctx['raw'] = np.array(Image.open(BytesIO(ctx['image_bytes'])))
+
+def stage_zoom(ctx):
+    # Zoom once at output size; everything up to the heatmap works on a reduced copy
+    ctx['image'] = zoom_image(fit_long_side(ctx['raw'], ctx.get('output_size', 0))[0])
+    ctx['working'] = fit_long_side(ctx['image'], ctx.get('working_size', 0))[0]
+
+def segment_cache_params(ctx):
+    return {'pipeline': ctx.get('cache_namespace', 'bot'), 'output_size': ctx.get('output_size', 0),
+            'working_size': ctx.get('working_size', 0), 'hair_scale': HAIR_REMOVAL_SCALE,
+            'hair_detect_size': hair.DETECT_SIZE}
+
+def stage_cache_lookup(ctx):
+    cached = get_segment_cache().get(ctx['image_bytes'], segment_cache_params(ctx))
+    ctx['cache_hit'] = cached is not None
+    if cached is not None:
+        ctx['contour'], ctx['mask'] = cached
+
+def stage_cache_store(ctx):
+    get_segment_cache().put(ctx['image_bytes'], segment_cache_params(ctx), ctx['contour'], ctx['mask'])
+
+def stage_hair(ctx):
+    ctx['cleaned'] = remove_hair(ctx['working'])
+
+def stage_grayscale(ctx):
+    ctx['gray'] = cv2.cvtColor(ctx['cleaned'], cv2.COLOR_BGR2GRAY)
+
+def stage_segment(ctx):
+    ctx['contour'] = segment_lesion(ctx['gray'])
+
+def stage_mask(ctx):
+    ctx['mask'] = create_mask_from_contour(ctx['gray'].shape, ctx['contour'])
+
+def stage_sample(ctx):
+    rng = sampler.get_rng(ctx.get('seed'))
+    ctx['points'] = np.concatenate([sample_border_points(ctx['contour'], ctx['num_border_points'], rng),
+                                    sample_internal_points(ctx['mask'], ctx['num_internal_points'], rng)])
+
+def stage_density(ctx):
+    """Normalized density in the working frame (sigma scaled to match), upsampled to the image."""
+    h, w = ctx['image'].shape[:2]
+    work_h, work_w = ctx['mask'].shape
+    sigma = ctx.get('sigma', 30) * work_w / w
+    method = ctx.get('density_method', 'sampled')
+    if method == 'sampled':
+        density = density_map(ctx['points'], work_w, work_h, sigma=sigma, gamma=0.7)
+    else:
+        density = sampler.lesion_density(ctx['contour'], ctx['mask'], ctx['num_border_points'],
+                                         ctx['num_internal_points'], sigma=sigma, gamma=0.7, method=method)
+    if (work_h, work_w) != (h, w):
+        density = cv2.resize(density, (w, h), interpolation=cv2.INTER_LINEAR)
+    if np.max(density) == 0:
+        raise ValueError("Empty heatmap")
+    ctx['density'] = density
+
+def stage_render(ctx):
+    ctx['png'] = render_heatmap(ctx['image'], ctx['density']).getvalue()
+
+is_cached = lambda ctx: ctx.get('cache_hit', False)
+is_unsampled = lambda ctx: ctx.get('density_method', 'sampled') != 'sampled'
+
+# decode -> zoom -> [cache] -> hair -> grayscale -> segment -> mask -> [cache] -> sample -> density -> render
+DERMGAZE_PIPELINE = Pipeline('dermgaze', [
+    Stage('decode', stage_decode),
+    Stage('zoom', stage_zoom),
+    Stage('cache_lookup', stage_cache_lookup),
+    Stage('hair', stage_hair, skip=is_cached),
+    Stage('grayscale', stage_grayscale, skip=is_cached),
+    Stage('segment', stage_segment, skip=is_cached),
+    Stage('mask', stage_mask, skip=is_cached),
+    Stage('cache_store', stage_cache_store, skip=is_cached),
+    Stage('sample', stage_sample, skip=is_unsampled),
+    Stage('density', stage_density),
+    Stage('render', stage_render),
+])
+
+def run_dermgaze_bot(image_bytes, num_border_points=3000, num_internal_points=2000,
+                     working_size=BOT_WORKING_SIZE, output_size=BOT_OUTPUT_SIZE,
+                     seed=None, density=BOT_DENSITY):
+    """Runs DERMGAZE_PIPELINE on an encoded image. Returns (PNG bytes, stage timings).
+
+    Segmentation, sampling and the density all run on a copy with its long
+    side at working_size; only the final overlay is drawn at the output size
+    (native, or long side output_size). 0 disables either limit.
+    seed makes the sampled points reproducible; density picks one of
+    sampler.DENSITY_METHODS (only "sampled" draws points).
+    Module-level and picklable in and out so it can run in a worker process.
+    """
+    ctx, timings = DERMGAZE_PIPELINE.run(
+        image_bytes=image_bytes, num_border_points=num_border_points, num_internal_points=num_internal_points,
+        working_size=working_size, output_size=output_size, seed=seed, density_method=density)
+    return ctx['png'], timings
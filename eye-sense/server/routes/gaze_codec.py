@@ -0,0 +1,120 @@
+"""Packed binary wire format for gaze points.
+
+The JSON path double-encodes the gaze array (JSON string inside a JSON body)
+and parses it back one dict at a time. The packed format is a 12-byte header
+followed by column arrays that the server reads with np.frombuffer:
+
+    offset  size  field
+    0       4     magic b"GAZE"
+    4       1     version (1)
+    5       1     flags: 1 = has t column, 2 = delta-encoded, 4 = zlib-compressed
+    6       1     dtype of x/y: 0 = int16, 1 = float32
+    7       1     reserved (0)
+    8       4     point count, uint32
+    12      ...   xy[count][2] interleaved, then t[count] as float32 ms if flagged
+                  (the web client sends ms since its first sample; float32 cannot
+                  hold an epoch timestamp in ms to better than minutes)
+
+All values are little-endian. With delta encoding every column stores the
+difference to the previous value (the first value is absolute). With zlib
+the bytes after the header are compressed as one stream. An uncompressed,
+non-delta payload is decoded without copying.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"GAZE"
+VERSION = 1
+CONTENT_TYPE = "application/x-gaze"
+
+FLAG_TIME = 1
+FLAG_DELTA = 2
+FLAG_ZLIB = 4
+
+DTYPES = {0: np.dtype("<i2"), 1: np.dtype("<f4")}
+DTYPE_CODES = {"int16": 0, "float32": 1}
+TIME_DTYPE = np.dtype("<f4")
+
+_HEADER = struct.Struct("<4sBBBBI")
+
+
+class GazeFormatError(ValueError):
+    """Raised for a payload that is not a valid packed gaze buffer."""
+
+
+def encode(points, times=None, dtype="int16", delta=False, compress=False):
+    """Packs (N, 2) points (and optional N times, in ms) into the wire format."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    code = DTYPE_CODES[dtype]
+    xy_dtype = DTYPES[code]
+    if xy_dtype.kind == "i":
+        # floor, not truncation, so -0.5 stays out of bounds like the JSON path
+        points = np.floor(points)
+    columns = [points.astype(xy_dtype)]
+
+    flags = 0
+    if times is not None:
+        flags |= FLAG_TIME
+        columns.append(np.asarray(times, dtype=np.float64).astype(TIME_DTYPE))
+    if delta:
+        flags |= FLAG_DELTA
+        columns = [np.diff(col, axis=0, prepend=np.zeros_like(col[:1])).astype(col.dtype) for col in columns]
+
+    body = b"".join(col.tobytes() for col in columns)
+    if compress:
+        flags |= FLAG_ZLIB
+        body = zlib.compress(body)
+    return _HEADER.pack(MAGIC, VERSION, flags, code, 0, len(points)) + body
+
+
+def decode(payload):
+    """Unpacks a wire buffer into (points, times).
+
+    points is an (N, 2) array in the encoded dtype and times is a float32
+    array or None. Raises GazeFormatError on malformed input.
+    """
+    view = memoryview(payload)
+    if len(view) < _HEADER.size:
+        raise GazeFormatError("Gaze payload shorter than header")
+    magic, version, flags, code, _, count = _HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise GazeFormatError("Bad gaze payload magic")
+    if version != VERSION:
+        raise GazeFormatError(f"Unsupported gaze payload version {version}")
+    if code not in DTYPES:
+        raise GazeFormatError(f"Unknown gaze dtype code {code}")
+
+    xy_dtype = DTYPES[code]
+    body = view[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        try:
+            body = memoryview(zlib.decompress(body))
+        except zlib.error as e:
+            raise GazeFormatError(f"Could not decompress gaze payload: {e}")
+
+    expected = count * xy_dtype.itemsize * 2 + (count * TIME_DTYPE.itemsize if flags & FLAG_TIME else 0)
+    if len(body) != expected:
+        raise GazeFormatError(f"Gaze payload has {len(body)} bytes, expected {expected} for {count} points")
+
+    points = np.frombuffer(body, dtype=xy_dtype, count=2 * count).reshape(count, 2)
+    times = None
+    if flags & FLAG_TIME:
+        times = np.frombuffer(body, dtype=TIME_DTYPE, count=count, offset=2 * count * xy_dtype.itemsize)
+
+    if flags & FLAG_DELTA:
+        points = np.cumsum(points, axis=0, dtype=xy_dtype)
+        if times is not None:
+            times = np.cumsum(times, dtype=TIME_DTYPE)
+
+    return points, times
+
+
+def decode_json(gaze_data_str):
+    """Parses the legacy JSON gazeDataStr into an (N, 2) float array of (x, y)."""
+    gaze_data = json.loads(gaze_data_str)
+    if not gaze_data:
+        return np.empty((0, 2))
+    return np.array([(d['x'], d['y']) for d in gaze_data], dtype=np.float64)
@@ -0,0 +1,195 @@
+"""Process-wide Cloud Storage access for the heatmap service and ml/ tooling.
+
+storage.Client.from_service_account_json + client.get_bucket used to run on
+every request: credentials were re-read, a bucket metadata GET was issued and
+a fresh HTTP session was opened each time. This module builds the client once
+per credentials file, on first use, with a pooled HTTP session, and hands out
+cached bucket handles. Everything is guarded by a lock so worker threads can
+share it.
+
+Setting STORAGE_BACKEND=local swaps in LocalBucket, a directory-backed fake
+with the subset of the google-cloud-storage Bucket/Blob API we use, so the
+service and scripts can run offline:
+
+    STORAGE_BACKEND=local LOCAL_BUCKET_ROOT=/tmp/buckets python app.py
+"""
+import os
+import threading
+
+try:
+    from google.api_core.exceptions import NotFound, NotModified
+except ImportError:  # local backend only
+    class NotFound(Exception):
+        pass
+
+    class NotModified(Exception):
+        pass
+
+# HTTP connections kept alive per host; sized for Flask's threaded server
+POOL_SIZE = int(os.getenv('STORAGE_POOL_SIZE', '32'))
+
+_lock = threading.RLock()
+_clients = {}
+_buckets = {}
+
+
+def backend():
+    """Returns the configured storage backend, 'gcs' or 'local'."""
+    return os.getenv('STORAGE_BACKEND', 'gcs')
+
+
+def _credentials_path(credentials_path):
+    return credentials_path or os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+
+
+def _build_client(credentials_path):
+    from google.cloud import storage
+    from google.oauth2 import service_account
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    credentials = service_account.Credentials.from_service_account_file(
+        credentials_path, scopes=["https://www.googleapis.com/auth/devstorage.read_write"])
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    return storage.Client(project=credentials.project_id, credentials=credentials, _http=session)
+
+
+def get_client(credentials_path=None):
+    """Returns the shared storage.Client for a service account key file."""
+    credentials_path = _credentials_path(credentials_path)
+    client = _clients.get(credentials_path)
+    if client is not None:
+        return client
+    with _lock:
+        if credentials_path not in _clients:
+            _clients[credentials_path] = _build_client(credentials_path)
+        return _clients[credentials_path]
+
+
+def get_bucket(bucket_name, credentials_path=None):
+    """Returns a cached bucket handle.
+
+    Uses client.bucket() rather than client.get_bucket(), so no metadata
+    round trip is made; a missing bucket surfaces on the first blob call.
+    """
+    key = (backend(), bucket_name, _credentials_path(credentials_path))
+    bucket = _buckets.get(key)
+    if bucket is not None:
+        return bucket
+    with _lock:
+        if key not in _buckets:
+            if key[0] == 'local':
+                _buckets[key] = LocalBucket(bucket_name)
+            else:
+                _buckets[key] = get_client(credentials_path).bucket(bucket_name)
+        return _buckets[key]
+
+
+def reset():
+    """Drops all cached clients and bucket handles (e.g. after changing backend)."""
+    with _lock:
+        _clients.clear()
+        _buckets.clear()
+
+
+##########################
+#  LOCAL (FAKE) BACKEND  #
+##########################
+
+class LocalBlob:
+    """A file under LOCAL_BUCKET_ROOT/<bucket>/ that quacks like storage.Blob."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, *name.split('/'))
+        self.content_type = None
+
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def etag(self):
+        generation = self.generation
+        return None if generation is None else f'"{generation:x}-{self.size:x}"'
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+
+    def download_as_bytes(self, if_generation_match=None, if_generation_not_match=None):
+        self.reload()
+        generation = self.generation
+        if if_generation_not_match is not None and generation == if_generation_not_match:
+            raise NotModified(f"{self.bucket.name}/{self.name}")
+        if if_generation_match is not None and generation != if_generation_match:
+            raise NotFound(f"{self.bucket.name}/{self.name} generation {if_generation_match}")
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def upload_from_string(self, data, content_type=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        self.content_type = content_type
+
+    def upload_from_file(self, file_obj, content_type=None):
+        self.upload_from_string(file_obj.read(), content_type=content_type)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, 'rb') as f:
+            self.upload_from_file(f, content_type=content_type)
+
+    def download_to_file(self, file_obj):
+        file_obj.write(self.download_as_bytes())
+
+
+class LocalBucket:
+    """Directory-backed stand-in for storage.Bucket, used when STORAGE_BACKEND=local."""
+
+    def __init__(self, name, root=None):
+        self.name = name
+        self.root = os.path.join(root or os.getenv('LOCAL_BUCKET_ROOT', 'local-buckets'), name)
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = LocalBlob(self, blob_name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix='', max_results=None, page_size=None):
+        """Lazily yields blobs in name order; page_size is accepted for API parity."""
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.tmp'):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                name = rel.replace(os.sep, '/')
+                if not name.startswith(prefix):
+                    continue
+                if max_results is not None and count >= max_results:
+                    return
+                count += 1
+                yield LocalBlob(self, name)
@@ -0,0 +1,81 @@
+"""Hair removal for dermoscopy images: black-hat hair mask + Telea inpainting.
+
+At full resolution cv2.inpaint dominates the bot pipeline on large uploads.
+With scale < 1 the image is taken down a Gaussian pyramid, the hair mask is
+detected there (kernel scaled to match) and inpainted there, and the fill
+is upsampled and copied back into the full-resolution image only where the
+upsampled mask is set. Pixels outside the hair mask keep their original
+full-resolution values.
+
+scale is the quality-vs-speed knob:
+
+    1.0     the original full-resolution algorithm, bit for bit
+    < 1.0   work at that fraction of full size
+    "auto"  work with the long side at HAIR_DETECT_SIZE pixels (full size
+            if the image is already smaller)
+
+On the bundled ml/dataset/images "auto" is ~3.5x faster than 1.0 with a
+mean SSIM of 0.993 against its output (benchmarks/bench_hair.py).
+"""
+import math
+import os
+
+import cv2
+
+HAIR_REMOVAL_SCALE = os.getenv('HAIR_REMOVAL_SCALE', 'auto')
+DETECT_SIZE = int(os.getenv('HAIR_DETECT_SIZE', '1024'))
+
+
+def hair_mask(gray, kernel_size=17, threshold=10):
+    """Binary (0/255) mask of dark thin structures at the image's own scale."""
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel)
+    _, mask = cv2.threshold(blackhat, threshold, 255, cv2.THRESH_BINARY)
+    return mask
+
+
+def resolve_scale(scale, shape):
+    """Turns a scale setting ("auto", number or numeric string) into a factor in (0, 1]."""
+    if scale == 'auto':
+        return min(1.0, DETECT_SIZE / max(shape[:2]))
+    return min(1.0, max(0.05, float(scale)))
+
+
+def downscale(image, scale):
+    """Shrinks by `scale` with pyrDown for each halving and a linear resize for the rest.
+
+    pyrDown low-passes before decimating, so thin hairs fade instead of
+    aliasing, and is several times faster than INTER_AREA on large images.
+    """
+    h, w = image.shape[:2]
+    for _ in range(int(math.floor(math.log2(1 / scale)))):
+        image = cv2.pyrDown(image)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if (image.shape[1], image.shape[0]) != size:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def remove_hair(image, kernel_size=17, threshold=10, inpaint_radius=1, scale=1.0):
+    """Removes hair using black-hat filtering + inpainting.
+
+    scale selects full-resolution (1.0) or multi-resolution (< 1.0 or "auto") mode.
+    """
+    scale = resolve_scale(scale, image.shape)
+    if scale >= 1.0:
+        mask = hair_mask(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), kernel_size, threshold)
+        return cv2.inpaint(image, mask, inpaint_radius, cv2.INPAINT_TELEA)
+
+    h, w = image.shape[:2]
+    small = downscale(image, scale)
+    small_kernel = max(3, int(round(kernel_size * scale)) | 1)
+    small_mask = hair_mask(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), small_kernel, threshold)
+    if not small_mask.any():
+        return image.copy()
+    fill = cv2.inpaint(small, small_mask, inpaint_radius, cv2.INPAINT_TELEA)
+
+    # Linear upsampling leaves a soft edge; any nonzero value marks a hair pixel
+    mask = cv2.resize(small_mask, (w, h), interpolation=cv2.INTER_LINEAR)
+    out = image.copy()
+    cv2.copyTo(cv2.resize(fill, (w, h), interpolation=cv2.INTER_LINEAR), mask, out)
+    return out
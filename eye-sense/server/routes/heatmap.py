@@ -1,17 +1,46 @@
 import os
 from PIL import Image
-from google.cloud import storage
 from dotenv import load_dotenv
-from flask import Blueprint, app, request, send_file, make_response, jsonify, Response
+from flask import Blueprint, app, request, send_file, make_response, jsonify, Response, url_for
 import json
 from .et_bot_utils import *
+from .density import density_map, blur, normalize
+from . import render, gcs, result_cache, gaze_codec, batch, pipeline, sampler
+from .image_cache import get_image_cache
+from .pixel_cache import get_pixel_cache
+from .result_cache import get_result_cache
+from .segment_cache import get_segment_cache
+from .sessions import get_session_store, SessionLimitError
+from .cohort import get_cohort_store, valid_group, valid_response_id, CohortError
+from . import bot_jobs
+from .bot_jobs import get_bot_queue, QueueFullError
+import threading
 
 load_dotenv(dotenv_path=r'./config.env')
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', 'not found')
 BUCKET_NAME = os.getenv('BUCKET_NAME', 'bucket not found')
 
+# Render parameters; part of the result cache key
+HEATMAP_SIGMA = 30
+HEATMAP_ALPHA = 0.4
+
 api_heatmap = Blueprint("heatmap", __name__)
 
+def cached_image_response(image_bytes, output_format, key, filename="heatmap"):
+    """Builds an inline image response carrying the result-cache ETag."""
+    response = make_response(image_bytes)
+    response.mimetype = render.mimetype(output_format)
+    response.headers["Content-Disposition"] = f"inline; filename={filename}.{output_format}"
+    response.headers["ETag"] = result_cache.etag_for(key)
+    response.headers["Cache-Control"] = result_cache.CACHE_CONTROL
+    return response
+
+def not_modified_response(key):
+    response = make_response("", 304)
+    response.headers["ETag"] = result_cache.etag_for(key)
+    response.headers["Cache-Control"] = result_cache.CACHE_CONTROL
+    return response
+
 @api_heatmap.route("/", methods=["GET"])
 def get_data():
     print("receiving GET request")
@@ -22,131 +51,500 @@ def generate_heatmap():
     """Generates heatmap for image given the gaze data, 
     width and height of the image, and the image in base 64.
     
-    Inputs:
+    Inputs (JSON body):
         gazeDataStr: JSON string of gaze data coordinates
         width: int representing width of image
         height: int representing height of image
         filename: string representing exact name of blob in GCP bucket
+        format: optional output encoding, "png" (default), "jpeg" or "webp"
+
+    Inputs (packed body, Content-Type application/x-gaze or application/octet-stream):
+        body: gaze points in the gaze_codec wire format
+        filename, width, height, format: query string parameters
 
     Returns:
         file: image with heatmap overlay
     """
+    if request.mimetype in (gaze_codec.CONTENT_TYPE, "application/octet-stream"):
+        data = request.args
+        gaze_payload = request.get_data()
+        load_points = lambda: gaze_codec.decode(gaze_payload)[0]
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('gazeDataStr'), str):
+            return {"error": "Missing gazeDataStr"}, 400
+        gaze_payload = data['gazeDataStr']
+        load_points = lambda: gaze_codec.decode_json(gaze_payload)
+    filename = data.get('filename')
+    output_format = data.get('format', 'png')
+
+    if not filename or not isinstance(filename, str):
+        return {"error": "Missing filename"}, 400
     try:
-        import numpy as np
-        import matplotlib as mpl
-        mpl.use('agg')
-        import matplotlib.pyplot as plt
-        from scipy.ndimage import gaussian_filter
-        from io import BytesIO
-        
-        data = request.json
-        filename = data['filename']
-        display_width = data['width']
-        display_height = data['height']
-        gaze_data_str = data['gazeDataStr']
-        
-        if not filename:
-            return {"error": "Missing filename"}, 400
-        
-        # Load and resize background image
-        client = storage.Client.from_service_account_json(GOOGLE_APPLICATION_CREDENTIALS)
-        
-        bucket = client.get_bucket(BUCKET_NAME)
-        blob = bucket.get_blob(filename)
-                
-        if blob is None:
+        display_width, display_height = render.display_size(data.get('width'), data.get('height'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if output_format not in render.FORMATS:
+        return {"error": f"Unsupported format '{output_format}'"}, 400
+
+    try:
+        bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+        exists, generation = get_image_cache().current_generation(bucket, filename)
+        if not exists:
             return {"error": f"File '{filename}' not found in bucket"}, 404
-        
-        image_bytes = blob.download_as_bytes()
-        if not image_bytes:
-            return {"error": f"Failed to download file '{filename}' from bucket"}, 500
 
+        # Identical inputs render identical bytes, so the digest doubles as the ETag
+        params = {"sigma": HEATMAP_SIGMA, "alpha": HEATMAP_ALPHA, "format": output_format}
+        key = result_cache.digest(filename, generation, display_width, display_height, gaze_payload, params)
+        results = get_result_cache()
+        if result_cache.etag_matches(request.headers.get("If-None-Match"), key):
+            results.not_modified()
+            return not_modified_response(key)
+
+        cached = results.get(key)
+        if cached is not None:
+            return cached_image_response(cached, output_format, key)
+
+        # Load background image, decoded and resized (cached per blob and size)
         try:
-            img = Image.open(BytesIO(image_bytes))
+            img = get_pixel_cache().get(bucket, filename, display_width, display_height)
         except Exception as e:
             return {"error": f"Could not open image: {str(e)}"}, 500
+                
+        if img is None:
+            return {"error": f"File '{filename}' not found in bucket"}, 404
 
-        img = img.resize((display_width, display_height), Image.BILINEAR)
-        img_width, img_height = img.size
+        img_height, img_width = img.shape[:2]
 
-        # Load and filter gaze data
-        gaze_data = json.loads(gaze_data_str)
-        points = [(int(d['x']), int(d['y'])) for d in gaze_data if 0 <= d['x'] < img_width and 0 <= d['y'] < img_height]
+        # Load gaze data (out-of-bounds points are dropped by the density engine)
+        try:
+            points = load_points()
+        except gaze_codec.GazeFormatError as e:
+            return {"error": str(e)}, 400
 
         # Create heatmap
-        heatmap = np.zeros((img_height, img_width))
-        for x, y in points:
-            heatmap[y, x] += 1
-
-        heatmap_blurred = gaussian_filter(heatmap, sigma=30)
-        heatmap_normalized = heatmap_blurred / np.max(heatmap_blurred) if np.max(heatmap_blurred) != 0 else heatmap_blurred
+        heatmap_normalized = density_map(points, img_width, img_height, sigma=HEATMAP_SIGMA)
         
-        # Plot image + heatmap as full-size with black outside
-        plt.figure(figsize=(img_width / 100, img_height / 100), dpi=100)
-        plt.imshow(img)
-        plt.imshow(heatmap_normalized, cmap='jet', alpha=0.4)
-        plt.axis('off')
+        # Composite image + heatmap at exactly the display size
+        buf = render.render_heatmap(img, heatmap_normalized, fmt=output_format, alpha=HEATMAP_ALPHA)
+        image_bytes = buf.getvalue()
+        results.put(key, image_bytes)
 
-        buf = BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, facecolor='black')
-        plt.close()
-        buf.seek(0)
-
-        response = send_file(buf, mimetype='image/png')
-        response.headers["Content-Disposition"] = "inline; filename=heatmap.png"
-        return response
+        return cached_image_response(image_bytes, output_format, key)
 
     except Exception as e:
-        # Only return an error if send_file() hasn't started streaming
-        print("Error during image processing:", e)
+        print("Error generating heatmap:", repr(e))
+        return {"error": f"Could not generate heatmap: {e}"}, 500
+
+
+@api_heatmap.route("/batch/", methods=["POST"])
+def generate_heatmap_batch():
+    """Generates many heatmaps in one request and returns them as a zip.
+
+    Inputs:
+        items: list of {filename, width, height, gazeDataStr, format?}, the
+            same fields as POST /
+
+    Returns:
+        zip of <index>_<name>.<format> images plus manifest.json listing each
+        item's file and ETag, or its error
+    """
+    data = request.json or {}
+    specs = data.get('items')
+    if not isinstance(specs, list) or not specs:
+        return {"error": "Missing items"}, 400
+    if len(specs) > batch.MAX_ITEMS:
+        return {"error": f"At most {batch.MAX_ITEMS} items per batch"}, 413
+
+    bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+    items = batch.render_batch(bucket, specs, HEATMAP_SIGMA, HEATMAP_ALPHA)
+    response = send_file(batch.zip_batch(items), mimetype="application/zip")
+    response.headers["Content-Disposition"] = "attachment; filename=heatmaps.zip"
+    return response
+
+
+@api_heatmap.route("/cache/", methods=["GET"])
+def get_cache_stats():
+    """Returns hit/miss counters and usage for the image, decoded pixel, rendered result
+    and bot segmentation caches."""
+    return jsonify({"images": get_image_cache().stats(), "pixels": get_pixel_cache().stats(),
+                    "results": get_result_cache().stats(), "segments": get_segment_cache().stats()})
+
+
+@api_heatmap.route("/prewarm/", methods=["POST"])
+def prewarm_images():
+    """Decodes and resizes a survey's images ahead of the first heatmap request.
+
+    Inputs:
+        filenames: list of blob names in the GCP bucket
+        sizes: optional list of [width, height]; defaults to the most common sizes seen
+
+    Returns:
+        202 immediately; the cache is filled in the background
+    """
+    data = request.get_json(silent=True) or {}
+    filenames = data.get('filenames')
+    if not isinstance(filenames, list) or not filenames or not all(isinstance(f, str) and f for f in filenames):
+        return {"error": "filenames must be a non-empty list of blob names"}, 400
+    sizes = data.get('sizes')
+    if sizes is not None:
+        if not isinstance(sizes, list) or not all(isinstance(size, list) and len(size) == 2 for size in sizes):
+            return {"error": "sizes must be a list of [width, height] pairs"}, 400
+        try:
+            sizes = [render.display_size(width, height) for width, height in sizes]
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+    bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+    threading.Thread(target=get_pixel_cache().prewarm, args=(bucket, filenames, sizes), daemon=True).start()
+    return {"message": "prewarming", "filenames": len(filenames)}, 202
+
+
+def request_bot_image():
+    """Reads the bot's input image bytes. Returns (image_bytes, error_response)."""
+    filename = request.form.get('filename')
+    if filename:
+        bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+        image_bytes = get_image_cache().get(bucket, filename)
+        if image_bytes is None:
+            return None, ({"error": f"File '{filename}' not found in bucket"}, 404)
+        return image_bytes, None
+
+    if 'image' not in request.files:
+        return None, ({"error": "No image file provided"}, 400)
+
+    file = request.files['image']
+
+    if file.filename == '':
+        return None, ({"error": "Empty filename"}, 400)
+    return file.read(), None
+
+
+def request_bot_params():
+    """Optional pipeline params from the form: seed (int) and density (a sampler.DENSITY_METHODS name).
+
+    analytic=true is still accepted as density=analytic. Raises ValueError on bad values.
+    """
+    params = {}
+    if request.form.get('seed'):
+        try:
+            params['seed'] = int(request.form['seed'])
+        except ValueError:
+            raise ValueError("seed must be an integer")
+    if request.form.get('analytic', '').lower() in ('1', 'true', 'yes'):
+        params['density'] = 'analytic'
+    if request.form.get('density'):
+        if request.form['density'] not in sampler.DENSITY_METHODS:
+            raise ValueError(f"density must be one of {', '.join(sampler.DENSITY_METHODS)}")
+        params['density'] = request.form['density']
+    return params
+
+
+def bot_png_response(image_bytes, timings=None):
+    response = make_response(image_bytes)
+    response.mimetype = 'image/png'
+    response.headers["Content-Disposition"] = "inline; filename=bot-heatmap.png"
+    if timings:
+        response.headers["Server-Timing"] = pipeline.server_timing(timings)
+        # CORS(app) allows every origin; let their scripts read the timings too
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
 
 
 @api_heatmap.route("/bot/", methods=["POST"])
 def simulate_dermgaze():
     """Predicts a heatmap for a skin lesion image, 
     width and height of the image, and the image in base 64.
+
+    Runs synchronously; use POST /bot/jobs/ to run in the background.
+
+    Inputs:
+        image: uploaded image file, or
+        filename: form field naming a blob in the GCP bucket (served from the image cache)
+        seed: optional form field; fixes the sampled gaze points
+        density: optional form field; "sampled" (default), "analytic" (expected density, no
+                 sampling) or "distance" (from the lesion's distance field, no blur)
     """
-    # --- Get uploaded file
-    if 'image' not in request.files:
-        return {"error": "No image file provided"}, 400
+    image_bytes, error = request_bot_image()
+    if error:
+        return error
+    try:
+        params = request_bot_params()
+    except ValueError as e:
+        return {"error": str(e)}, 400
 
-    file = request.files['image']
+    try:
+        return bot_png_response(*run_dermgaze_bot(image_bytes, **params))
+    except Exception as e:
+        return {"error": str(e)}, 500
 
-    if file.filename == '':
-        return {"error": "Empty filename"}, 400
-    
+
+def describe_bot_job(job):
+    return {**job.describe(), "statusUrl": url_for("heatmap.get_bot_job", job_id=job.id),
+            "resultUrl": url_for("heatmap.get_bot_job_result", job_id=job.id)}
+
+
+@api_heatmap.route("/bot/jobs/", methods=["POST"])
+def submit_bot_job():
+    """Queues the bot pipeline and returns a job id immediately.
+
+    Inputs: same as POST /bot/. Identical uploads share one job.
+
+    Returns:
+        202 with jobId, status, statusUrl and resultUrl, or
+        503 with Retry-After when the queue is full
+    """
+    image_bytes, error = request_bot_image()
+    if error:
+        return error
     try:
-        raw_image = Image.open(file.stream)
-        np_image = np.array(raw_image)
+        params = request_bot_params()
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    try:
+        job, created = get_bot_queue().submit(image_bytes, **params)
+    except QueueFullError as e:
+        return {"error": str(e)}, 503, {"Retry-After": "5"}
+    return {**describe_bot_job(job), "deduplicated": not created}, 202
 
-        # data = request.json
-        # filepath = data['filepath']
-        num_border_points = 3000#data['num_border_points']
-        num_internal_points = 2000#data['num_internal_points']
-        
-        # Load and zoom
-        # raw_image, _ = load_image(filepath)
-        image = zoom_image(np_image)
-        
-        # Hair removal
-        cleaned = remove_hair(image)
 
-        # Grayscale after cleanup
-        gray = cv2.cvtColor(cleaned, cv2.COLOR_BGR2GRAY)
+@api_heatmap.route("/bot/jobs/", methods=["GET"])
+def get_bot_queue_stats():
+    """Returns queue depth and job counters for the bot queue."""
+    return jsonify(get_bot_queue().stats())
 
-        # Segmentation
-        contour = segment_lesion(gray)
-        mask = create_mask_from_contour(gray.shape, contour)
 
-        # Sampling
-        border_points = sample_border_points(contour, num_border_points)
-        internal_points = sample_internal_points(mask, num_internal_points)
+@api_heatmap.route("/bot/jobs/<job_id>", methods=["GET"])
+def get_bot_job(job_id):
+    """Returns a job's status. ?wait=<seconds> long-polls until it finishes."""
+    try:
+        wait_seconds = float(request.args.get('wait', 0))
+    except ValueError:
+        return {"error": "wait must be a number"}, 400
+    job = get_bot_queue().get(job_id, wait_seconds)
+    if job is None:
+        return {"error": "Unknown or expired job"}, 404
+    return describe_bot_job(job)
 
-        # Heatmap
-        buf = visualize_heatmap(image, border_points, internal_points)#, original_filename=os.path.basename(filepath))
-        response = send_file(buf, mimetype='image/png')
-        response.headers["Content-Disposition"] = "inline; filename=bot-heatmap.png"
-        return response
-    
+
+@api_heatmap.route("/bot/jobs/<job_id>/result", methods=["GET"])
+def get_bot_job_result(job_id):
+    """Returns the job's heatmap PNG, 202 with its status while pending,
+    or 500 with the error if it failed. Accepts ?wait=<seconds> like the status route."""
+    try:
+        wait_seconds = float(request.args.get('wait', 0))
+    except ValueError:
+        return {"error": "wait must be a number"}, 400
+    job = get_bot_queue().get(job_id, wait_seconds)
+    if job is None:
+        return {"error": "Unknown or expired job"}, 404
+    status = job.status
+    if status == bot_jobs.DONE:
+        return bot_png_response(job.result(), job.timings())
+    if status == bot_jobs.FAILED:
+        return describe_bot_job(job), 500
+    return describe_bot_job(job), 202
+
+
+def is_packed_request():
+    return request.mimetype in (gaze_codec.CONTENT_TYPE, "application/octet-stream")
+
+
+def request_gaze_points():
+    """Reads gaze points from a packed body or a JSON {gazeDataStr} body."""
+    if is_packed_request():
+        return gaze_codec.decode(request.get_data())[0]
+    return gaze_codec.decode_json(request.json['gazeDataStr'])
+
+
+@api_heatmap.route("/sessions/", methods=["POST"])
+def open_gaze_session():
+    """Opens an incremental gaze session for one image at one display size.
+
+    Inputs:
+        filename: string representing exact name of blob in GCP bucket
+        width: int representing width of image
+        height: int representing height of image
+
+    Returns:
+        201 with sessionId
+    """
+    data = request.json or {}
+    filename = data.get('filename')
+    if not filename:
+        return {"error": "Missing filename"}, 400
+    try:
+        width, height = render.display_size(data.get('width'), data.get('height'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+    exists, _ = get_image_cache().current_generation(bucket, filename)
+    if not exists:
+        return {"error": f"File '{filename}' not found in bucket"}, 404
+
+    try:
+        session = get_session_store().open(filename, width, height)
+    except SessionLimitError as e:
+        return {"error": str(e)}, 503, {"Retry-After": "60"}
+    return session.describe(), 201
+
+
+@api_heatmap.route("/sessions/<session_id>/points", methods=["POST"])
+def append_gaze_points(session_id):
+    """Adds a chunk of gaze points (JSON gazeDataStr or packed body) to a session."""
+    session = get_session_store().get(session_id)
+    if session is None:
+        return {"error": f"Session '{session_id}' not found or expired"}, 404
+    try:
+        points = request_gaze_points()
+    except (gaze_codec.GazeFormatError, KeyError, TypeError, ValueError) as e:
+        return {"error": f"Invalid gaze data: {e}"}, 400
+    session.append(points)
+    return session.describe()
+
+
+@api_heatmap.route("/sessions/<session_id>", methods=["GET"])
+def get_session_heatmap(session_id):
+    """Renders the session's current heatmap from its running grid.
+
+    Inputs:
+        format: optional query parameter, "png" (default), "jpeg" or "webp"
+    """
+    session = get_session_store().get(session_id)
+    if session is None:
+        return {"error": f"Session '{session_id}' not found or expired"}, 404
+    output_format = request.args.get('format', 'png')
+    if output_format not in render.FORMATS:
+        return {"error": f"Unsupported format '{output_format}'"}, 400
+
+    grid, version = session.snapshot()
+    key = f"{session.id}-{version}-{output_format}"
+    if result_cache.etag_matches(request.headers.get("If-None-Match"), key):
+        return not_modified_response(key)
+    rendered = session.rendered
+    if rendered is not None and rendered[:2] == (version, output_format):
+        return cached_image_response(rendered[2], output_format, key)
+
+    bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+    try:
+        img = get_pixel_cache().get(bucket, session.filename, session.width, session.height)
     except Exception as e:
-        return {"error": str(e)}, 500
+        return {"error": f"Could not open image: {str(e)}"}, 500
+    if img is None:
+        return {"error": f"File '{session.filename}' not found in bucket"}, 404
+
+    heatmap_normalized = normalize(blur(grid, HEATMAP_SIGMA))
+    image_bytes = render.render_heatmap(img, heatmap_normalized, fmt=output_format, alpha=HEATMAP_ALPHA).getvalue()
+    session.rendered = (version, output_format, image_bytes)
+    return cached_image_response(image_bytes, output_format, key)
+
+
+@api_heatmap.route("/sessions/<session_id>", methods=["DELETE"])
+def close_gaze_session(session_id):
+    if not get_session_store().close(session_id):
+        return {"error": f"Session '{session_id}' not found or expired"}, 404
+    return "", 204
+
+
+@api_heatmap.route("/cohorts/<cohort_id>/responses", methods=["POST"])
+def add_cohort_response(cohort_id):
+    """Adds one response's gaze data to a question's running aggregate.
+
+    Inputs (JSON body, or packed body with these as query parameters):
+        responseId: unique id of the response; repeats are ignored
+        group: optional respondent group (e.g. "novice"), default "all"
+        filename, width, height: image and display size the gaze was recorded at
+        gazeDataStr: JSON string of gaze data coordinates (JSON body only)
+    """
+    data = request.args if is_packed_request() else (request.json or {})
+    response_id = data.get('responseId')
+    filename = data.get('filename')
+    if not response_id or not filename:
+        return {"error": "Missing responseId or filename"}, 400
+    group = data.get('group', 'all')
+    if not valid_response_id(response_id):
+        return {"error": "responseId must be a printable string of at most 256 characters"}, 400
+    if not valid_group(group):
+        return {"error": "group must be 1-64 letters, digits, '_' or '-'"}, 400
+    try:
+        width, height = render.display_size(data.get('width'), data.get('height'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    try:
+        points = request_gaze_points()
+    except (gaze_codec.GazeFormatError, KeyError, TypeError, ValueError) as e:
+        return {"error": f"Invalid request: {e}"}, 400
+
+    cohort = get_cohort_store().get(cohort_id)
+    try:
+        added = cohort.add_response(response_id, filename, width, height, points, group=group)
+    except CohortError as e:
+        return {"error": str(e)}, 409
+    return {**cohort.summary(), "added": added}, 201 if added else 200
+
+
+@api_heatmap.route("/cohorts/<cohort_id>/summary", methods=["GET"])
+def get_cohort_summary(cohort_id):
+    summary = get_cohort_store().get(cohort_id).summary()
+    if summary['filename'] is None:
+        return {"error": f"Cohort '{cohort_id}' has no responses"}, 404
+    return summary
+
+
+@api_heatmap.route("/cohorts/<cohort_id>", methods=["GET"])
+def get_cohort_heatmap(cohort_id):
+    """Renders the aggregate heatmap of a question's responses.
+
+    Inputs (query parameters):
+        width, height: display size to render at
+        groups: optional comma-separated respondent groups; default all groups
+        format: optional output encoding, "png" (default), "jpeg" or "webp"
+    """
+    try:
+        width, height = render.display_size(request.args.get('width'), request.args.get('height'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    output_format = request.args.get('format', 'png')
+    if output_format not in render.FORMATS:
+        return {"error": f"Unsupported format '{output_format}'"}, 400
+    groups = [g for g in request.args.get('groups', '').split(',') if g] or None
+
+    cohort = get_cohort_store().get(cohort_id)
+    # Summary and grid come from one locked read, so the counts in the cache key match the grid
+    summary, grid, responses = cohort.combined_grid(groups)
+    if grid is None or responses == 0:
+        return {"error": f"Cohort '{cohort_id}' has no matching responses"}, 404
+    filename = summary['filename']
+
+    bucket = gcs.get_bucket(BUCKET_NAME, GOOGLE_APPLICATION_CREDENTIALS)
+    exists, generation = get_image_cache().current_generation(bucket, filename)
+    if not exists:
+        return {"error": f"File '{filename}' not found in bucket"}, 404
+
+    # The group counts change whenever a response is added, so they version the render
+    state = json.dumps({"cohort": cohort_id, "groups": groups, "counts": summary['groups']}, sort_keys=True)
+    params = {"sigma": HEATMAP_SIGMA, "alpha": HEATMAP_ALPHA, "format": output_format}
+    key = result_cache.digest(filename, generation, width, height, state, params)
+    results = get_result_cache()
+    if result_cache.etag_matches(request.headers.get("If-None-Match"), key):
+        results.not_modified()
+        return not_modified_response(key)
+    cached = results.get(key)
+    if cached is not None:
+        return cached_image_response(cached, output_format, key, filename="cohort-heatmap")
+
+    try:
+        img = get_pixel_cache().get(bucket, filename, width, height)
+    except Exception as e:
+        return {"error": f"Could not open image: {str(e)}"}, 500
+    if img is None:
+        return {"error": f"File '{filename}' not found in bucket"}, 404
+
+    # One blur at grid resolution (sigma scaled to match), then upsample to the display size
+    grid_height, grid_width = grid.shape
+    density = blur(grid, HEATMAP_SIGMA * grid_width / width)
+    density = cv2.resize(density, (width, height), interpolation=cv2.INTER_LINEAR)
+    image_bytes = render.render_heatmap(img, normalize(density), fmt=output_format, alpha=HEATMAP_ALPHA).getvalue()
+    results.put(key, image_bytes)
+    return cached_image_response(image_bytes, output_format, key, filename="cohort-heatmap")
@@ -0,0 +1,283 @@
+"""Two-tier (memory + disk) LRU cache for source images fetched from the bucket.
+
+The same survey image is viewed by many respondents, so downloading it on
+every heatmap request is wasted work. Entries are keyed by bucket/blob name
+and stored content-addressed by generation, so a re-uploaded blob never
+serves stale bytes:
+
+    memory   OrderedDict of raw bytes, bounded by IMAGE_CACHE_MEMORY_MB
+    disk     <IMAGE_CACHE_DIR>/<sha1(bucket/blob)>-<generation>, bounded by
+             IMAGE_CACHE_DISK_MB and evicted least-recently-used first
+
+An entry younger than IMAGE_CACHE_REVALIDATE_SECONDS is served without
+contacting the bucket. Older entries are revalidated with a conditional
+download (if_generation_not_match), which costs a 304 when nothing changed.
+
+The disk tier is shared by every process using IMAGE_CACHE_DIR (the Flask
+app and the bot's worker pool), so the directory itself is its index, as in
+result_cache.DiskStore: reads open the file directly and bump its mtime,
+stores write atomically and then trim the directory, oldest mtime first,
+under an flock on .lock where available. What a process keeps in memory is
+only its own memory tier and when it last validated each generation; a
+file it has not validated yet is revalidated before being served.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .gcs import NotFound, NotModified
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is then only serialized within a process
+    fcntl = None
+
+MEMORY_BYTES = int(float(os.getenv('IMAGE_CACHE_MEMORY_MB', '64')) * 1024 * 1024)
+DISK_BYTES = int(float(os.getenv('IMAGE_CACHE_DISK_MB', '1024')) * 1024 * 1024)
+REVALIDATE_SECONDS = float(os.getenv('IMAGE_CACHE_REVALIDATE_SECONDS', '30'))
+CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'eye-sense-image-cache'))
+
+
+class _Entry:
+    __slots__ = ('generation', 'etag', 'checked_at')
+
+    def __init__(self, generation, etag, checked_at):
+        self.generation = generation
+        self.etag = etag
+        self.checked_at = checked_at
+
+
+class BlobCache:
+    """Memory + disk LRU of blob bytes, validated against the blob generation."""
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_bytes=MEMORY_BYTES, disk_bytes=DISK_BYTES,
+                 revalidate_seconds=REVALIDATE_SECONDS):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.revalidate_seconds = revalidate_seconds
+
+        self._lock = threading.Lock()
+        self._entries = {}            # key -> _Entry this process has seen
+        self._memory = OrderedDict()  # key -> bytes, oldest first
+        self._memory_used = 0
+        self.counters = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0,
+                         'revalidations': 0, 'not_modified': 0, 'evictions': 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(bucket_name, blob_name):
+        return hashlib.sha1(f"{bucket_name}/{blob_name}".encode('utf-8')).hexdigest()
+
+    def _path(self, key, generation):
+        return os.path.join(self.cache_dir, f"{key}-{generation}")
+
+    def _files(self, key=None):
+        """(mtime, key, generation, size) of every complete file (or only key's), oldest first."""
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                name_key, _, generation = entry.name.partition('-')
+                if not generation.isdigit() or (key is not None and name_key != key):
+                    continue  # .lock, *.tmp
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process meanwhile
+                files.append((stat.st_mtime, name_key, int(generation), stat.st_size))
+        return sorted(files)
+
+    def _remove(self, key, generation):
+        try:
+            os.remove(self._path(key, generation))
+        except FileNotFoundError:
+            pass
+
+    def _disk_lock(self):
+        lock_file = open(os.path.join(self.cache_dir, '.lock'), 'a')
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _count(self, name):
+        self.counters[name] += 1
+
+    def stats(self):
+        """Returns hit/miss counters and current tier usage (the disk tier across processes)."""
+        files = self._files()
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                'entries': len(files),
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'disk_bytes': sum(size for _, _, _, size in files),
+            }
+
+    def _lookup(self, key):
+        """This process's entry for key, else one for the newest file another process stored.
+
+        A file found on disk has not been validated by this process yet.
+        Caller holds the lock.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            files = self._files(key)
+            if files:
+                generation = max(generation for _, _, generation, _ in files)
+                entry = self._entries[key] = _Entry(generation, None, float("-inf"))
+        return entry
+
+    def _read(self, key, entry):
+        """Returns cached bytes from memory or disk, or None. Caller holds the lock."""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self._count('memory_hits')
+            return data
+        path = self._path(key, entry.generation)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used for every process's eviction
+        except FileNotFoundError:
+            return None  # evicted, possibly by another process
+        self._remember(key, data)
+        self._count('disk_hits')
+        return data
+
+    def _remember(self, key, data):
+        """Puts bytes in the memory tier. Caller holds the lock."""
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key))
+        if len(data) > self.memory_bytes:
+            return
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_used -= len(old)
+
+    def _drop(self, key):
+        """Forgets key in this process and removes its files. Caller holds the lock."""
+        self._entries.pop(key, None)
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key))
+        for _, _, generation, _ in self._files(key):
+            self._remove(key, generation)
+
+    def _store(self, key, data, generation, etag):
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key, generation))
+        with self._lock:
+            self._entries[key] = _Entry(generation, etag, time.monotonic())
+            self._remember(key, data)
+        evicted = 0
+        with self._disk_lock():
+            files = []
+            for file in self._files():
+                if file[1] == key and file[2] != generation:
+                    self._remove(key, file[2])  # superseded generation
+                else:
+                    files.append(file)
+            used = sum(size for _, _, _, size in files)
+            for _, name, file_generation, size in files:
+                if used <= self.disk_bytes:
+                    break
+                self._remove(name, file_generation)
+                used -= size
+                evicted += 1
+        with self._lock:
+            self.counters['evictions'] += evicted
+
+    def get(self, bucket, blob_name):
+        """Returns the blob's bytes, downloading only when missing or changed.
+
+        Returns None if the blob does not exist in the bucket.
+        """
+        key = self._key(bucket.name, blob_name)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+                data = self._read(key, entry)
+                if data is not None:
+                    self._count('hits')
+                    return data
+            generation = entry.generation if entry is not None else None
+            if generation is not None:
+                self._count('revalidations')
+
+        blob = bucket.blob(blob_name)
+        try:
+            if generation is not None:
+                data = blob.download_as_bytes(if_generation_not_match=generation)
+            else:
+                data = blob.download_as_bytes()
+        except NotModified:
+            with self._lock:
+                self._count('not_modified')
+                entry.checked_at = time.monotonic()
+                data = self._read(key, entry)
+                if data is not None:
+                    self._count('hits')
+                    return data
+            # Evicted between the check and the read; fetch it again
+            data = blob.download_as_bytes()
+        except NotFound:
+            with self._lock:
+                self._drop(key)
+            return None
+
+        with self._lock:
+            self._count('misses')
+        if blob.generation is not None:
+            self._store(key, data, blob.generation, blob.etag)
+        return data
+
+    def current_generation(self, bucket, blob_name):
+        """Returns (exists, generation) for a blob, revalidating like get() does.
+
+        Cheap when the entry is fresh: no bytes are read from either tier.
+        generation is None if the backend did not report one.
+        """
+        key = self._key(bucket.name, blob_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.checked_at < self.revalidate_seconds:
+                return True, entry.generation
+        if self.get(bucket, blob_name) is None:
+            return False, None
+        with self._lock:
+            entry = self._entries.get(key)
+            return True, entry.generation if entry is not None else None
+
+    def clear(self):
+        """Empties both tiers, including files other processes stored (counters are kept)."""
+        with self._lock, self._disk_lock():
+            self._entries.clear()
+            self._memory.clear()
+            self._memory_used = 0
+            for _, key, generation, _ in self._files():
+                self._remove(key, generation)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Returns the process-wide BlobCache, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = BlobCache()
+    return _cache
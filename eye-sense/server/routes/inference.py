@@ -0,0 +1,119 @@
+"""Routes serving the learned heatmap model from a resident, warm predictor.
+
+The model is loaded and warmed once at server startup (app.py calls
+preload_model; INFERENCE_PRELOAD=1, the default) instead of once per
+prediction.
+Concurrent requests share forward passes through the PredictionBatcher.
+"""
+import os
+from io import BytesIO
+
+import cv2
+import numpy as np
+from flask import Blueprint, jsonify, make_response, request
+from PIL import Image
+
+from . import pipeline, render
+from .batcher import QueueFullError, get_batcher
+from .et_bot_utils import fit_long_side
+from .heatmap import request_bot_image
+from .pipeline import Pipeline, Stage
+from .predictor import ModelUnavailableError, get_predictor, preload
+
+PRELOAD = os.getenv('INFERENCE_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+# Long side (px) of the overlay returned by /predict; 0 = the upload's own size
+OUTPUT_SIZE = int(os.getenv('INFERENCE_OUTPUT_SIZE', '1000'))
+
+OUTPUTS = ("overlay", "heatmap")
+
+api_inference = Blueprint("inference", __name__)
+
+
+def preload_model():
+    """Loads and warms the model; called once by the serving entry point (app.py)."""
+    if PRELOAD:
+        preload()
+
+
+def stage_decode(ctx):
+    ctx['raw'] = np.asarray(Image.open(BytesIO(ctx['image_bytes'])).convert('RGB'))
+
+
+def stage_prepare(ctx):
+    # Resizing and scaling run on the request thread, in parallel across requests
+    ctx['input'] = get_predictor().prepare(ctx['raw'])
+
+
+def stage_predict(ctx):
+    # Includes the wait for the batch to fill (at most INFERENCE_MAX_WAIT_MS)
+    ctx['heatmap'] = get_batcher().predict(ctx['input'])
+
+
+def stage_render(ctx):
+    if ctx['output'] == 'heatmap':
+        # Grayscale at the model's resolution, like the training targets
+        ok, png = cv2.imencode('.png', np.round(ctx['heatmap'] * 255).astype(np.uint8))
+        if not ok:
+            raise ValueError("Could not encode heatmap")
+        ctx['png'] = png.tobytes()
+        return
+    image = fit_long_side(ctx['raw'], OUTPUT_SIZE)[0]
+    h, w = image.shape[:2]
+    density = cv2.resize(ctx['heatmap'], (w, h), interpolation=cv2.INTER_LINEAR)
+    ctx['png'] = render.render_heatmap(image, density).getvalue()
+
+
+INFERENCE_PIPELINE = Pipeline('inference', [
+    Stage('decode', stage_decode),
+    Stage('prepare', stage_prepare),
+    Stage('predict', stage_predict),
+    Stage('render', stage_render),
+])
+
+
+@api_inference.route("/", methods=["GET"])
+def get_model_status():
+    """Returns whether the model is loaded, its load/warm-up times, prediction counters and
+    the batcher's batch-size and queue-wait histograms."""
+    try:
+        return jsonify({**get_predictor().stats(), "batching": get_batcher().stats()})
+    except ModelUnavailableError as e:
+        return {"loaded": False, "error": str(e)}, 503
+
+
+@api_inference.route("/predict", methods=["POST"])
+def predict():
+    """Predicts an expert-attention heatmap for a skin lesion image with the learned model.
+
+    Inputs:
+        image: uploaded image file, or
+        filename: form field naming a blob in the GCP bucket (served from the image cache)
+        output: optional form field; "overlay" (default) blends the heatmap over the
+                image, "heatmap" returns the raw grayscale heatmap at model resolution
+
+    Returns:
+        PNG with a Server-Timing header, or
+        503 if the model is not loaded or too many predictions are waiting (with Retry-After)
+    """
+    image_bytes, error = request_bot_image()
+    if error:
+        return error
+    output = request.form.get('output', 'overlay')
+    if output not in OUTPUTS:
+        return {"error": f"output must be one of {', '.join(OUTPUTS)}"}, 400
+
+    try:
+        ctx, timings = INFERENCE_PIPELINE.run(image_bytes=image_bytes, output=output)
+    except ModelUnavailableError as e:
+        return {"error": str(e)}, 503
+    except QueueFullError as e:
+        return {"error": str(e)}, 503, {"Retry-After": "1"}
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+    response = make_response(ctx['png'])
+    response.mimetype = 'image/png'
+    response.headers["Content-Disposition"] = f"inline; filename=predicted-{output}.png"
+    response.headers["Server-Timing"] = pipeline.server_timing(timings)
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
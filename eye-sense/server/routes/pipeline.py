@@ -0,0 +1,97 @@
+"""Small staged-pipeline runner with per-stage instrumentation.
+
+A Pipeline is an ordered list of named stages. Each stage is a function
+that reads and writes a shared context dict; a stage whose skip(ctx) is
+true is recorded but not run. Every run records, per stage:
+
+    ms          wall time
+    skipped     whether the stage was skipped
+    out_bytes   size of the arrays/bytes the stage added or replaced in ctx
+    rss_mb      process peak RSS after the stage (where available)
+
+The timings are turned into a Server-Timing header value, and can also be
+printed as one JSON line per run with PIPELINE_LOG=1 (off by default, as
+the header already carries them).
+"""
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PIPELINE_LOG = os.getenv('PIPELINE_LOG', '0').lower() in ('1', 'true', 'yes')
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _size(value):
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 0
+
+
+class Stage:
+    def __init__(self, name, fn, skip=None):
+        self.name = name
+        self.fn = fn
+        self.skip = skip
+
+
+class Pipeline:
+    """Ordered named stages over a context dict."""
+
+    def __init__(self, name, stages=()):
+        self.name = name
+        self.stages = list(stages)
+
+    def then(self, name, fn, skip=None):
+        """Returns a new pipeline with one more stage appended."""
+        return Pipeline(self.name, self.stages + [Stage(name, fn, skip)])
+
+    def replace(self, name, fn, skip=None):
+        """Returns a new pipeline with the named stage swapped for fn."""
+        if name not in [stage.name for stage in self.stages]:
+            raise KeyError(f"No stage '{name}' in pipeline '{self.name}'")
+        return Pipeline(self.name, [Stage(name, fn, skip) if stage.name == name else stage
+                                    for stage in self.stages])
+
+    def run(self, **inputs):
+        """Runs every stage on a context built from inputs. Returns (ctx, timings)."""
+        ctx = dict(inputs)
+        timings = []
+        try:
+            for stage in self.stages:
+                if stage.skip is not None and stage.skip(ctx):
+                    timings.append({'stage': stage.name, 'ms': 0.0, 'skipped': True})
+                    continue
+                before = {key: id(value) for key, value in ctx.items()}
+                start = time.perf_counter()
+                stage.fn(ctx)
+                elapsed = time.perf_counter() - start
+                out_bytes = sum(_size(value) for key, value in ctx.items() if before.get(key) != id(value))
+                timings.append({'stage': stage.name, 'ms': round(elapsed * 1000, 2), 'skipped': False,
+                                'out_bytes': out_bytes, 'rss_mb': _peak_rss_mb()})
+        finally:
+            if PIPELINE_LOG:
+                log_timings(self.name, timings)
+        return ctx, timings
+
+
+def log_timings(name, timings):
+    total = sum(t['ms'] for t in timings)
+    print(json.dumps({'pipeline': name, 'total_ms': round(total, 2), 'stages': timings}))
+
+
+def server_timing(timings):
+    """Server-Timing header value, e.g. 'zoom;dur=12.1, hair;dur=40.3'. Skipped stages are left out."""
+    return ", ".join(f"{t['stage']};dur={t['ms']}" for t in timings if not t['skipped'])
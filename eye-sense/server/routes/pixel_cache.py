@@ -0,0 +1,139 @@
+"""In-memory LRU of decoded, resized source images keyed by (blob, width, height).
+
+Survey viewers mostly share a handful of viewport sizes, so after the first
+request for a size the PIL decode + BILINEAR resize is skipped entirely.
+Entries are compact read-only uint8 RGB arrays, bounded by PIXEL_CACHE_MB,
+and include the blob generation in their key so a re-uploaded image is
+decoded again. The byte-level BlobCache (image_cache.py) sits underneath.
+"""
+import os
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .image_cache import get_image_cache
+
+MEMORY_BYTES = int(float(os.getenv('PIXEL_CACHE_MB', '256')) * 1024 * 1024)
+PREWARM_WORKERS = int(os.getenv('PIXEL_CACHE_PREWARM_WORKERS', '4'))
+
+
+def decode_resized(image_bytes, width, height):
+    """Decodes image bytes and resizes to (width, height) as generate_heatmap does."""
+    img = Image.open(BytesIO(image_bytes))
+    img = img.resize((width, height), Image.BILINEAR)
+    return np.asarray(img.convert("RGB"))
+
+
+class PixelCache:
+    """LRU of (height, width, 3) uint8 arrays with a total byte budget."""
+
+    def __init__(self, memory_bytes=MEMORY_BYTES, blob_cache=None):
+        self.memory_bytes = memory_bytes
+        self.blob_cache = blob_cache or get_image_cache()
+        self._lock = threading.Lock()
+        self._arrays = OrderedDict()
+        self._used = 0
+        self._sizes = Counter()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def stats(self):
+        """Returns hit/miss counters, usage and the most requested sizes."""
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._arrays),
+                'bytes': self._used,
+                'common_sizes': [list(size) for size, _ in self._sizes.most_common(5)],
+            }
+
+    def common_sizes(self, n=3):
+        """Returns the n most requested (width, height) pairs so far."""
+        with self._lock:
+            return [size for size, _ in self._sizes.most_common(n)]
+
+    def _put(self, key, pixels):
+        """Caller holds the lock."""
+        if pixels.nbytes > self.memory_bytes:
+            return
+        if key in self._arrays:
+            self._used -= self._arrays.pop(key).nbytes
+        self._arrays[key] = pixels
+        self._used += pixels.nbytes
+        while self._used > self.memory_bytes:
+            _, old = self._arrays.popitem(last=False)
+            self._used -= old.nbytes
+            self.counters['evictions'] += 1
+
+    def get(self, bucket, blob_name, width, height, count_size=True):
+        """Returns the blob decoded and resized to (width, height), or None if missing.
+
+        Raises whatever PIL raises if the blob is not a decodable image.
+        """
+        exists, generation = self.blob_cache.current_generation(bucket, blob_name)
+        if not exists:
+            return None
+        key = (bucket.name, blob_name, generation, width, height)
+        with self._lock:
+            if count_size:
+                self._sizes[(width, height)] += 1
+            pixels = self._arrays.get(key)
+            if pixels is not None:
+                self._arrays.move_to_end(key)
+                self.counters['hits'] += 1
+                return pixels
+            self.counters['misses'] += 1
+
+        image_bytes = self.blob_cache.get(bucket, blob_name)
+        if image_bytes is None:
+            return None
+        pixels = decode_resized(image_bytes, width, height)
+        pixels.setflags(write=False)
+        if generation is not None:
+            with self._lock:
+                self._put(key, pixels)
+        return pixels
+
+    def prewarm(self, bucket, blob_names, sizes=None, workers=PREWARM_WORKERS):
+        """Decodes every blob at every size, in parallel. Returns the number of entries filled.
+
+        sizes defaults to the most common viewport sizes seen so far.
+        Missing or undecodable blobs are skipped.
+        """
+        sizes = sizes or self.common_sizes()
+        jobs = [(name, int(w), int(h)) for name in blob_names for w, h in sizes]
+
+        def warm(job):
+            name, w, h = job
+            try:
+                return self.get(bucket, name, w, h, count_size=False) is not None
+            except Exception as e:
+                print(f"Prewarm failed for {name} at {w}x{h}:", e)
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return sum(pool.map(warm, jobs))
+
+    def clear(self):
+        with self._lock:
+            self._arrays.clear()
+            self._used = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_pixel_cache():
+    """Returns the process-wide PixelCache, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PixelCache()
+    return _cache
@@ -0,0 +1,155 @@
+"""Resident heatmap model for the inference routes.
+
+run_prediction.predict_on_image, GCPHeatmapModel.predict_on_image and
+testDLmodel.py load the Keras model for every prediction, which takes far
+longer than the forward pass itself. A HeatmapPredictor loads the model
+once, traces its forward pass for a fixed input signature and runs a dummy
+batch through it, so the first real request already hits a warm graph.
+
+Configured with:
+
+    MODEL_PATH          saved model (.keras file or SavedModel directory)
+    MODEL_INPUT_SIZE    square input side the model was trained at
+    MODEL_COLOR_ORDER   channel order it was trained on: "bgr" for
+                        GCPHeatmapModel (cv2), "rgb" for DLmodel (tf.image)
+    MODEL_WARMUP_BATCH  size of the dummy warm-up batch
+"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import tensorflow as tf
+except ImportError:  # the rest of the API runs without TensorFlow
+    tf = None
+
+MODEL_PATH = os.getenv('MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml',
+                                                  'models', 'gcp_heatmap_predictor'))
+INPUT_SIZE = int(os.getenv('MODEL_INPUT_SIZE', '256'))
+COLOR_ORDER = os.getenv('MODEL_COLOR_ORDER', 'bgr')
+WARMUP_BATCH = int(os.getenv('MODEL_WARMUP_BATCH', '1'))
+
+COLOR_ORDERS = ('rgb', 'bgr')
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised when TensorFlow or the saved model is missing, or the model fails to load."""
+
+
+class HeatmapPredictor:
+    """A loaded heatmap model and its traced forward pass.
+
+    Images come in as (H, W, 3) uint8 RGB arrays of any size; heatmaps go out
+    as (INPUT_SIZE, INPUT_SIZE) float32 arrays in [0, 1].
+    """
+
+    def __init__(self, model_path=MODEL_PATH, input_size=INPUT_SIZE, color_order=COLOR_ORDER):
+        if color_order not in COLOR_ORDERS:
+            raise ValueError(f"Unknown color order '{color_order}', expected one of {COLOR_ORDERS}")
+        self.model_path = os.path.abspath(model_path)
+        self.input_size = input_size
+        self.color_order = color_order
+        self.model = None
+        self._forward = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._lock = threading.Lock()
+        self.counters = {'batches': 0, 'images': 0, 'seconds': 0.0}
+
+    def load(self):
+        if tf is None:
+            raise ModelUnavailableError("TensorFlow is not installed")
+        if not os.path.exists(self.model_path):
+            raise ModelUnavailableError(f"Model not found at {self.model_path}. Please train the model first.")
+        start = time.perf_counter()
+        try:
+            # compile=False: inference needs neither the optimizer nor custom losses like mse_ssim_loss
+            model = tf.keras.models.load_model(self.model_path, compile=False)
+        except Exception as e:
+            raise ModelUnavailableError(f"Could not load model from {self.model_path}: {e}")
+        size = self.input_size
+        # One trace for every batch size; model.predict would rebuild a tf.data pipeline per call
+        self._forward = tf.function(lambda x: model(x, training=False),
+                                    input_signature=[tf.TensorSpec([None, size, size, 3], tf.float32)])
+        self.model = model
+        self.load_seconds = time.perf_counter() - start
+        return self
+
+    def warm_up(self, batch_size=WARMUP_BATCH):
+        """Runs a dummy batch so tracing and kernel setup happen before the first request."""
+        start = time.perf_counter()
+        self._run(np.zeros((batch_size, self.input_size, self.input_size, 3), dtype=np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+        return self
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def prepare(self, image):
+        """(H, W, 3) uint8 RGB -> model input: resized, in the training channel order, float32 in [0, 1]."""
+        resized = cv2.resize(image, (self.input_size, self.input_size), interpolation=cv2.INTER_LINEAR)
+        if self.color_order == 'bgr':
+            resized = resized[..., ::-1]
+        return resized.astype(np.float32) * np.float32(1 / 255.0)
+
+    def _run(self, batch):
+        out = self._forward(tf.convert_to_tensor(batch)).numpy()
+        return np.clip(out.reshape(len(batch), self.input_size, self.input_size), 0.0, 1.0)
+
+    def predict_batch(self, batch):
+        """Heatmaps for an (N, S, S, 3) batch of prepared inputs."""
+        if not self.loaded:
+            raise ModelUnavailableError("Model is not loaded")
+        start = time.perf_counter()
+        heatmaps = self._run(batch)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['images'] += len(batch)
+            self.counters['seconds'] += elapsed
+        return heatmaps
+
+    def predict(self, image):
+        """Heatmap for one (H, W, 3) uint8 RGB image."""
+        return self.predict_batch(self.prepare(image)[None])[0]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        batches = counters.pop('batches')
+        seconds = counters.pop('seconds')
+        return {'loaded': self.loaded, 'model_path': self.model_path, 'input_size': self.input_size,
+                'color_order': self.color_order, 'load_seconds': self.load_seconds,
+                'warmup_seconds': self.warmup_seconds, 'batches': batches, **counters,
+                'mean_batch_ms': seconds / batches * 1000 if batches else 0.0}
+
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+
+def get_predictor():
+    """Returns the process-wide warm HeatmapPredictor, loading it on first use.
+
+    Raises ModelUnavailableError if it cannot be loaded; the next call tries again.
+    """
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = HeatmapPredictor().load().warm_up()
+    return _predictor
+
+
+def preload():
+    """Loads and warms the model at startup; failures are logged and left for the routes to report."""
+    try:
+        predictor = get_predictor()
+        print(f"Heatmap model loaded from {predictor.model_path} in {predictor.load_seconds:.1f}s, "
+              f"warmed up in {predictor.warmup_seconds:.2f}s")
+    except ModelUnavailableError as e:
+        print(f"Heatmap model not loaded: {e}")
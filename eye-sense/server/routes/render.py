@@ -0,0 +1,121 @@
+"""Heatmap overlay renderer that composites directly in NumPy.
+
+Replaces the plt.figure -> imshow x2 -> savefig path: the normalized density
+is mapped through a precomputed 256-entry jet lookup table, alpha-blended
+over the image and encoded straight to PNG/JPEG/WebP with Pillow. No pyplot
+global state is touched, so it is safe to call from any worker thread, and
+the output has exactly the same width and height as the input image.
+"""
+import os
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# matplotlib's 'jet' segment data: (x, value below x, value above x)
+_JET_SEGMENTS = {
+    "red": ((0.0, 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1.0, 0.5, 0.5)),
+    "green": ((0.0, 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1.0, 0, 0)),
+    "blue": ((0.0, 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1.0, 0, 0)),
+}
+
+FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# Largest display size a request may ask for; every size allocates grids and images of that many pixels
+MAX_SIDE = int(os.getenv('HEATMAP_MAX_SIDE', '4096'))
+MAX_PIXELS = int(os.getenv('HEATMAP_MAX_PIXELS', str(3840 * 2160)))
+
+
+def display_size(width, height):
+    """Parses a requested (width, height) display size.
+
+    Raises ValueError with a client-facing message if either is not an
+    integer, not positive, over HEATMAP_MAX_SIDE, or the area is over
+    HEATMAP_MAX_PIXELS.
+    """
+    try:
+        width, height = int(width), int(height)
+    except (TypeError, ValueError):
+        raise ValueError("width and height must be integers")
+    if width <= 0 or height <= 0:
+        raise ValueError("width and height must be positive")
+    if width > MAX_SIDE or height > MAX_SIDE or width * height > MAX_PIXELS:
+        raise ValueError(f"width and height must each be at most {MAX_SIDE} px, and at most {MAX_PIXELS} px in total")
+    return width, height
+
+
+def _build_jet_lut(n=256):
+    """Samples the jet colormap at n points, as matplotlib does for cmap='jet'."""
+    x = np.linspace(0, 1, n)
+    channels = []
+    for name in ("red", "green", "blue"):
+        seg = np.array(_JET_SEGMENTS[name], dtype=np.float64)
+        channels.append(np.interp(x, seg[:, 0], seg[:, 1]))
+    return np.stack(channels, axis=-1).astype(np.float32)
+
+
+# (256, 3) float32 in [0, 1]; blending is done in float and rounded once
+JET_LUT = _build_jet_lut()
+
+
+def colorize(density, lut=JET_LUT):
+    """Maps a [0, 1] density grid to (H, W, 3) float32 colors via the LUT."""
+    n = len(lut)
+    idx = np.clip((density * n).astype(np.intp), 0, n - 1)
+    return lut[idx]
+
+
+def to_rgb(image):
+    """Returns a PIL image or array as an (H, W, 3) uint8 array."""
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert("RGB"))
+    image = np.asarray(image)
+    if image.ndim == 2:
+        return np.repeat(image[..., None], 3, axis=-1)
+    if image.shape[-1] == 4:
+        return image[..., :3]
+    return image
+
+
+def overlay(image, density, alpha=0.4, lut=JET_LUT):
+    """Alpha-blends the colorized density over the image.
+
+    image and density must have the same height and width. Returns an
+    (H, W, 3) uint8 array.
+    """
+    rgb = to_rgb(image)
+    if rgb.shape[:2] != density.shape:
+        raise ValueError(f"Image size {rgb.shape[:2]} does not match heatmap size {density.shape}")
+
+    blended = colorize(density, lut)
+    blended *= alpha * 255.0
+    blended += rgb * np.float32(1.0 - alpha)
+    return np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+
+def encode_image(rgb, fmt="png", quality=90):
+    """Encodes an (H, W, 3) uint8 array and returns a rewound BytesIO."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported output format '{fmt}', expected one of {sorted(FORMATS)}")
+    pil_format, _ = FORMATS[fmt]
+
+    buf = BytesIO()
+    options = {"optimize": False, "compress_level": 1} if pil_format == "PNG" else {"quality": quality}
+    Image.fromarray(rgb).save(buf, format=pil_format, **options)
+    buf.seek(0)
+    return buf
+
+
+def mimetype(fmt):
+    """Returns the Content-Type for an output format."""
+    return FORMATS[fmt][1]
+
+
+def render_heatmap(image, density, fmt="png", alpha=0.4, quality=90):
+    """Overlays a normalized density on the image and encodes it in one step."""
+    return encode_image(overlay(image, density, alpha), fmt, quality)
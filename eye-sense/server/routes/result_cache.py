@@ -0,0 +1,223 @@
+"""Cache of rendered heatmap images keyed by a digest of everything that
+goes into them.
+
+The dashboards re-request the same response heatmap over and over. A render
+is fully determined by (filename, blob generation, width, height, gaze
+payload, render params), so the sha256 of those is both the cache key and a
+strong ETag: a matching If-None-Match can be answered with 304 without even
+looking in the store.
+
+The store is pluggable via RESULT_CACHE_BACKEND:
+
+    memory  (default) in-process LRU bounded by RESULT_CACHE_MB
+    disk    files under RESULT_CACHE_DIR, bounded by RESULT_CACHE_MB
+    none    disables storage (ETag/304 handling still works)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction is then only serialized within a process
+    fcntl = None
+
+BACKEND = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+MAX_BYTES = int(float(os.getenv('RESULT_CACHE_MB', '128')) * 1024 * 1024)
+CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'eye-sense-result-cache'))
+CACHE_CONTROL = os.getenv('RESULT_CACHE_CONTROL', 'private, max-age=3600')
+
+
+def digest(filename, generation, width, height, gaze_payload, params):
+    """Returns the hex sha256 identifying one rendered heatmap."""
+    h = hashlib.sha256()
+    header = {'filename': filename, 'generation': generation, 'width': width, 'height': height,
+              'params': params}
+    h.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+    h.update(b'\0')
+    h.update(gaze_payload if isinstance(gaze_payload, bytes) else str(gaze_payload).encode('utf-8'))
+    return h.hexdigest()
+
+
+def etag_for(key):
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match, key):
+    """True if an If-None-Match header value covers this key."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag_for(key) in tags
+
+
+class MemoryStore:
+    """In-process LRU of encoded images with a byte budget."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._used = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._used -= len(self._items.pop(key))
+            self._items[key] = value
+            self._used += len(value)
+            while self._used > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._used -= len(old)
+
+    def usage(self):
+        with self._lock:
+            return {'entries': len(self._items), 'bytes': self._used}
+
+
+class DiskStore:
+    """Encoded images as files named by digest, evicted least-recently-used first.
+
+    The directory itself is the index, so several processes (the Flask app
+    and the bot's worker pool) can share one store: get() opens the file
+    directly and bumps its mtime, put() writes atomically and then trims the
+    directory back to max_bytes, oldest mtime first, under an flock on
+    .lock where available. Puts only follow a miss, so the directory scan
+    is cheap next to the work being cached.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entries(self):
+        """(mtime, name, size) of every complete entry, oldest first."""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process meanwhile
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        return sorted(entries)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used for every process's eviction
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+        with self._lock, open(os.path.join(self.cache_dir, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self._entries()
+            used = sum(size for _, _, size in entries)
+            for _, name, size in entries:
+                if used <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+                used -= size
+
+    def usage(self):
+        entries = self._entries()
+        return {'entries': len(entries), 'bytes': sum(size for _, _, size in entries)}
+
+
+class NullStore:
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        pass
+
+    def usage(self):
+        return {'entries': 0, 'bytes': 0}
+
+
+STORES = {'memory': MemoryStore, 'disk': DiskStore, 'none': NullStore}
+
+
+class ResultCache:
+    """Counts hits/misses/304s around a pluggable store."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        value = self.store.get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def put(self, key, value):
+        self.store.put(key, value)
+
+    def not_modified(self):
+        self._count('not_modified')
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        return {**counters, 'hit_rate': counters['hits'] / lookups if lookups else 0.0,
+                'backend': type(self.store).__name__, **self.store.usage()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide ResultCache using RESULT_CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if BACKEND not in STORES:
+                    raise ValueError(f"Unknown RESULT_CACHE_BACKEND '{BACKEND}', expected one of {sorted(STORES)}")
+                _cache = ResultCache(STORES[BACKEND]())
+    return _cache
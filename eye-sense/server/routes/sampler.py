@@ -0,0 +1,185 @@
+"""Simulated expert gaze: points sampled on a lesion's border and inside its mask.
+
+All samplers return (N, 2) int32 arrays of (x, y) and draw from an explicit
+np.random.Generator, so a run is reproducible from its seed.
+
+The analytic mode skips sampling altogether. The sampled histogram's
+expected value is known in closed form: each contour vertex receives
+num_border / len(contour) and each mask pixel num_internal / mask area.
+Blurring that grid gives the noise-free heatmap that many sampled runs
+average to, in one pass and without drawing any points.
+
+The distance mode approximates that blurred grid in closed form from the
+mask's signed distance field (two cv2.distanceTransform passes): the
+border's mass, spread evenly along the perimeter, falls off as a Gaussian
+of the distance to the contour, and the interior's mass, spread evenly
+over the area, is a plateau whose edge follows the normal CDF of the
+signed distance. No point grid and no full-size blur.
+"""
+import cv2
+import numpy as np
+from scipy.special import ndtr
+
+from .density import accumulate_points, blur, normalize
+
+DENSITY_METHODS = ("sampled", "analytic", "distance")
+
+# Falloff (in downsampled pixels) the distance mode keeps after shrinking the mask
+DISTANCE_MIN_FALLOFF = 8.0
+# Distance mode lookup table: entries per falloff, and falloffs covered either side of the edge
+DISTANCE_LUT_STEPS = 64
+DISTANCE_LUT_RANGE = 6
+
+# Give up on rejection sampling below this fraction of mask pixels in the bounding box
+MIN_ACCEPT_RATE = 0.05
+
+
+def get_rng(seed=None):
+    """Returns seed itself if it is a Generator, else np.random.default_rng(seed)."""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def contour_points(contour):
+    """(K, 2) int32 vertices of an OpenCV contour."""
+    return np.asarray(contour, dtype=np.int32).reshape(-1, 2)
+
+
+def sample_border_points(contour, num_points, rng=None):
+    """Samples num_points contour vertices uniformly with replacement."""
+    vertices = contour_points(contour)
+    return vertices[get_rng(rng).integers(0, len(vertices), num_points)]
+
+
+def sample_internal_points(mask, num_points, rng=None):
+    """Samples num_points pixels uniformly (with replacement) where mask == 255.
+
+    Draws candidates in the mask's bounding box and keeps the ones that hit
+    the mask, so only the box is ever touched instead of the whole image.
+    """
+    rng = get_rng(rng)
+    x, y, w, h = cv2.boundingRect((mask == 255).view(np.uint8))
+    if w == 0 or h == 0:
+        return np.empty((0, 2), dtype=np.int32)
+    box = mask[y:y + h, x:x + w] == 255
+    accept_rate = np.count_nonzero(box) / box.size
+    if accept_rate < MIN_ACCEPT_RATE:
+        ys, xs = np.nonzero(box)
+        idx = rng.integers(0, len(xs), num_points)
+        return np.column_stack([xs[idx] + x, ys[idx] + y]).astype(np.int32)
+
+    picked = []
+    remaining = num_points
+    while remaining > 0:
+        batch = int(remaining / accept_rate * 1.2) + 16
+        cx = rng.integers(0, w, batch)
+        cy = rng.integers(0, h, batch)
+        hit = box[cy, cx]
+        picked.append(np.column_stack([cx[hit], cy[hit]])[:remaining])
+        remaining -= len(picked[-1])
+    return (np.concatenate(picked) + (x, y)).astype(np.int32)
+
+
+def sample_points(contour, mask, num_border, num_internal, rng=None):
+    """Border samples followed by internal samples, as one (N, 2) array."""
+    rng = get_rng(rng)
+    return np.concatenate([sample_border_points(contour, num_border, rng),
+                           sample_internal_points(mask, num_internal, rng)])
+
+
+def expected_counts(contour, mask, num_border, num_internal):
+    """Expected per-pixel count grid of sample_points, shaped like mask."""
+    height, width = mask.shape
+    vertices = contour_points(contour)
+    grid = accumulate_points(vertices, width, height,
+                             weights=np.full(len(vertices), num_border / len(vertices), dtype=np.float32))
+    inside = mask == 255
+    area = np.count_nonzero(inside)
+    if area:
+        grid += inside * np.float32(num_internal / area)
+    return grid
+
+
+def signed_distance(mask, factor=1):
+    """Float32 distance (in mask pixels) to the mask edge, positive inside mask == 255.
+
+    With factor > 1 the field is measured on the mask shrunk by factor and
+    returned at that reduced size, edge-padded to a whole number of blocks.
+    """
+    inside = (mask == 255).view(np.uint8)
+    if factor > 1:
+        h, w = inside.shape
+        sh, sw = -(-h // factor), -(-w // factor)
+        inside = cv2.copyMakeBorder(inside, 0, sh * factor - h, 0, sw * factor - w, cv2.BORDER_REPLICATE)
+        # Area averaging of 0/1 rounds to majority coverage of each block
+        inside = cv2.resize(inside, (sw, sh), interpolation=cv2.INTER_AREA)
+    d_in = cv2.distanceTransform(inside, cv2.DIST_L2, 5)
+    d_out = cv2.distanceTransform(1 - inside, cv2.DIST_L2, 5)
+    # Each pixel is zero in one of the two; both measure to the nearest opposite
+    # pixel centre, so the edge itself lies half a pixel closer
+    s = d_in - d_out
+    s -= np.copysign(np.float32(0.5), s)
+    return s * np.float32(factor)
+
+
+def distance_density(contour, mask, border_weight, interior_weight, falloff=30, gamma=None):
+    """Normalized [0, 1] heatmap from the signed distance to the lesion edge, shaped like mask.
+
+    border_weight and interior_weight are the total attention on the border
+    and inside the lesion (the point counts of the other modes); falloff
+    plays the part of the blur sigma. Like the pyramid blur, the field is
+    computed on a grid shrunk until falloff is DISTANCE_MIN_FALLOFF pixels
+    and only the normalized result is upsampled (bilinearly).
+    """
+    height, width = mask.shape
+    area = np.count_nonzero(mask == 255)
+    perimeter = cv2.arcLength(np.asarray(contour, dtype=np.int32).reshape(-1, 1, 2), True)
+    if area == 0 or perimeter == 0:
+        return np.zeros(mask.shape, dtype=np.float32)
+
+    factor = max(1, int(falloff // DISTANCE_MIN_FALLOFF))
+    s = signed_distance(mask, factor)
+    if factor > 1 and not (s > 0).any():
+        # Lesion smaller than one block; measure it at full resolution
+        factor, s = 1, signed_distance(mask)
+    # Iso-distance lines follow every jag of the pixel contour; a blur of half the
+    # falloff rounds them off the way blurring the sampled border would
+    s = cv2.GaussianBlur(s, (0, 0), falloff / factor / 2)
+    # The density depends on s alone, so it is tabulated at 1/DISTANCE_LUT_STEPS falloff
+    # and looked up: a Gaussian-blurred line carrying border_weight / perimeter per pixel
+    # of length, plus a blurred uniform fill of interior_weight / area per pixel (edge
+    # taken as straight). Beyond DISTANCE_LUT_RANGE falloffs both terms are flat.
+    t = np.linspace(-DISTANCE_LUT_RANGE, DISTANCE_LUT_RANGE, 2 * DISTANCE_LUT_RANGE * DISTANCE_LUT_STEPS + 1)
+    profile = (np.exp(-0.5 * t * t) * (border_weight / (perimeter * np.sqrt(2 * np.pi) * falloff))
+               + ndtr(t) * (interior_weight / area)).astype(np.float32)
+    s *= np.float32(DISTANCE_LUT_STEPS / falloff)
+    s += np.float32(DISTANCE_LUT_RANGE * DISTANCE_LUT_STEPS + 0.5)
+    np.clip(s, 0, len(profile) - 1, out=s)
+    density = profile[s.astype(np.int32)]
+    # Normalize (and apply gamma) on the small grid, before upsampling
+    density = normalize(density, gamma)
+    if factor > 1:
+        sh, sw = density.shape
+        density = cv2.resize(density, (sw * factor, sh * factor), interpolation=cv2.INTER_LINEAR)
+        density = np.ascontiguousarray(density[:height, :width])
+    return density
+
+
+def lesion_density(contour, mask, num_border, num_internal, sigma=30, gamma=None, rng=None, method="sampled"):
+    """Normalized [0, 1] heatmap of simulated gaze over a lesion, shaped like mask.
+
+    method is one of DENSITY_METHODS: "sampled" blurs a histogram of
+    sample_points, "analytic" blurs expected_counts and "distance" uses
+    distance_density with the counts as weights and sigma as the falloff.
+    """
+    height, width = mask.shape
+    if method == "distance":
+        return distance_density(contour, mask, num_border, num_internal, falloff=sigma, gamma=gamma)
+    if method == "analytic":
+        grid = expected_counts(contour, mask, num_border, num_internal)
+    elif method == "sampled":
+        grid = accumulate_points(sample_points(contour, mask, num_border, num_internal, rng), width, height)
+    else:
+        raise ValueError(f"Unknown density method '{method}', expected one of {DENSITY_METHODS}")
+    return normalize(blur(grid, sigma), gamma)
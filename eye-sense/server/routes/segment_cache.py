@@ -0,0 +1,137 @@
+"""Persisted cache of the bot's preprocessing artifacts.
+
+Hair removal and Otsu segmentation do not depend on the sampling counts or
+sigma, yet every bot run on the same image used to redo them. Their outputs
+are cached here, keyed by the sha256 of the image bytes plus every
+preprocessing parameter, so re-running with new sampling settings only
+repeats sampling, density and render.
+
+An entry is one compressed .npz holding:
+
+    contour   the lesion contour, delta-encoded (K, 2) int32
+    mask_rle  run lengths of the filled mask, starting with a background run
+
+Entries live in a result_cache store selected by SEGMENT_CACHE_BACKEND
+(disk by default, under SEGMENT_CACHE_DIR, bounded by SEGMENT_CACHE_MB).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+import numpy as np
+
+from .result_cache import STORES
+
+BACKEND = os.getenv('SEGMENT_CACHE_BACKEND', 'disk')
+MAX_BYTES = int(float(os.getenv('SEGMENT_CACHE_MB', '256')) * 1024 * 1024)
+CACHE_DIR = os.getenv('SEGMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'eye-sense-segment-cache'))
+
+
+def cache_key(image_bytes, params):
+    """Hex sha256 of the preprocessing params and the encoded image."""
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    h.update(b'\0')
+    h.update(image_bytes)
+    return h.hexdigest()
+
+
+def rle_encode(mask):
+    """Run lengths of a binary mask in row-major order, starting with a background run."""
+    flat = mask.ravel() > 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    runs = np.diff(np.concatenate([[0], changes, [flat.size]]))
+    if flat.size and flat[0]:
+        runs = np.concatenate([[0], runs])
+    return runs.astype(np.int64)
+
+
+def rle_decode(runs, shape):
+    """Inverse of rle_encode, as a 0/255 uint8 mask."""
+    values = np.where(np.arange(len(runs)) % 2 == 1, np.uint8(255), np.uint8(0))
+    return np.repeat(values, runs).reshape(shape)
+
+
+def pack(contour, mask):
+    points = np.asarray(contour, dtype=np.int32).reshape(-1, 2)
+    buf = BytesIO()
+    np.savez_compressed(buf, contour=np.diff(points, axis=0, prepend=np.zeros((1, 2), np.int32)),
+                        mask_rle=rle_encode(mask), mask_shape=np.array(mask.shape))
+    return buf.getvalue()
+
+
+def unpack(data):
+    """Returns (contour, mask); contour is (K, 1, 2) int32 like cv2.findContours."""
+    with np.load(BytesIO(data)) as entry:
+        contour = np.cumsum(entry['contour'], axis=0, dtype=np.int32).reshape(-1, 1, 2)
+        mask = rle_decode(entry['mask_rle'], tuple(entry['mask_shape']))
+    return contour, mask
+
+
+class SegmentCache:
+    """Hit/miss counters around a store of packed preprocessing artifacts."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, image_bytes, params):
+        """Returns (contour, mask) or None."""
+        data = self.store.get(cache_key(image_bytes, params))
+        if data is not None:
+            try:
+                result = unpack(data)
+                self._count('hits')
+                return result
+            except (ValueError, KeyError, OSError):
+                pass  # unreadable entry; the caller recomputes and overwrites it
+        self._count('misses')
+        return None
+
+    def put(self, image_bytes, params, contour, mask):
+        self.store.put(cache_key(image_bytes, params), pack(contour, mask))
+
+    def get_or_compute(self, image_bytes, params, compute):
+        """Returns (contour, mask), calling compute() and storing its result on a miss."""
+        result = self.get(image_bytes, params)
+        if result is None:
+            result = compute()
+            self.put(image_bytes, params, *result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        return {**counters, 'hit_rate': counters['hits'] / lookups if lookups else 0.0,
+                'backend': type(self.store).__name__, **self.store.usage()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_segment_cache():
+    """Returns the process-wide SegmentCache using SEGMENT_CACHE_BACKEND."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if BACKEND not in STORES:
+                    raise ValueError(f"Unknown SEGMENT_CACHE_BACKEND '{BACKEND}', expected one of {sorted(STORES)}")
+                if BACKEND == 'disk':
+                    store = STORES[BACKEND](CACHE_DIR, MAX_BYTES)
+                elif BACKEND == 'memory':
+                    store = STORES[BACKEND](MAX_BYTES)
+                else:
+                    store = STORES[BACKEND]()
+                _cache = SegmentCache(store)
+    return _cache
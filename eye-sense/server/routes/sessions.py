@@ -0,0 +1,115 @@
+"""Incremental gaze sessions: a running accumulation grid per viewing session.
+
+A session is opened for (filename, width, height). Gaze chunks are added to
+its float32 count grid as they arrive, so each append costs O(points in the
+chunk) and history is never reprocessed. The current heatmap can be
+rendered at any time from the grid. Sessions idle for longer than
+GAZE_SESSION_TTL_SECONDS are evicted lazily on the next store access.
+
+Display sizes are bounded by render.display_size, and the grids of all
+live sessions together by GAZE_SESSION_MAX_MB.
+"""
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from .density import accumulate_points
+
+TTL_SECONDS = float(os.getenv('GAZE_SESSION_TTL_SECONDS', '900'))
+MAX_SESSIONS = int(os.getenv('GAZE_SESSION_MAX', '256'))
+MAX_BYTES = int(float(os.getenv('GAZE_SESSION_MAX_MB', '1024')) * 1024 * 1024)
+
+
+class SessionLimitError(RuntimeError):
+    """Raised when opening a session would exceed GAZE_SESSION_MAX or GAZE_SESSION_MAX_MB."""
+
+
+class GazeSession:
+    """Running gaze count grid for one (filename, width, height)."""
+
+    def __init__(self, filename, width, height):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.grid = np.zeros((height, width), dtype=np.float32)
+        self.point_count = 0
+        # Bumped on every append; identifies a rendered state for ETags
+        self.version = 0
+        # (version, format, encoded bytes) of the last render
+        self.rendered = None
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def append(self, points):
+        """Adds a chunk of (x, y) points to the grid. Returns the total point count."""
+        with self.lock:
+            accumulate_points(points, self.width, self.height, out=self.grid)
+            self.point_count += len(points)
+            self.version += 1
+            self.last_seen = time.monotonic()
+            return self.point_count
+
+    def snapshot(self):
+        """Returns (grid copy, version) for rendering outside the lock."""
+        with self.lock:
+            self.last_seen = time.monotonic()
+            return self.grid.copy(), self.version
+
+    def describe(self):
+        return {"sessionId": self.id, "filename": self.filename, "width": self.width,
+                "height": self.height, "points": self.point_count, "version": self.version}
+
+
+class SessionStore:
+    """Thread-safe map of live sessions with idle-TTL eviction."""
+
+    def __init__(self, ttl_seconds=TTL_SECONDS, max_sessions=MAX_SESSIONS, max_bytes=MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _evict_idle(self):
+        """Caller holds the lock."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for session_id in [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]:
+            del self._sessions[session_id]
+
+    def open(self, filename, width, height):
+        with self._lock:
+            self._evict_idle()
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimitError(f"Too many open gaze sessions ({self.max_sessions})")
+            used = sum(s.grid.nbytes for s in self._sessions.values())
+            if used + width * height * 4 > self.max_bytes:
+                raise SessionLimitError(f"Open gaze sessions would exceed {self.max_bytes // (1024 * 1024)} MB")
+            session = GazeSession(filename, width, height)
+            self._sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        """Returns the live session or None if it does not exist or has expired."""
+        with self._lock:
+            self._evict_idle()
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._evict_idle()
+            return len(self._sessions)
+
+
+_store = SessionStore()
+
+
+def get_session_store():
+    return _store
@@ -0,0 +1,83 @@
+"""Prediction micro-batching with a fake predict_batch."""
+import threading
+
+import numpy as np
+import pytest
+
+from routes.batcher import Histogram, PredictionBatcher, QueueFullError
+
+
+class FakeModel:
+    """predict_batch doubles its input; release() lets blocked calls through."""
+
+    def __init__(self, block=False):
+        self.batches = []
+        self.gate = threading.Event()
+        if not block:
+            self.gate.set()
+        self.entered = threading.Event()
+
+    def predict_batch(self, inputs):
+        self.entered.set()
+        self.gate.wait(5)
+        self.batches.append(len(inputs))
+        return inputs * 2
+
+
+def test_concurrent_requests_share_batches():
+    model = FakeModel(block=True)
+    batcher = PredictionBatcher(model.predict_batch, max_batch=4, max_wait_ms=50)
+    first = batcher.submit(np.zeros((2, 2)))
+    model.entered.wait(5)  # the worker is busy with the first input
+    futures = [batcher.submit(np.full((2, 2), i, dtype=float)) for i in range(1, 7)]
+    model.gate.set()
+
+    assert first.result(5).tolist() == [[0, 0], [0, 0]]
+    for i, future in enumerate(futures, start=1):
+        assert future.result(5).tolist() == [[2 * i] * 2] * 2  # each caller gets its own slice
+    assert model.batches == [1, 4, 2]
+    snapshot = batcher.stats()['batch_size']
+    assert snapshot['count'] == 3 and snapshot['buckets']['<=4'] == 1
+
+
+def test_max_batch_one_disables_batching():
+    model = FakeModel()
+    batcher = PredictionBatcher(model.predict_batch, max_batch=1, max_wait_ms=50)
+    assert [batcher.predict(np.ones(1) * i)[0] for i in range(3)] == [0, 2, 4]
+    assert model.batches == [1, 1, 1]
+
+
+def test_queue_full():
+    model = FakeModel(block=True)
+    batcher = PredictionBatcher(model.predict_batch, max_batch=1, max_queue=2)
+    batcher.submit(np.zeros(1))
+    model.entered.wait(5)
+    batcher.submit(np.zeros(1))
+    batcher.submit(np.zeros(1))
+    with pytest.raises(QueueFullError):
+        batcher.submit(np.zeros(1))
+    model.gate.set()
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    def fail(inputs):
+        raise RuntimeError("model exploded")
+
+    batcher = PredictionBatcher(fail, max_batch=4, max_wait_ms=20)
+    futures = [batcher.submit(np.zeros(1)) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="exploded"):
+            future.result(5)
+    # The worker survives and keeps serving
+    batcher.predict_batch = lambda inputs: inputs + 1
+    assert batcher.predict(np.zeros(1))[0] == 1
+
+
+def test_histogram():
+    histogram = Histogram([1, 5, 10])
+    for value in (0.5, 1, 3, 10, 50):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['buckets'] == {'<=1': 2, '<=5': 1, '<=10': 1, '>10': 1}
+    assert snapshot['count'] == 5 and snapshot['mean'] == pytest.approx(12.9)
+    assert Histogram([1]).snapshot() == {'buckets': {'<=1': 0, '>1': 0}, 'count': 0, 'mean': 0.0}
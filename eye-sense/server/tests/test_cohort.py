@@ -0,0 +1,73 @@
+"""Cohort aggregation: repeat responses and consistent summary/grid reads."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from routes.cohort import Cohort, CohortError
+
+
+def test_repeat_responses_are_ignored_after_reload(tmp_path):
+    cohort = Cohort('q1', root=str(tmp_path))
+    assert cohort.add_response('r1', 'a.jpg', 100, 50, [(10, 10), (20, 20)])
+    assert not cohort.add_response('r1', 'a.jpg', 100, 50, [(30, 30)], group='novice')
+
+    reloaded = Cohort('q1', root=str(tmp_path))
+    assert not reloaded.add_response('r1', 'a.jpg', 100, 50, [(30, 30)])
+    assert reloaded.add_response('r2', 'a.jpg', 100, 50, [(30, 30)], group='novice')
+
+
+def test_combined_grid_matches_its_summary(tmp_path):
+    cohort = Cohort('q1', root=str(tmp_path))
+    summary, grid, responses = cohort.combined_grid()
+    assert grid is None and responses == 0 and summary['groups'] == {}
+
+    cohort.add_response('r1', 'a.jpg', 100, 50, [(10, 10)])
+    cohort.add_response('r2', 'a.jpg', 100, 50, [(10, 10), (90, 40)], group='novice')
+    summary, grid, responses = cohort.combined_grid()
+    assert summary['groups'] == {'all': 1, 'novice': 1} and responses == 2
+    assert np.isclose(grid.sum(), 2.0)
+    summary, grid, responses = cohort.combined_grid(['novice'])
+    assert responses == 1 and np.isclose(grid.sum(), 1.0)
+
+
+def test_invalid_group_and_response_id(tmp_path):
+    cohort = Cohort('q1', root=str(tmp_path))
+    for group in (None, 3, ['all'], '', 'a/b', 'x' * 65):
+        with pytest.raises(CohortError):
+            cohort.add_response('r1', 'a.jpg', 100, 50, [(10, 10)], group=group)
+    for response_id in (7, 'two\nlines', 'x' * 257):
+        with pytest.raises(CohortError):
+            cohort.add_response(response_id, 'a.jpg', 100, 50, [(10, 10)])
+
+
+def test_response_ids_are_appended_outside_meta(tmp_path):
+    cohort = Cohort('q1', root=str(tmp_path))
+    cohort.add_response('r1', 'a.jpg', 100, 50, [(10, 10)])
+    meta = open(os.path.join(cohort.dir, 'meta.json')).read()
+    cohort.add_response('r2', 'a.jpg', 100, 50, [(20, 20)])
+    assert open(os.path.join(cohort.dir, 'meta.json')).read() == meta
+    assert open(os.path.join(cohort.dir, 'all.ids')).read() == 'r1\nr2\n'
+    assert 'r1' not in meta
+
+
+def test_old_meta_format_is_migrated(tmp_path):
+    cohort = Cohort('q1', root=str(tmp_path))
+    cohort.add_response('r1', 'a.jpg', 100, 50, [(10, 10)])
+    cohort.add_response('r2', 'a.jpg', 100, 50, [(20, 20)], group='novice')
+    meta_path = os.path.join(cohort.dir, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.pop('groups')
+    meta['responses'] = {'all': ['r1'], 'novice': ['r2']}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    for group in ('all', 'novice'):
+        os.remove(os.path.join(cohort.dir, f"{group}.ids"))
+
+    reloaded = Cohort('q1', root=str(tmp_path))
+    assert reloaded.summary()['groups'] == {'all': 1, 'novice': 1}
+    assert not reloaded.add_response('r2', 'a.jpg', 100, 50, [(30, 30)])
+    with open(meta_path) as f:
+        assert 'responses' not in json.load(f)
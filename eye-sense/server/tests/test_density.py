@@ -0,0 +1,79 @@
+"""Density engine: point binning and the Gaussian blur backends."""
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+
+from routes import density
+from routes.density import accumulate_points, blur, density_map, normalize
+
+# Stated accuracy of the pyramid backend (fraction of peak), see routes/density.py
+PYRAMID_TOLERANCE = 0.11
+
+
+def reference(points, width, height, sigma):
+    """The original per-point loop + gaussian_filter."""
+    grid = np.zeros((height, width))
+    for x, y in points:
+        if 0 <= x < width and 0 <= y < height:
+            grid[int(y), int(x)] += 1
+    blurred = gaussian_filter(grid, sigma=sigma)
+    return blurred / blurred.max()
+
+
+def reference_counts(points, width, height):
+    grid = np.zeros((height, width), np.float32)
+    for x, y in points:
+        if 0 <= x < width and 0 <= y < height:
+            grid[int(y), int(x)] += 1
+    return grid
+
+
+def random_points(rng, n, width, height):
+    return np.c_[rng.uniform(-5, width + 5, n), rng.uniform(-5, height + 5, n)]
+
+
+def test_accumulate_points_matches_loop_and_drops_outside():
+    points = [(0, 0), (0.9, 0.2), (9.99, 4.5), (-0.1, 1), (10, 1), (3, 5)]
+    grid = accumulate_points(points, 10, 5)
+    assert grid.dtype == np.float32 and grid.sum() == 3
+    assert grid[0, 0] == 2 and grid[4, 9] == 1
+
+    # Dense path (bincount) and in-place accumulation agree with the sparse one
+    rng = np.random.default_rng(0)
+    dense = random_points(rng, 5000, 40, 30)
+    out = accumulate_points(dense[:2500], 40, 30)
+    accumulate_points(dense[2500:], 40, 30, out=out)
+    np.testing.assert_array_equal(out, reference_counts(dense, 40, 30))
+
+
+@pytest.mark.parametrize("backend", ["separable", "fft", "auto"])
+def test_exact_backends_match_gaussian_filter(backend):
+    rng = np.random.default_rng(1)
+    points = random_points(rng, 300, 160, 120)
+    result = density_map(points, 160, 120, sigma=12, backend=backend)
+    np.testing.assert_allclose(result, reference(points, 160, 120, 12), atol=1e-5)
+
+
+@pytest.mark.parametrize("n", [1, 100, 5000])
+def test_pyramid_backend_within_stated_tolerance(n):
+    rng = np.random.default_rng(n)
+    for width, height in ((401, 299), (640, 480)):
+        points = random_points(rng, n, width, height)
+        result = density_map(points, width, height, sigma=30, backend="pyramid")
+        assert np.abs(result - reference(points, width, height, 30)).max() < PYRAMID_TOLERANCE
+
+
+def test_pyramid_does_not_double_count_edges():
+    # Points on the far corner, where the last block is partial
+    points = [(400, 298)] * 20 + [(200, 150)] * 20
+    result = density_map(points, 401, 299, sigma=30, backend="pyramid")
+    assert np.abs(result - reference(points, 401, 299, 30)).max() < PYRAMID_TOLERANCE
+
+
+def test_normalize_and_empty_grid():
+    assert not density_map([], 20, 10).any()
+    grid = np.array([[0, 2], [4, 8]], np.float32)
+    np.testing.assert_allclose(normalize(grid.copy()), grid / 8)
+    with pytest.raises(ValueError):
+        blur(grid, 3, backend="box")
+    assert density.as_point_array([]).shape == (0, 2)
@@ -0,0 +1,21 @@
+"""Bounds on client-supplied display sizes and on live session grids."""
+import pytest
+
+from routes import render
+from routes.sessions import SessionLimitError, SessionStore
+
+
+def test_display_size_parses_and_bounds():
+    assert render.display_size('800', 600) == (800, 600)
+    for width, height in ((None, 600), ('wide', 600), (0, 600), (800, -1),
+                          (render.MAX_SIDE + 1, 10), (render.MAX_SIDE, render.MAX_SIDE)):
+        with pytest.raises(ValueError):
+            render.display_size(width, height)
+
+
+def test_session_store_byte_budget():
+    store = SessionStore(max_sessions=10, max_bytes=2 * 100 * 100 * 4)
+    store.open('a.jpg', 100, 100)
+    store.open('a.jpg', 100, 100)
+    with pytest.raises(SessionLimitError):
+        store.open('a.jpg', 10, 10)
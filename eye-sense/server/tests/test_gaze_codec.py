@@ -0,0 +1,82 @@
+"""Packed gaze wire format: round trips, the web client's layout and malformed payloads."""
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from routes import gaze_codec
+from routes.gaze_codec import GazeFormatError
+
+
+def test_int16_round_trip_floors_and_is_zero_copy():
+    points = [(10.7, 20.2), (-0.5, 3.0), (639.99, 479.0)]
+    decoded, times = gaze_codec.decode(gaze_codec.encode(points))
+    assert times is None and decoded.dtype == np.int16
+    assert decoded.tolist() == [[10, 20], [-1, 3], [639, 479]]
+    assert not decoded.flags.writeable  # a view over the request body
+
+
+@pytest.mark.parametrize('delta', [False, True])
+@pytest.mark.parametrize('compress', [False, True])
+def test_float32_round_trip_with_times(delta, compress):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-50, 2000, (500, 2))
+    times = np.cumsum(rng.uniform(10, 40, 500))
+    payload = gaze_codec.encode(points, times, dtype='float32', delta=delta, compress=compress)
+    decoded, decoded_times = gaze_codec.decode(payload)
+    # Delta sums accumulate float32 rounding; absolute values are exact to float32
+    assert np.allclose(decoded, points.astype(np.float32), atol=1e-2 if delta else 0)
+    assert np.allclose(decoded_times, times.astype(np.float32), atol=0.1 if delta else 0)
+
+
+def test_web_client_layout():
+    """The buffer heatmap-controller.ts builds: delta int16 x,y then delta float32 ms since t0."""
+    samples = [(100, 200, 1700000000000.0), (103, 198, 1700000000016.0), (90, 210, 1700000000033.0)]
+    header = struct.pack('<4sBBBBI', b'GAZE', 1, gaze_codec.FLAG_TIME | gaze_codec.FLAG_DELTA, 0, 0, 3)
+    xy, ts = [], []
+    prev_x = prev_y = 0
+    prev_t = samples[0][2]
+    for x, y, t in samples:
+        xy += [x - prev_x, y - prev_y]
+        ts.append(t - prev_t)
+        prev_x, prev_y, prev_t = x, y, t
+    payload = header + struct.pack('<6h', *xy) + struct.pack('<3f', *ts)
+
+    points, times = gaze_codec.decode(payload)
+    assert points.tolist() == [[100, 200], [103, 198], [90, 210]]
+    assert times.tolist() == [0.0, 16.0, 33.0]
+
+
+def test_empty_payload():
+    points, times = gaze_codec.decode(gaze_codec.encode(np.empty((0, 2)), times=[], compress=True))
+    assert points.shape == (0, 2) and len(times) == 0
+
+
+def test_malformed_payloads():
+    good = gaze_codec.encode([(1, 2), (3, 4)], times=[0, 1])
+    bad = {
+        'short': good[:8],
+        'magic': b'JUNK' + good[4:],
+        'version': good[:4] + bytes([9]) + good[5:],
+        'dtype': good[:6] + bytes([7]) + good[7:],
+        'length': good[:-1],
+        'zlib': good[:5] + bytes([good[5] | gaze_codec.FLAG_ZLIB]) + good[6:],
+    }
+    for payload in bad.values():
+        with pytest.raises(GazeFormatError):
+            gaze_codec.decode(payload)
+    # Truncated compressed bodies are caught too
+    compressed = gaze_codec.encode([(1, 2)] * 100, compress=True)
+    with pytest.raises(GazeFormatError):
+        gaze_codec.decode(compressed[:-4])
+
+
+def test_decode_json():
+    gaze = [{'x': 1.5, 'y': 2, 'time': 5}, {'x': -3, 'y': 4}]
+    assert gaze_codec.decode_json(json.dumps(gaze)).tolist() == [[1.5, 2.0], [-3.0, 4.0]]
+    assert gaze_codec.decode_json('[]').shape == (0, 2)
+    with pytest.raises(ValueError):
+        gaze_codec.decode_json('not json')
+    with pytest.raises(KeyError):
+        gaze_codec.decode_json(json.dumps([{'x': 1}]))
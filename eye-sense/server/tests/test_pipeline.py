@@ -0,0 +1,38 @@
+"""Pipeline stages and their timings."""
+import pytest
+
+from routes import pipeline
+from routes.pipeline import Pipeline
+
+
+def test_run_records_timings_and_skips():
+    def load(ctx):
+        ctx['data'] = bytes(1000)
+
+    def double(ctx):
+        ctx['n'] *= 2
+
+    p = Pipeline('test').then('load', load).then('double', double).then('never', double, skip=lambda ctx: True)
+    ctx, timings = p.run(n=3)
+    assert ctx['n'] == 6 and len(ctx['data']) == 1000
+    assert [t['stage'] for t in timings] == ['load', 'double', 'never']
+    assert timings[0]['out_bytes'] == 1000 and timings[1]['out_bytes'] == 0
+    assert timings[2] == {'stage': 'never', 'ms': 0.0, 'skipped': True}
+    assert pipeline.server_timing(timings) == f"load;dur={timings[0]['ms']}, double;dur={timings[1]['ms']}"
+
+
+def test_replace_returns_a_new_pipeline():
+    p = Pipeline('test').then('step', lambda ctx: ctx.update(v=1))
+    q = p.replace('step', lambda ctx: ctx.update(v=2))
+    assert p.run()[0]['v'] == 1 and q.run()[0]['v'] == 2
+    with pytest.raises(KeyError):
+        p.replace('missing', lambda ctx: None)
+
+
+def test_timings_logged_only_when_enabled(monkeypatch, capsys):
+    p = Pipeline('test').then('step', lambda ctx: None)
+    p.run()
+    assert capsys.readouterr().out == ''
+    monkeypatch.setattr(pipeline, 'PIPELINE_LOG', True)
+    p.run()
+    assert '"pipeline": "test"' in capsys.readouterr().out
@@ -0,0 +1,46 @@
+"""Heatmap compositing: the jet LUT, blending and encoding."""
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from routes import render
+
+
+def test_jet_lut_matches_matplotlib():
+    matplotlib = pytest.importorskip('matplotlib')
+    reference = matplotlib.colormaps['jet'].resampled(256)(np.arange(256))[:, :3]
+    assert np.allclose(render.JET_LUT, reference, atol=1e-6)
+
+
+def test_colorize_bins_like_a_256_entry_colormap():
+    density = np.array([[0.0, 0.5, 1.0, 1.5, -0.2]], dtype=np.float32)
+    colors = render.colorize(density)
+    expected = render.JET_LUT[[0, 128, 255, 255, 0]]
+    assert colors.shape == (1, 5, 3) and np.array_equal(colors[0], expected)
+
+
+def test_overlay_blends_and_checks_size():
+    image = np.full((4, 6, 3), 100, np.uint8)
+    density = np.zeros((4, 6), np.float32)
+    blended = render.overlay(image, density, alpha=0.5)
+    expected = np.round(render.JET_LUT[0] * 0.5 * 255 + 50).astype(np.uint8)
+    assert blended.dtype == np.uint8 and (blended == expected).all()
+    assert np.array_equal(render.overlay(image, density, alpha=0.0), image)
+    with pytest.raises(ValueError):
+        render.overlay(image, np.zeros((6, 4), np.float32))
+    # Grayscale and RGBA inputs are accepted
+    assert render.overlay(image[..., 0], density).shape == (4, 6, 3)
+    assert render.overlay(np.dstack([image, image[..., :1]]), density).shape == (4, 6, 3)
+
+
+@pytest.mark.parametrize('fmt', ['png', 'jpeg', 'webp'])
+def test_render_heatmap_encodes(fmt):
+    image = np.zeros((30, 40, 3), np.uint8)
+    density = np.linspace(0, 1, 30 * 40, dtype=np.float32).reshape(30, 40)
+    decoded = Image.open(BytesIO(render.render_heatmap(image, density, fmt=fmt).getvalue()))
+    assert decoded.size == (40, 30) and decoded.format == render.FORMATS[fmt][0]
+    assert render.mimetype(fmt) == f"image/{fmt}"
+    with pytest.raises(ValueError):
+        render.encode_image(np.zeros((2, 2, 3), np.uint8), fmt='gif')
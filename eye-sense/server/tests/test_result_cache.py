@@ -0,0 +1,116 @@
+"""Rendered-result cache: digests, ETag matching, stores and the 304 path of POST /."""
+import json
+import os
+
+import numpy as np
+import pytest
+from flask import Flask
+from PIL import Image
+
+from routes import gcs, image_cache, pixel_cache, result_cache
+from routes.gcs import LocalBucket
+from routes.result_cache import DiskStore, MemoryStore, ResultCache, digest, etag_for, etag_matches
+
+
+def test_digest_covers_every_input():
+    base = ('a.jpg', 1000, 800, 600, b'\x01\x02', {'sigma': 30})
+    key = digest(*base)
+    assert digest(*base) == key and len(key) == 64
+    for i, other in enumerate(['b.jpg', 1001, 801, 601, b'\x01\x03', {'sigma': 31}]):
+        changed = list(base)
+        changed[i] = other
+        assert digest(*changed) != key
+    # JSON and packed payloads with the same text hash alike; params order does not matter
+    assert digest('a.jpg', 1, 2, 3, '[]', {'a': 1, 'b': 2}) == digest('a.jpg', 1, 2, 3, b'[]', {'b': 2, 'a': 1})
+
+
+def test_etag_matches():
+    key = 'abc'
+    assert etag_for(key) == '"abc"'
+    assert etag_matches('"abc"', key)
+    assert etag_matches('W/"abc"', key)
+    assert etag_matches('"x", "abc"', key)
+    assert etag_matches('*', key)
+    assert not etag_matches(None, key)
+    assert not etag_matches('', key)
+    assert not etag_matches('"abcd"', key)
+    assert not etag_matches('abc', key)
+
+
+def test_memory_store_lru_budget():
+    store = MemoryStore(max_bytes=10)
+    store.put('a', b'1234')
+    store.put('b', b'1234')
+    assert store.get('a') == b'1234'  # a is now most recently used
+    store.put('c', b'1234')
+    assert store.get('b') is None and store.get('a') and store.get('c')
+    store.put('huge', b'x' * 11)
+    assert store.get('huge') is None
+    assert store.usage() == {'entries': 2, 'bytes': 8}
+
+
+def test_disk_store_shared_and_bounded(tmp_path):
+    first = DiskStore(str(tmp_path), max_bytes=10)
+    second = DiskStore(str(tmp_path), max_bytes=10)
+    first.put('a', b'1234')
+    assert second.get('a') == b'1234'
+    os.utime(tmp_path / 'a', (1, 1))
+    second.put('b', b'1234')
+    second.put('c', b'1234')  # evicts a, the oldest mtime
+    assert first.get('a') is None and first.get('b') == b'1234'
+    assert first.usage() == {'entries': 2, 'bytes': 8}
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))
+
+
+def test_result_cache_counters():
+    cache = ResultCache(MemoryStore())
+    assert cache.get('k') is None
+    cache.put('k', b'png')
+    assert cache.get('k') == b'png'
+    cache.not_modified()
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['not_modified']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5 and stats['backend'] == 'MemoryStore'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from routes import heatmap
+
+    bucket = LocalBucket('images', root=str(tmp_path / 'buckets'))
+    path = tmp_path / 'a.png'
+    Image.fromarray(np.full((60, 80, 3), 128, np.uint8)).save(path)
+    bucket.blob('a.png').upload_from_filename(str(path))
+
+    blobs = image_cache.BlobCache(str(tmp_path / 'images'))
+    monkeypatch.setattr(gcs, 'get_bucket', lambda *args: bucket)
+    monkeypatch.setattr(image_cache, '_cache', blobs)
+    monkeypatch.setattr(pixel_cache, '_cache', pixel_cache.PixelCache(blob_cache=blobs))
+    monkeypatch.setattr(result_cache, '_cache', ResultCache(MemoryStore()))
+
+    app = Flask(__name__)
+    app.register_blueprint(heatmap.api_heatmap, url_prefix='/api/v1/heatmaps')
+    return app.test_client()
+
+
+def test_generate_heatmap_etag_and_304(client):
+    body = {'filename': 'a.png', 'width': 80, 'height': 60,
+            'gazeDataStr': json.dumps([{'x': 40, 'y': 30}])}
+    first = client.post('/api/v1/heatmaps/', json=body)
+    assert first.status_code == 200 and first.mimetype == 'image/png'
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == result_cache.CACHE_CONTROL
+
+    repeat = client.post('/api/v1/heatmaps/', json=body)
+    assert repeat.data == first.data and repeat.headers['ETag'] == etag
+
+    revalidated = client.post('/api/v1/heatmaps/', json=body, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+
+    moved = client.post('/api/v1/heatmaps/', json={**body, 'gazeDataStr': json.dumps([{'x': 10, 'y': 10}])},
+                        headers={'If-None-Match': etag})
+    assert moved.status_code == 200 and moved.headers['ETag'] != etag
+
+    stats = result_cache.get_result_cache().stats()
+    assert (stats['hits'], stats['misses'], stats['not_modified']) == (1, 2, 1)
@@ -0,0 +1,56 @@
+"""Simulated gaze sampling: seeding and the density methods."""
+import numpy as np
+import pytest
+
+from routes import sampler
+
+
+@pytest.fixture
+def lesion():
+    mask = np.zeros((60, 80), np.uint8)
+    mask[20:40, 25:55] = 255
+    contour = np.array([[[25, 20]], [[54, 20]], [[54, 39]], [[25, 39]]], dtype=np.int32)
+    return contour, mask
+
+
+def test_seeded_sampling_is_reproducible(lesion):
+    contour, mask = lesion
+    first = sampler.sample_points(contour, mask, 50, 200, rng=7)
+    assert np.array_equal(first, sampler.sample_points(contour, mask, 50, 200, rng=7))
+    assert not np.array_equal(first, sampler.sample_points(contour, mask, 50, 200, rng=8))
+    # A Generator is used as-is, so consecutive calls continue its stream
+    rng = np.random.default_rng(7)
+    assert sampler.get_rng(rng) is rng
+    assert np.array_equal(sampler.sample_points(contour, mask, 50, 200, rng=rng), first)
+
+
+def test_samples_land_where_they_should(lesion):
+    contour, mask = lesion
+    border = sampler.sample_border_points(contour, 100, rng=0)
+    assert {tuple(p) for p in border} <= {tuple(p) for p in contour.reshape(-1, 2)}
+    internal = sampler.sample_internal_points(mask, 500, rng=0)
+    assert internal.shape == (500, 2) and (mask[internal[:, 1], internal[:, 0]] == 255).all()
+    # A sparse mask takes the direct path instead of rejection sampling
+    sparse = np.zeros((100, 100), np.uint8)
+    sparse[0, 0] = sparse[99, 99] = 255
+    points = sampler.sample_internal_points(sparse, 20, rng=0)
+    assert {tuple(p) for p in points} <= {(0, 0), (99, 99)}
+    assert sampler.sample_internal_points(np.zeros((5, 5), np.uint8), 10).shape == (0, 2)
+
+
+@pytest.mark.parametrize('method', sampler.DENSITY_METHODS)
+def test_lesion_density_methods(lesion, method):
+    contour, mask = lesion
+    density = sampler.lesion_density(contour, mask, 100, 1000, sigma=5, rng=0, method=method)
+    assert density.shape == mask.shape
+    assert density.min() >= 0 and density.max() == pytest.approx(1.0)
+    assert density[30, 40] > density[2, 2]  # the lesion outweighs the far corner
+
+
+def test_sampled_density_converges_to_analytic(lesion):
+    contour, mask = lesion
+    sampled = sampler.lesion_density(contour, mask, 2000, 20000, sigma=5, rng=0, method="sampled")
+    analytic = sampler.lesion_density(contour, mask, 2000, 20000, sigma=5, method="analytic")
+    assert np.abs(sampled - analytic).max() < 0.1
+    with pytest.raises(ValueError):
+        sampler.lesion_density(contour, mask, 1, 1, method="nope")
@@ -0,0 +1,58 @@
+"""Bot segmentation cache: mask RLE and contour packing round trips."""
+import numpy as np
+import pytest
+
+from routes import segment_cache
+from routes.result_cache import MemoryStore
+from routes.segment_cache import SegmentCache, pack, rle_decode, rle_encode, unpack
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (7, 13), (64, 48)])
+def test_rle_round_trip(shape):
+    rng = np.random.default_rng(shape[0])
+    masks = [np.zeros(shape, np.uint8), np.full(shape, 255, np.uint8),
+             (rng.random(shape) > 0.5).astype(np.uint8) * 255]
+    for mask in masks:
+        runs = rle_encode(mask)
+        assert runs.sum() == mask.size
+        assert np.array_equal(rle_decode(runs, shape), mask)
+
+
+def test_rle_starts_with_a_background_run():
+    assert rle_encode(np.array([[255, 255, 0]])).tolist() == [0, 2, 1]
+    assert rle_encode(np.array([[0, 255, 255]])).tolist() == [1, 2]
+    # Any non-zero value counts as foreground and decodes to 255
+    assert rle_decode(rle_encode(np.array([[0, 1, 7]])), (1, 3)).tolist() == [[0, 255, 255]]
+
+
+def test_pack_round_trip():
+    mask = np.zeros((40, 50), np.uint8)
+    mask[10:30, 5:45] = 255
+    contour = np.array([[[5, 10]], [[44, 10]], [[44, 29]], [[5, 29]]], dtype=np.int32)
+    got_contour, got_mask = unpack(pack(contour, mask))
+    assert got_contour.shape == (4, 1, 2) and got_contour.dtype == np.int32
+    assert np.array_equal(got_contour, contour)
+    assert np.array_equal(got_mask, mask)
+
+
+def test_get_or_compute_and_unreadable_entries():
+    cache = SegmentCache(MemoryStore())
+    mask = np.zeros((8, 8), np.uint8)
+    mask[2:5, 2:5] = 255
+    contour = np.array([[[2, 2]], [[4, 4]]], dtype=np.int32)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return contour, mask
+
+    params = {'zoom': 1.5}
+    cache.get_or_compute(b'image', params, compute)
+    got_contour, got_mask = cache.get_or_compute(b'image', params, compute)
+    assert len(calls) == 1 and np.array_equal(got_mask, mask) and np.array_equal(got_contour, contour)
+    cache.get_or_compute(b'image', {'zoom': 2.0}, compute)
+    assert len(calls) == 2
+
+    cache.store.put(segment_cache.cache_key(b'other', params), b'not an npz')
+    assert cache.get(b'other', params) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
@@ -0,0 +1,182 @@
+"""Offline tests of the shared storage client and the source-image cache,
+run against the directory-backed LocalBucket:
+
+    cd eye-sense/server && python -m pytest tests
+"""
+import os
+
+import pytest
+
+from routes import gcs
+from routes.gcs import LocalBucket, NotFound, NotModified
+from routes.image_cache import BlobCache
+
+
+@pytest.fixture(autouse=True)
+def clean_gcs():
+    gcs.reset()
+    yield
+    gcs.reset()
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket('images', root=str(tmp_path / 'buckets'))
+
+
+def upload(bucket, name, data, generation=None):
+    """Uploads data; generation pins the blob's mtime so re-uploads always change it."""
+    blob = bucket.blob(name)
+    blob.upload_from_string(data)
+    if generation is not None:
+        os.utime(blob.path, ns=(generation, generation))
+    return blob
+
+
+class FakeClient:
+    def __init__(self):
+        self.bucket_calls = []
+
+    def bucket(self, name):
+        self.bucket_calls.append(name)
+        return object()
+
+
+def test_get_client_built_once_per_credentials(monkeypatch):
+    built = []
+    monkeypatch.setattr(gcs, '_build_client', lambda path: built.append(path) or FakeClient())
+    first = gcs.get_client('a.json')
+    assert gcs.get_client('a.json') is first
+    assert gcs.get_client('b.json') is not first
+    assert built == ['a.json', 'b.json']
+
+
+def test_get_bucket_caches_handles(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setenv('STORAGE_BACKEND', 'gcs')
+    monkeypatch.setattr(gcs, '_build_client', lambda path: client)
+    first = gcs.get_bucket('images', 'key.json')
+    assert gcs.get_bucket('images', 'key.json') is first
+    gcs.get_bucket('other', 'key.json')
+    assert client.bucket_calls == ['images', 'other']
+
+    gcs.reset()
+    assert gcs.get_bucket('images', 'key.json') is not first
+
+
+def test_get_bucket_local_backend(monkeypatch, tmp_path):
+    monkeypatch.setenv('STORAGE_BACKEND', 'local')
+    monkeypatch.setenv('LOCAL_BUCKET_ROOT', str(tmp_path))
+    bucket = gcs.get_bucket('images')
+    assert isinstance(bucket, LocalBucket)
+    assert bucket.root == os.path.join(str(tmp_path), 'images')
+    assert gcs.get_bucket('images') is bucket
+
+
+def test_local_blob_round_trip(bucket):
+    blob = upload(bucket, 'a/b.jpg', b'jpeg bytes', generation=1000)
+    assert blob.exists() and blob.size == 10 and blob.generation == 1000
+    assert bucket.get_blob('a/b.jpg').download_as_bytes() == b'jpeg bytes'
+    assert bucket.get_blob('missing.jpg') is None
+    with pytest.raises(NotFound):
+        bucket.blob('missing.jpg').download_as_bytes()
+
+
+def test_local_blob_conditional_download(bucket):
+    blob = upload(bucket, 'a.jpg', b'v1', generation=1000)
+    with pytest.raises(NotModified):
+        blob.download_as_bytes(if_generation_not_match=1000)
+    assert blob.download_as_bytes(if_generation_not_match=999) == b'v1'
+    with pytest.raises(NotFound):
+        blob.download_as_bytes(if_generation_match=999)
+
+
+def test_local_bucket_list_blobs(bucket):
+    for name in ('x/2.jpg', 'x/1.jpg', 'y/1.jpg'):
+        upload(bucket, name, b'.')
+    assert [b.name for b in bucket.list_blobs()] == ['x/1.jpg', 'x/2.jpg', 'y/1.jpg']
+    assert [b.name for b in bucket.list_blobs(prefix='x/', max_results=1)] == ['x/1.jpg']
+
+
+def test_image_cache_hit_after_miss(bucket, tmp_path):
+    cache = BlobCache(str(tmp_path / 'cache'), revalidate_seconds=60)
+    upload(bucket, 'a.jpg', b'v1', generation=1000)
+    assert cache.get(bucket, 'a.jpg') == b'v1'
+    assert cache.get(bucket, 'a.jpg') == b'v1'
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits'], stats['memory_hits'], stats['revalidations']) == (1, 1, 1, 0)
+
+
+def test_image_cache_revalidates_by_generation(bucket, tmp_path):
+    cache = BlobCache(str(tmp_path / 'cache'), revalidate_seconds=0)
+    upload(bucket, 'a.jpg', b'v1', generation=1000)
+    assert cache.get(bucket, 'a.jpg') == b'v1'
+
+    # Unchanged: a conditional download answers NotModified and the cached bytes are served
+    assert cache.get(bucket, 'a.jpg') == b'v1'
+    stats = cache.stats()
+    assert (stats['revalidations'], stats['not_modified'], stats['hits']) == (1, 1, 1)
+
+    # Re-uploaded: the new generation is downloaded and replaces the old file
+    upload(bucket, 'a.jpg', b'v2', generation=2000)
+    assert cache.get(bucket, 'a.jpg') == b'v2'
+    assert cache.current_generation(bucket, 'a.jpg') == (True, 2000)
+    files = [name for name in os.listdir(tmp_path / 'cache') if not name.startswith('.')]
+    assert len(files) == 1 and files[0].endswith('-2000')
+
+
+def test_image_cache_missing_and_deleted_blobs(bucket, tmp_path):
+    cache = BlobCache(str(tmp_path / 'cache'), revalidate_seconds=0)
+    assert cache.get(bucket, 'missing.jpg') is None
+    blob = upload(bucket, 'a.jpg', b'v1', generation=1000)
+    cache.get(bucket, 'a.jpg')
+    os.remove(blob.path)
+    assert cache.get(bucket, 'a.jpg') is None
+    assert cache.current_generation(bucket, 'a.jpg') == (False, None)
+    assert cache.stats()['entries'] == 0
+
+
+def test_image_cache_disk_budget_and_restart(bucket, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache = BlobCache(cache_dir, memory_bytes=0, disk_bytes=25, revalidate_seconds=60)
+    for i in range(3):
+        upload(bucket, f'{i}.jpg', bytes(10), generation=1000 + i)
+        cache.get(bucket, f'{i}.jpg')
+    stats = cache.stats()
+    assert (stats['entries'], stats['disk_bytes'], stats['evictions']) == (2, 20, 1)
+
+    # A new process rebuilds the index from disk and revalidates before serving
+    restarted = BlobCache(cache_dir, memory_bytes=0, disk_bytes=25, revalidate_seconds=60)
+    assert restarted.stats()['entries'] == 2
+    assert restarted.get(bucket, '2.jpg') == bytes(10)
+    stats = restarted.stats()
+    assert (stats['revalidations'], stats['not_modified'], stats['disk_hits']) == (1, 1, 1)
+
+
+def test_image_cache_directory_shared_between_processes(bucket, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first = BlobCache(cache_dir, memory_bytes=0, disk_bytes=25, revalidate_seconds=60)
+    second = BlobCache(cache_dir, memory_bytes=0, disk_bytes=25, revalidate_seconds=60)
+    upload(bucket, 'a.jpg', bytes(10), generation=1000)
+    first.get(bucket, 'a.jpg')
+
+    # The other process finds the file and only revalidates it
+    assert second.get(bucket, 'a.jpg') == bytes(10)
+    stats = second.stats()
+    assert (stats['misses'], stats['not_modified'], stats['disk_hits']) == (0, 1, 1)
+
+    # Its newer generation replaces the file the first process stored ...
+    upload(bucket, 'a.jpg', bytes(11), generation=2000)
+    second.revalidate_seconds = 0
+    assert second.get(bucket, 'a.jpg') == bytes(11)
+    # ... which the first process notices instead of serving a missing file
+    first.revalidate_seconds = 0
+    assert first.get(bucket, 'a.jpg') == bytes(11)
+    assert first.current_generation(bucket, 'a.jpg') == (True, 2000)
+
+    # Both processes count against one disk budget
+    upload(bucket, 'b.jpg', bytes(10), generation=1000)
+    upload(bucket, 'c.jpg', bytes(10), generation=1000)
+    first.get(bucket, 'b.jpg')
+    second.get(bucket, 'c.jpg')
+    assert first.stats()['disk_bytes'] <= 25 and second.stats()['evictions'] == 1
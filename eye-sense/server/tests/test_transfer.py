@@ -0,0 +1,133 @@
+"""BulkTransfer against the directory-backed LocalBucket."""
+import threading
+import time
+
+import pytest
+
+from routes import transfer
+from routes.gcs import LocalBucket, NotFound
+from routes.transfer import BulkTransfer, with_retry
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    bucket = LocalBucket('images', root=str(tmp_path))
+    for i in range(6):
+        bucket.blob(f'img/{i}.jpg').upload_from_string(bytes([i]) * (i + 1))
+    return bucket
+
+
+class FlakyBlob:
+    """Wraps a LocalBlob; the first `failures` downloads raise a transient error."""
+
+    def __init__(self, blob, failures, error=ConnectionError):
+        self.blob = blob
+        self.name = blob.name
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def download_as_bytes(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("transient")
+        return self.blob.download_as_bytes()
+
+
+def test_with_retry_retries_only_retryable_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError("slow")
+        return "ok"
+
+    retried = []
+    assert with_retry(flaky, retries=3, backoff_seconds=0, on_retry=lambda: retried.append(1)) == "ok"
+    assert len(calls) == 3 and len(retried) == 2
+
+
+
+def test_with_retry_gives_up():
+    calls = []
+
+    def fail(error):
+        calls.append(1)
+        raise error
+
+    with pytest.raises(ValueError):
+        with_retry(lambda: fail(ValueError("bad")), retries=3, backoff_seconds=0)
+    assert len(calls) == 1  # not retryable
+    with pytest.raises(ConnectionError):
+        with_retry(lambda: fail(ConnectionError("down")), retries=2, backoff_seconds=0)
+    assert len(calls) == 4
+
+
+def test_download_retries_injected_transient_error(bucket):
+    blob = FlakyBlob(bucket.blob('img/3.jpg'), failures=2)
+    with BulkTransfer(workers=2, retries=3, backoff_seconds=0) as bulk:
+        assert bulk.download(blob).result() == bytes([3]) * 4
+    assert blob.calls == 3
+    assert bulk.stats.counters['retries'] == 2 and bulk.stats.counters['failures'] == 0
+
+
+def test_download_all_records_failures_and_keeps_going(bucket):
+    blobs = list(transfer.iter_blobs(bucket, prefix='img/'))
+    blobs[1] = FlakyBlob(blobs[1], failures=10)                 # transient, but never recovers
+    blobs[4] = FlakyBlob(blobs[4], failures=1, error=NotFound)  # not retryable
+    with BulkTransfer(workers=3, retries=2, backoff_seconds=0) as bulk:
+        got = [(blob.name, data) for blob, data in bulk.download_all(blobs)]
+    assert [name for name, _ in got] == ['img/0.jpg', 'img/2.jpg', 'img/3.jpg', 'img/5.jpg']
+    assert got[-1][1] == bytes([5]) * 6
+    assert sorted(name for name, _ in bulk.stats.failed) == ['img/1.jpg', 'img/4.jpg']
+    assert bulk.stats.counters['failures'] == 2 and bulk.stats.counters['downloads'] == 4
+
+
+def test_errors_in_the_callers_loop_are_not_swallowed(bucket):
+    with BulkTransfer(workers=2, backoff_seconds=0) as bulk:
+        with pytest.raises(RuntimeError):
+            for _ in bulk.download_all(transfer.iter_blobs(bucket)):
+                raise RuntimeError("caller bug")
+
+
+def test_in_flight_transfers_are_bounded():
+    """Submitting blocks once max_in_flight transfers are queued or running."""
+    release = threading.Event()
+    lock = threading.Lock()
+    started = []
+
+    class BlockedBlob:
+        def __init__(self, name):
+            self.name = name
+
+        def download_as_bytes(self):
+            with lock:
+                started.append(self.name)
+            release.wait(5)
+            return b'.'
+
+    bulk = BulkTransfer(workers=1, max_in_flight=2, backoff_seconds=0)
+    submitted = []
+
+    def submit_all():
+        for i in range(5):
+            submitted.append(bulk.download(BlockedBlob(f'{i}.jpg')))
+
+    thread = threading.Thread(target=submit_all)
+    thread.start()
+    time.sleep(0.1)
+    assert len(submitted) == 2 and len(started) == 1
+    release.set()
+    thread.join(5)
+    assert all(f.result() == b'.' for f in submitted)
+    bulk.close()
+    assert len(submitted) == 5 and len(started) == 5
+
+
+def test_upload_round_trip(bucket):
+    with BulkTransfer(workers=2, backoff_seconds=0) as bulk:
+        url = bulk.upload(bucket, 'out/a.png', b'png bytes', content_type='image/png').result()
+    assert url.endswith('/images/out/a.png')
+    assert bucket.blob('out/a.png').download_as_bytes() == b'png bytes'
+    assert bulk.stats.counters['uploads'] == 1 and bulk.stats.counters['bytes_up'] == 9
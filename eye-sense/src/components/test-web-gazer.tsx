@@ -1,5 +1,11 @@
 import { useEffect, useRef, useState } from "react";
-import { getHeatmapFromGazeData } from "../controllers/heatmap-controller";
+import {
+  appendGazeChunk,
+  closeGazeSession,
+  getHeatmapFromGazeData,
+  getSessionHeatmap,
+  openGazeSession,
+} from "../controllers/heatmap-controller";
 import "../web-gazer.scss";
 import "../App.scss";
 import { GazeDataCoordinate } from "../types";
@@ -37,6 +43,7 @@ const TestWebGazer = ({
   ];
   const clicksRequired = 1;
   const gazeData: GazeDataCoordinate[] = [];
+  const gazeChunkMs = 1000;
 
   const [currentClicks, setCurrentClicks] = useState<number[]>(
     Array(9).fill(0) // Initialize all clicks to 0
@@ -55,6 +62,49 @@ const TestWebGazer = ({
   const gazeDot = useRef<HTMLDivElement>(null);
   const trackingImage = useRef<HTMLImageElement>(null);
 
+  // Gaze is streamed to a server-side session while tracking, so the heatmap
+  // is ready when tracking stops instead of being built from the whole log.
+  // Uploads are chained so the final fetch sees every chunk.
+  const gazeSession = useRef<{
+    sessionId: string | null;
+    sent: number;
+    failed: boolean;
+    uploads: Promise<void>;
+    timer?: ReturnType<typeof setInterval>;
+  }>({ sessionId: null, sent: 0, failed: false, uploads: Promise.resolve() });
+
+  const flushGazeData = () => {
+    const session = gazeSession.current;
+    session.uploads = session.uploads.then(async () => {
+      if (session.failed || session.sent === gazeData.length) return;
+      if (!session.sessionId) {
+        // The image is only laid out once loading has finished
+        if (!trackingImage.current) return;
+        const opened = await openGazeSession({
+          filename: getFilenameFromSignedUrl(imageUrl),
+          width: trackingImage.current.scrollWidth,
+          height: trackingImage.current.scrollHeight,
+        });
+        if (!opened) {
+          session.failed = true;
+          return;
+        }
+        session.sessionId = opened.sessionId;
+      }
+      const end = gazeData.length;
+      const appended = await appendGazeChunk(
+        session.sessionId,
+        gazeData.slice(session.sent, end)
+      );
+      if (!appended) {
+        session.failed = true;
+        return;
+      }
+      session.sent = end;
+    });
+    return session.uploads;
+  };
+
   const clickDot = (index: number, xPercent: number, yPercent: number) => {
     const x = window.innerWidth * (xPercent / 100);
     const y = window.innerHeight * (yPercent / 100);
@@ -114,6 +164,8 @@ const TestWebGazer = ({
 
     console.log(window.webgazer);
 
+    gazeSession.current.timer = setInterval(flushGazeData, gazeChunkMs);
+
     setTimeout(() => {
       stopTrackingPhase();
     }, 10000); // Track for 10 seconds
@@ -127,6 +179,7 @@ const TestWebGazer = ({
     window.webgazer.clearGazeListener();
     window.webgazer.end();
     // window.webgazer.pause().showVideo(false).showPredictionPoints(false);
+    clearInterval(gazeSession.current.timer);
 
     try {
       const width = trackingImage.current.scrollWidth;
@@ -135,12 +188,22 @@ const TestWebGazer = ({
       console.log("imageUrl:", imageUrl);
       const filename = getFilenameFromSignedUrl(imageUrl);
 
-      const response = await getHeatmapFromGazeData({
-        gazeData,
-        width,
-        height,
-        filename,
-      });
+      await flushGazeData();
+      const { sessionId, failed } = gazeSession.current;
+      let response = null;
+      if (sessionId) {
+        if (!failed) response = await getSessionHeatmap(sessionId);
+        closeGazeSession(sessionId);
+      }
+      if (!response) {
+        // The session could not be used; post the whole log instead
+        response = await getHeatmapFromGazeData({
+          gazeData,
+          width,
+          height,
+          filename,
+        });
+      }
 
       const heatmapBlob = response.heatmapBlob;
 
@@ -3,38 +3,145 @@ import axios from "axios";
 
 const API_URL = "http://localhost:5000/api/v1/heatmaps";
 
+// The last few rendered heatmaps, keyed by a SHA-256 of the request, with the
+// server's ETag, so repeat requests can be answered with a 304 instead of
+// re-sending the image. A Map iterates in insertion order, so re-inserting on
+// every hit keeps the least recently used entry first.
+const HEATMAP_CACHE_SIZE = 16;
+const heatmapCache = new Map<string, { etag: string; blob: Blob }>();
+
+const heatmapCacheGet = (key: string) => {
+  const entry = heatmapCache.get(key);
+  if (entry) {
+    heatmapCache.delete(key);
+    heatmapCache.set(key, entry);
+  }
+  return entry;
+};
+
+const heatmapCacheSet = (key: string, entry: { etag: string; blob: Blob }) => {
+  heatmapCache.delete(key);
+  heatmapCache.set(key, entry);
+  while (heatmapCache.size > HEATMAP_CACHE_SIZE) {
+    heatmapCache.delete(heatmapCache.keys().next().value as string);
+  }
+};
+
+// Hex SHA-256 of the parts concatenated; strings are hashed as UTF-8
+const sha256Hex = async (...parts: (string | ArrayBuffer)[]) => {
+  const chunks = parts.map((part) =>
+    typeof part === "string"
+      ? new TextEncoder().encode(part)
+      : new Uint8Array(part)
+  );
+  const bytes = new Uint8Array(
+    chunks.reduce((length, chunk) => length + chunk.length, 0)
+  );
+  let offset = 0;
+  chunks.forEach((chunk) => {
+    bytes.set(chunk, offset);
+    offset += chunk.length;
+  });
+  const digest = await crypto.subtle.digest("SHA-256", bytes);
+  return Array.from(new Uint8Array(digest), (b) =>
+    b.toString(16).padStart(2, "0")
+  ).join("");
+};
+
+// Packed gaze wire format (see server/routes/gaze_codec.py): 12-byte header,
+// interleaved little-endian int16 x,y pairs, then float32 times, all
+// delta-encoded. Roughly 10x smaller than the JSON-in-JSON body. Times are
+// sent relative to the first sample: an epoch timestamp in ms does not fit a
+// float32 (it would be off by minutes), a session offset does.
+const GAZE_CONTENT_TYPE = "application/x-gaze";
+const GAZE_FLAG_TIME = 1;
+const GAZE_FLAG_DELTA = 2;
+
+export const encodeGazeData = (gazeData: GazeDataCoordinate[]) => {
+  const count = gazeData.length;
+  const buffer = new ArrayBuffer(12 + count * 4 + count * 4);
+  const view = new DataView(buffer);
+  ["G", "A", "Z", "E"].forEach((c, i) => view.setUint8(i, c.charCodeAt(0)));
+  view.setUint8(4, 1); // version
+  view.setUint8(5, GAZE_FLAG_TIME | GAZE_FLAG_DELTA);
+  view.setUint8(6, 0); // int16 x/y
+  view.setUint8(7, 0);
+  view.setUint32(8, count, true);
+
+  let prevX = 0;
+  let prevY = 0;
+  // Starting from t0 makes the first time delta 0 and every decoded time relative to t0
+  let prevTime = count ? gazeData[0].time : 0;
+  gazeData.forEach(({ x, y, time }, i) => {
+    // floor (not truncate) so slightly negative points stay out of bounds
+    const px = Math.max(-32768, Math.min(32767, Math.floor(x)));
+    const py = Math.max(-32768, Math.min(32767, Math.floor(y)));
+    view.setInt16(12 + i * 4, px - prevX, true);
+    view.setInt16(12 + i * 4 + 2, py - prevY, true);
+    view.setFloat32(12 + count * 4 + i * 4, time - prevTime, true);
+    prevX = px;
+    prevY = py;
+    prevTime = time;
+  });
+  return buffer;
+};
+
 export const getHeatmapFromGazeData = async ({
   gazeData,
   width,
   height,
   filename,
+  packed = true,
 }: {
   gazeData: GazeDataCoordinate[];
   width: number;
   height: number;
   filename: string;
+  packed?: boolean;
 }) => {
   try {
-    const gazeDataStr: string = JSON.stringify(gazeData);
-
-    const response = await axios.post(
-      API_URL + `/`,
-      {
-        gazeDataStr,
-        width,
-        height,
-        filename,
-      },
-      {
-        responseType: "blob",
-      }
+    // Encoded once: the same bytes are hashed for the cache key and sent
+    const gazePayload = packed
+      ? encodeGazeData(gazeData)
+      : JSON.stringify(gazeData);
+    const cacheKey = await sha256Hex(
+      JSON.stringify({ width, height, filename, packed }),
+      gazePayload
     );
+    const cached = heatmapCacheGet(cacheKey);
+    const config = {
+      responseType: "blob" as const,
+      validateStatus: (status: number) =>
+        (status >= 200 && status < 300) || status === 304,
+    };
+    const conditional = cached ? { "If-None-Match": cached.etag } : {};
+
+    const response =
+      typeof gazePayload !== "string"
+        ? await axios.post(API_URL + `/`, gazePayload, {
+            ...config,
+            params: { filename, width, height },
+            headers: { ...conditional, "Content-Type": GAZE_CONTENT_TYPE },
+          })
+        : await axios.post(
+            API_URL + `/`,
+            { gazeDataStr: gazePayload, width, height, filename },
+            { ...config, headers: conditional }
+          );
 
     // const heatmapUrl = URL.createObjectURL(response.data);
 
     // return { heatmapUrl }; // should return { heatmapUrl: 'data:image/png;base64,...' }
 
+    if (response.status === 304 && cached) {
+      return { heatmapBlob: cached.blob };
+    }
+
     const heatmapBlob = response.data;
+    const etag = response.headers["etag"];
+    if (etag) {
+      heatmapCacheSet(cacheKey, { etag, blob: heatmapBlob });
+    }
     return { heatmapBlob };
   } catch (error) {
     console.log("Error generating heatmap:", error);
@@ -42,6 +149,8 @@ export const getHeatmapFromGazeData = async ({
   }
 };
 
+// Submits the image as a background bot job, then long-polls for the result
+// so no server request worker is held for the whole pipeline run.
 export const generateExpertHeatmap = async (image: File) => {
   if (!image) return null;
 
@@ -49,18 +158,87 @@ export const generateExpertHeatmap = async (image: File) => {
     const formData = new FormData();
     formData.append("image", image);
 
-    const response = await axios.post(API_URL + `/bot/`, formData, {
-      responseType: "blob",
+    const submitted = await axios.post(API_URL + `/bot/jobs/`, formData, {
       headers: {
         "Content-Type": "multipart/form-data",
       },
     });
+    const { jobId } = submitted.data as { jobId: string };
 
-    const expertHeatmapUrl = URL.createObjectURL(response.data);
-    return { heatmapUrl: expertHeatmapUrl }
-    // return response.data;
+    for (;;) {
+      const response = await axios.get(
+        API_URL + `/bot/jobs/${jobId}/result?wait=25`,
+        { responseType: "blob" }
+      );
+      if (response.status === 202) continue;
+
+      const expertHeatmapUrl = URL.createObjectURL(response.data);
+      return { heatmapUrl: expertHeatmapUrl };
+    }
   } catch (error) {
     console.error(`Error generating expert heatmap`, error);
     return null;
   }
-}
\ No newline at end of file
+};
+
+// Incremental gaze sessions: open once, append chunks as WebGazer produces
+// them, and fetch the running heatmap whenever it is needed.
+export const openGazeSession = async ({
+  filename,
+  width,
+  height,
+}: {
+  filename: string;
+  width: number;
+  height: number;
+}) => {
+  try {
+    const response = await axios.post(API_URL + `/sessions/`, {
+      filename,
+      width,
+      height,
+    });
+    return response.data as { sessionId: string };
+  } catch (error) {
+    console.log("Error opening gaze session:", error);
+    return null;
+  }
+};
+
+export const appendGazeChunk = async (
+  sessionId: string,
+  gazeData: GazeDataCoordinate[]
+) => {
+  try {
+    const response = await axios.post(
+      API_URL + `/sessions/${sessionId}/points`,
+      encodeGazeData(gazeData),
+      { headers: { "Content-Type": GAZE_CONTENT_TYPE } }
+    );
+    return response.data as { points: number; version: number };
+  } catch (error) {
+    console.log("Error appending gaze data:", error);
+    return null;
+  }
+};
+
+export const getSessionHeatmap = async (sessionId: string) => {
+  try {
+    const response = await axios.get(API_URL + `/sessions/${sessionId}`, {
+      responseType: "blob",
+    });
+    const heatmapBlob = response.data;
+    return { heatmapBlob };
+  } catch (error) {
+    console.log("Error fetching session heatmap:", error);
+    return null;
+  }
+};
+
+export const closeGazeSession = async (sessionId: string) => {
+  try {
+    await axios.delete(API_URL + `/sessions/${sessionId}`);
+  } catch (error) {
+    console.log("Error closing gaze session:", error);
+  }
+};